@@ -24,3 +24,7 @@ class Partito(metaclass=comb_p, **conf):
 
     def filter(self, district, *, total, row, dataframe, sbarramenti, **kwargs):
         return True
+
+    @classmethod
+    def filter_batch(cls, district, *, total, dataframe, rows, sbarramenti, **kwargs):
+        return pd.Series(True, index=dataframe.index)
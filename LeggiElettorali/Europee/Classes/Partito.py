@@ -5,9 +5,20 @@ conf = """
 metaclasses:
   - logger # aggiunge automaticamente una funzione log
   - subclass
+  - totFilter
 
 subclass:
     - PolEnt
+
+filters:
+  elette: # soglia del 4% dei voti nazionali
+    levels: [Nazione]
+    filter:
+      type: value
+      column: Voti
+      logic: relative
+      criteria: gt
+      target: 0.04
 """
 
 conf = yaml.safe_load(conf)
@@ -18,19 +29,34 @@ metas_p
 comb_p = type("combPol", tuple(metas_p), {})
 
 
+def preference_ranking(hub):
+    """
+    Indice (partito, circoscrizione): candidati della lista nella circoscrizione
+    in ordine di voti, dai log della lane 'lista' di tutti i candidati. A parità
+    di voti i candidati sono in ordine di nome, i sottostanti dell'Hub non hanno
+    un ordine
+    """
+    rows = {}
+    for p in hub.get_instances("Partito"):
+        partito = hub.get_instance("Partito", p)
+        candidati = sorted(hub.get_political_subs(partito, "Candidato", actual=True), key=lambda c: c.name)
+        for c in candidati:
+            for log in c.logs.get('lista', {}).values():
+                voti, cand = rows.setdefault((p, log.get('Circoscrizione')), ([], []))
+                voti.append(log['Voti'])
+                cand.append(c)
+
+    ranking = {}
+    for k, (voti, cand) in rows.items():
+        df = pd.DataFrame({'Voti': voti, 'Nome': [c.name for c in cand], 'Candidato': cand})
+        ranking[k] = df.sort_values(['Voti', 'Nome'], kind='stable')['Candidato'].to_numpy()
+    return ranking
+
+
 class Partito(metaclass=comb_p, **conf):
     def elect(self, lane, district, seats, **info):
-        candidati = src.GlobalVars.Hub.get_political_subs(self, "Candidato", actual=True)
-        df_t = []
-        for c in candidati:
-            df = c.get_log('lista')
-            df['Candidato'] = c
-            df_t.append(df)
-
-        df = pd.concat(df_t, sort=True)
-        ord = df[df['Circoscrizione'] == district.name].sort_values('Voti')
-        #print(ord)
-        it = iter(ord['Candidato'])
+        ranking = src.GlobalVars.Hub.get_index('preferenze_liste', preference_ranking)
+        it = iter(ranking[(self.name, district.name)])
         ret =  []
         for i in range(seats):
             c = next(it)
@@ -38,13 +64,3 @@ class Partito(metaclass=comb_p, **conf):
             if n is not None:
                 ret.append(n)
         return ret
-
-    def filter(self, district, *, total, row, dataframe, sbarramenti, **kwargs):
-        if sbarramenti[0] == 'elette':
-            #print("Filtering elette", total, row, dataframe, district)
-            if district.type != 'Nazione':
-                return True
-            tot_voti = dataframe['Voti'].sum()
-            p_voti = row['Voti']
-            return p_voti > tot_voti*0.04
-        return True
@@ -1,13 +1,13 @@
-import pandas as pd
-import numpy as np
 import yaml
 
 
+# totFilter genera filter e filter_batch dalla conf filters
 conf = """
 metaclasses:
     - logger
     - PolEnt
     - party
+    - totFilter
 
 subclass:
     - PolEnt
@@ -19,6 +19,71 @@ party:
     info_vars:
         - coalition
 
+filters:
+  # solo i partiti che si sono presentati unicamente in una di queste due
+  # regioni ricevono un filtro regionale (20% dei voti della regione),
+  # le altre regioni non lo prevedono
+  regione:
+    levels: [Nazione]
+    filter:
+      and:
+        - type: membership
+          column: Regione
+          values: [TRENTINO-ALTO ADIGE, FRIULI-VENEZIA GIULIA]
+        - type: value
+          column: Voti
+          group: [Partito]
+          aggregate: size
+          criteria: eq
+          target: 1
+        - type: value
+          column: Voti
+          group: [Partito]
+          logic: relative
+          relative_to: [Regione]
+          criteria: gt
+          target: 0.2
+
+  # i partiti che si sono presentati nelle circoscrizioni estere devono
+  # superare il 4% dei voti esteri
+  elette_estero:
+    levels: [Estero]
+    filter:
+      type: value
+      column: Voti
+      group: [Lista]
+      logic: relative
+      criteria: gt
+      target: 0.04
+
+  # sbarramento nazionale: passano i partiti di una coalizione (NO COALIZIONE
+  # non è una coalizione) che ha superato il 10% e quelli che superano il 4%
+  elette_nazione:
+    levels: [Nazione]
+    filter:
+      or:
+        - type: value
+          column: Voti
+          group: [Partito]
+          logic: relative
+          criteria: gt
+          target: 0.04
+        - and:
+          - not:
+              type: membership
+              column: Coalizione
+              values: [NO COALIZIONE]
+          - type: value
+            column: Voti
+            group: [Coalizione]
+            logic: relative
+            criteria: gt
+            target: 0.1
+
+  # ogni filtro passa tutte le righe fuori dai suoi levels
+  elette:
+    and: [elette_estero, elette_nazione]
+
 """
 
 conf = yaml.safe_load(conf)
@@ -30,83 +95,4 @@ comb_p = type("combPol", tuple(metas_p), {})
 
 
 class Partito(metaclass=comb_p, **conf):
-
-    
-    def filter(self, district, *, total, row, dataframe, sbarramenti, **kwargs):
-        # il dataframe ha le colonne : LISTA COALIZIONE VOTI
-
-        if sbarramenti[0] == 'regione' and district.type == 'Nazione' :
-
-            # solo i partiti che stanno in queste due regione ricevono un
-            # filtro regionale, le altre regioni non lo prevedono
-            if row['Regione'] == 'TRENTINO-ALTO ADIGE' or row['Regione'] == 'FRIULI-VENEZIA GIULIA' :
-
-                # prendo tutte le righe del partito nelle diverse regioni
-                # se riga_cercata ha solo una riga allora il partito si è presentato
-                # unicamente in una regione (tra trentino e friuli)
-                riga_cercata = dataframe[dataframe['Partito'] == row['Partito']]
-
-                if len(riga_cercata.index) == 1 :
-                    tot_voti_regione = dataframe[dataframe['Regione'] == row['Regione']]['Voti'].sum()
-                    tot_voti_partito = riga_cercata['Voti'].sum()
-
-                    self.percRegione = (tot_voti_partito / tot_voti_regione) * 100
-
-                    return tot_voti_partito > tot_voti_regione * 0.2
-            else :
-                self.percRegione = 0.0
-            
-            return False
-
-        # questo è il filtro per lo sbarramento dei partiti che si sono 
-        # presentati nelle circoscrizioni estere, bisogna controllare solamente
-        # se passano il 4% dei voti esteri #     
-        if sbarramenti[0] == 'elette' and district.type == 'Estero':
-            tot_voti = dataframe['Voti'].sum()
-
-            solo_righe_partito = dataframe[dataframe['Lista'] == row['Lista']]
-            tot_voti_partito = solo_righe_partito['Voti'].sum()
-
-            return tot_voti_partito > tot_voti * 0.04
-            
-        
-        # filtro che implementa lo sbarramenti a livello nazionale per i partiti,
-        # controllando se fanno parte di una coalizione che ha superato la rispettiva
-        # soglia di sbarramento.
-        # in caso non faccia parte di una coalizione o nel caso la coalizione non passi
-        # il rispettivo sbarramento allora devo controllare se il partito passa lo sbarramento
-        # del 4% dei voti totali nazionali #
-        if sbarramenti[0] == 'elette' and district.type == 'Nazione':
-
-            tot_voti = dataframe['Voti'].sum()
-            # calcolo il numero di voti totali del partito
-            solo_righe_partito = dataframe[dataframe['Partito'] == row['Partito']]
-            tot_voti_partito = solo_righe_partito['Voti'].sum()
-
-            self.percNazione = (tot_voti_partito / tot_voti) * 100
-            self.votiPartito = tot_voti_partito
-
-            # questo controllo viene effettuato solo se il partito
-            # sta effettivamente dentro ad una coalizione
-            #
-            # NO COALIZIONE non è una coalizione
-            if row['Coalizione'] != 'NO COALIZIONE' :
-
-                # calcolo il numero di voti totali della coalizione
-                solo_righe_coalizione = dataframe[dataframe['Coalizione'] == row['Coalizione']]
-                tot_voti_coalizione = solo_righe_coalizione['Voti'].sum()
-
-                if tot_voti_coalizione > tot_voti * 0.1 :
-                    return True
-            
-            # se la coalizione non è passata, o se non stava in coalizione,
-            # allora controllo direttamente se ha passato il 4% dei voti
-            # validi #
-            return tot_voti_partito > tot_voti * 0.04
-
-        return True
-
-    
-
-
-
+    pass
@@ -0,0 +1,185 @@
+"""
+Metodi di ripartizione dei seggi su array numpy.
+
+Tutte le funzioni accettano:
+    + votes: array di interi, 1D (un distretto, un valore per partito) oppure
+        2D (distretti x partiti) per ripartire molti distretti in una sola chiamata
+    + seats: il numero di seggi, un intero oppure un array con un valore per distretto
+
+e restituiscono un array di interi della stessa forma di votes con i seggi.
+
+Parità: a parità di resto (o di quoziente) vince il partito con più voti,
+a parità di voti quello con l'indice (colonna) minore. I resti sono confrontati
+in aritmetica intera, quindi il risultato non dipende da arrotondamenti.
+I distretti senza voti non ricevono seggi.
+"""
+import numpy as np
+
+
+def _as_batch(votes, seats):
+    votes = np.asarray(votes, dtype=np.int64)
+    single = votes.ndim == 1
+    votes = np.atleast_2d(votes)
+    seats = np.broadcast_to(np.asarray(seats, dtype=np.int64), votes.shape[:1]).copy()
+    seats[votes.sum(axis=1) == 0] = 0
+    return votes, seats, single
+
+
+def _ranks(*keys):
+    """
+    keys: array 2D, dal meno al più importante (come np.lexsort), ordinati in modo crescente
+
+    Restituisce per ogni elemento la posizione nell'ordinamento della sua riga
+    """
+    order = np.lexsort(keys, axis=-1)
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(order.shape[1])[None, :], axis=1)
+    return ranks
+
+
+def largest_remainder(votes, seats, quota='hare'):
+    """
+    Metodo dei quozienti e dei più alti resti
+
+    quota:
+        + hare: voti / seggi
+        + hare_intero: la parte intera di voti / seggi (il quoziente intero delle leggi italiane)
+        + droop: la parte intera di voti / (seggi + 1), più uno
+        + imperiali: voti / (seggi + 2)
+
+    Il quoziente è una frazione num / den uguale per tutto il distretto, i seggi
+    pieni sono v * den // num e il resto v * den % num.
+
+    Seggi in eccesso: con imperiali e hare_intero i quozienti pieni possono
+    superare i seggi (ad esempio [23, 8] con 22 seggi: quoziente 1, 31 quozienti
+    pieni). Come per i seggi eccedenti delle leggi italiane i seggi in più sono
+    tolti uno alla volta a partire dal partito con il resto minore (a parità di
+    resto quello con meno voti, poi quello con l'indice maggiore), tra i partiti
+    che hanno almeno un seggio, a giro: in una passata ogni partito perde al più
+    un seggio, se l'eccesso è maggiore del numero di partiti si ricomincia.
+    Nell'esempio i resti sono tutti 0: a ogni passata perdono un seggio prima
+    il partito da 8 voti e poi quello da 23, il risultato è [19, 3].
+    """
+    votes, seats, single = _as_batch(votes, seats)
+    total = votes.sum(axis=1)
+
+    if quota == 'hare':
+        num, den = total, seats
+    elif quota == 'hare_intero':
+        num, den = total // np.maximum(seats, 1), np.ones_like(seats)
+    elif quota == 'droop':
+        num, den = total // (seats + 1) + 1, np.ones_like(seats)
+    elif quota == 'imperiali':
+        num, den = total, seats + 2
+    else:
+        raise KeyError(f"Unknown quota: {quota}")
+
+    num = np.maximum(num, 1)[:, None]
+    den = den[:, None]
+    full, rest = np.divmod(votes * den, num)
+    full[seats == 0] = 0
+    rest[seats == 0] = 0
+
+    parties = np.broadcast_to(np.arange(votes.shape[1]), votes.shape)
+    left = seats - full.sum(axis=1)
+
+    # seggi in eccesso: si tolgono a partire dal resto minore, tra chi ne ha almeno uno
+    # (uno per partito a ogni passata, con un solo partito possono servire più passate)
+    excess = np.maximum(-left, 0)
+    while excess.any():
+        ranks = _ranks(-parties, votes, rest, full == 0)
+        take = (ranks < excess[:, None]) & (full > 0)
+        full -= take
+        excess -= take.sum(axis=1)
+    left = np.maximum(left, 0)
+
+    # seggi rimanenti: ai resti maggiori
+    rounds, left = np.divmod(left, votes.shape[1])
+    ranks = _ranks(parties, -votes, -rest)
+    full += rounds[:, None] + (ranks < left[:, None])
+
+    return full[0] if single else full
+
+
+def _divisors(method, n):
+    k = np.arange(n, dtype=np.float64)
+    if method == 'dhondt':
+        return k + 1
+    if method == 'sainte_lague':
+        return 2 * k + 1
+    if method == 'sainte_lague_modificato':
+        d = 2 * k + 1
+        d[:1] = 1.4
+        return d
+    raise KeyError(f"Unknown divisor method: {method}")
+
+
+def highest_averages(votes, seats, method='dhondt'):
+    """
+    Metodo dei divisori (dhondt, sainte_lague, sainte_lague_modificato)
+
+    Per ogni distretto si calcolano tutti i quozienti voti / divisore e si
+    assegnano i seggi ai maggiori. I quozienti sono in virgola mobile a doppia
+    precisione, sufficiente a distinguere due frazioni diverse con voti e
+    divisori realistici.
+    """
+    votes, seats, single = _as_batch(votes, seats)
+    d, p = votes.shape
+    m = max(int(seats.max(initial=0)), 1)
+
+    quotients = (votes[:, :, None] / _divisors(method, m)[None, None, :]).reshape(d, p * m)
+    parties = np.broadcast_to(np.repeat(np.arange(p), m), (d, p * m))
+    v = np.repeat(votes, m, axis=1)
+
+    chosen = _ranks(parties, -v, -quotients) < seats[:, None]
+    res = chosen.reshape(d, p, m).sum(axis=2)
+
+    return res[0] if single else res
+
+
+def hare(votes, seats):
+    return largest_remainder(votes, seats, 'hare')
+
+
+def hare_intero(votes, seats):
+    return largest_remainder(votes, seats, 'hare_intero')
+
+
+def droop(votes, seats):
+    return largest_remainder(votes, seats, 'droop')
+
+
+def imperiali(votes, seats):
+    return largest_remainder(votes, seats, 'imperiali')
+
+
+def dhondt(votes, seats):
+    return highest_averages(votes, seats, 'dhondt')
+
+
+def sainte_lague(votes, seats):
+    return highest_averages(votes, seats, 'sainte_lague')
+
+
+def sainte_lague_modificato(votes, seats):
+    return highest_averages(votes, seats, 'sainte_lague_modificato')
+
+
+METODI = {
+    'hare': hare,
+    'hare_intero': hare_intero,
+    'droop': droop,
+    'imperiali': imperiali,
+    'dhondt': dhondt,
+    'sainte_lague': sainte_lague,
+    'sainte_lague_modificato': sainte_lague_modificato,
+}
+
+
+def apportion(votes, seats, method='hare'):
+    """
+    Ripartisce seats tra i partiti con il metodo indicato (una chiave di METODI)
+    """
+    if method not in METODI:
+        raise KeyError(f"Unknown apportionment method: {method}")
+    return METODI[method](votes, seats)
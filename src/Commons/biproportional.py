@@ -0,0 +1,215 @@
+"""
+Ripartizione biproporzionale: data una matrice di voti distretti x partiti, i
+seggi di ogni distretto (righe) e quelli di ogni partito (colonne) trova la
+matrice intera dei seggi con il metodo dell'alternate scaling.
+
+Ogni passo è un metodo dei divisori applicato a tutte le righe (o a tutte le
+colonne) insieme: il divisore di ogni riga è cercato per bisezione, il costo
+di una passata è lineare nella dimensione della matrice.
+"""
+import numpy as np
+import pandas as pd
+
+from src.Commons.apportionment import hare
+
+ARROTONDAMENTI = {
+    'standard': 0.5,  # Sainte-Laguë
+    'down': 0.,  # D'Hondt
+}
+
+
+def _divisor_step(weights, targets, shift, iterations=200):
+    """
+    weights: matrice (n x m) di pesi non negativi
+    targets: i seggi di ogni riga
+    shift: 0.5 per l'arrotondamento standard, 0 per quello per difetto
+
+    Restituisce la matrice dei seggi, con la somma di ogni riga uguale a targets,
+    e il divisore di ogni riga. Le parità sono risolte a favore del peso maggiore
+    e poi dell'indice minore.
+    """
+    total = weights.sum(axis=1)
+    if ((total == 0) & (targets > 0)).any():
+        raise ValueError("Seats assigned to a row without votes")
+
+    safe = np.where(total > 0, total, 1.)
+    lo = safe / (targets + weights.shape[1] + 1)  # almeno targets seggi
+    hi = weights.max(axis=1, initial=0.) / (1 - shift) + 1.  # nessun seggio
+
+    def count(d):
+        return np.floor(weights / d[:, None] + shift).astype(np.int64)
+
+    for _ in range(iterations):
+        exact = count(lo).sum(axis=1) == targets
+        if (exact | (hi <= lo * (1 + 1e-12))).all():
+            break
+        mid = np.sqrt(lo * hi)
+        up = count(mid).sum(axis=1) >= targets
+        lo = np.where(up, mid, lo)
+        hi = np.where(up, hi, mid)
+
+    seats = count(hi)
+    exact = count(lo).sum(axis=1) == targets
+    seats[exact] = count(lo)[exact]
+
+    # parità: i pesi che cambiano seggio tra hi e lo sono equivalenti
+    missing = targets - seats.sum(axis=1)
+    if (missing > 0).any():
+        tied = count(lo) > seats
+        cols = np.broadcast_to(np.arange(weights.shape[1]), weights.shape)
+        order = np.lexsort((cols, -weights, ~tied), axis=-1)
+        ranks = np.empty_like(order)
+        np.put_along_axis(ranks, order, np.arange(order.shape[1])[None, :], axis=1)
+        seats += tied & (ranks < missing[:, None])
+
+    return seats, np.where(exact, lo, np.sqrt(lo * hi))
+
+
+def _tie_and_transfer(votes, seats, r, c, rows, shift, tol=1e-9):
+    """
+    Conclude l'alternate scaling quando si blocca: seats ha le colonne corrette,
+    r e c sono i divisori di righe e colonne. In scala logaritmica cerca un
+    cammino di celle in parità da una riga con seggi in eccesso a una in difetto
+    e sposta un seggio lungo il cammino, se non esiste cambia i divisori delle
+    righe e colonne raggiunte finché non si crea una nuova parità
+    """
+    pos = votes > 0
+    a = np.log(np.where(pos, votes, 1.))
+    rho, gam = np.log(r), np.log(c)
+    seats = seats.copy()
+
+    def signpost(k):
+        with np.errstate(divide='ignore'):
+            return np.log(np.maximum(k - shift, 0.))
+
+    while True:
+        diff = seats.sum(axis=1) - rows
+        if not diff.any():
+            return seats
+
+        q = a - rho[:, None] - gam[None, :]
+        lower = q - signpost(seats)
+        upper = signpost(seats + 1) - q
+        down = pos & (seats > 0) & (lower <= tol)  # può perdere un seggio
+        up = pos & (upper <= tol)  # può guadagnare un seggio
+
+        row_lab = diff > 0
+        col_lab = np.zeros(seats.shape[1], dtype=bool)
+        row_pred = np.full(seats.shape[0], -1)
+        col_pred = np.full(seats.shape[1], -1)
+        frontier = row_lab.copy()
+        target = -1
+        while frontier.any():
+            cand = down & frontier[:, None] & ~col_lab[None, :]
+            new_cols = cand.any(axis=0)
+            col_pred[new_cols] = cand[:, new_cols].argmax(axis=0)
+            col_lab |= new_cols
+
+            cand = up & new_cols[None, :] & ~row_lab[:, None]
+            new_rows = cand.any(axis=1)
+            row_pred[new_rows] = cand[new_rows].argmax(axis=1)
+            row_lab |= new_rows
+
+            hit = new_rows & (diff < 0)
+            if hit.any():
+                target = hit.argmax()
+                break
+            frontier = new_rows
+
+        if target >= 0:
+            i = target
+            while row_pred[i] >= 0:
+                j = row_pred[i]
+                seats[i, j] += 1
+                i = col_pred[j]
+                seats[i, j] -= 1
+            continue
+
+        free = ~col_lab[None, :]
+        delta = np.concatenate([lower[row_lab[:, None] & free & pos & (seats > 0)],
+                                upper[~row_lab[:, None] & ~free & pos]])
+        if len(delta) == 0 or not np.isfinite(delta.min()):
+            raise ValueError("Biproportional apportionment is not feasible")
+        rho[row_lab] += delta.min()
+        gam[col_lab] -= delta.min()
+
+
+def biproportional(votes, row_seats, col_seats, rounding='standard', max_iter=100):
+    """
+    votes: matrice (distretti x partiti) dei voti
+    row_seats: i seggi di ogni distretto
+    col_seats: i seggi di ogni partito
+    rounding: una chiave di ARROTONDAMENTI
+
+    Restituisce la matrice intera dei seggi, con le somme di righe e colonne
+    uguali a row_seats e col_seats. L'alternate scaling può bloccarsi a pochi
+    seggi dalla soluzione, in quel caso conclude _tie_and_transfer
+    """
+    votes = np.asarray(votes, dtype=np.float64)
+    rows = np.asarray(row_seats, dtype=np.int64)
+    cols = np.asarray(col_seats, dtype=np.int64)
+    if rows.sum() != cols.sum():
+        raise ValueError(f"Row seats ({rows.sum()}) and column seats ({cols.sum()}) differ")
+    shift = ARROTONDAMENTI[rounding]
+
+    c = np.ones(votes.shape[1])
+    best = None
+    for _ in range(max_iter):
+        seats, r = _divisor_step(votes / c[None, :], rows, shift)
+        if (seats.sum(axis=0) == cols).all():
+            return seats
+        seats_t, c = _divisor_step((votes / r[:, None]).T, cols, shift)
+        seats = seats_t.T
+        err = np.abs(seats.sum(axis=1) - rows).sum()
+        if err == 0:
+            return seats
+        if best is not None and err >= best:
+            break
+        best = err
+    return _tie_and_transfer(votes, seats, r, c, rows, shift)
+
+
+def correct_biproportional(distretto, distribuzione_ideale, distribuzione_raccolta,
+                           info_locali, *info_comuni, voti, colonna_distretto,
+                           colonna_partito='Partito', colonna_lista=None, colonna_voti='Voti',
+                           colonna_seggi='Seggi', seggi_distretti=None, arrotondamento='standard'):
+    """
+    Corrector per le lanes: ridistribuisce i seggi della distribuzione ideale
+    (per partito) tra i sottolivelli con il metodo biproporzionale
+
+    voti: dataframe con colonne colonna_distretto, colonna_partito, colonna_voti
+    seggi_distretti: dataframe colonna_distretto, colonna_seggi con i seggi di ogni
+        sottolivello, se None sono i seggi delle distribuzioni raccolte o, se questi
+        non tornano con la distribuzione ideale, i seggi ripartiti tra i sottolivelli
+        in proporzione ai voti (Hare)
+    colonna_lista: la colonna dei partiti nelle distribuzioni raccolte (default colonna_partito)
+
+    Restituisce le nuove distribuzioni dei sottolivelli (colonna_lista, colonna_seggi)
+    """
+    colonna_lista = colonna_partito if colonna_lista is None else colonna_lista
+    distretti = list(distribuzione_raccolta.keys())
+
+    ideale = distribuzione_ideale.groupby(colonna_partito, sort=False)[colonna_seggi].sum()
+    ideale = ideale[ideale > 0]
+
+    if seggi_distretti is None:
+        righe = pd.Series({k: v[colonna_seggi].sum() if len(v) > 0 else 0
+                           for k, v in distribuzione_raccolta.items()})
+    else:
+        righe = seggi_distretti.set_index(colonna_distretto)[colonna_seggi]
+    righe = righe.reindex(distretti).fillna(0)
+
+    matrice = voti.pivot_table(index=colonna_distretto, columns=colonna_partito,
+                               values=colonna_voti, aggfunc='sum')
+    matrice = matrice.reindex(index=distretti, columns=ideale.index).fillna(0)
+
+    if seggi_distretti is None and righe.sum() != ideale.sum():
+        righe = pd.Series(hare(matrice.sum(axis=1).to_numpy(), ideale.sum()), index=distretti)
+
+    seggi = biproportional(matrice.to_numpy(), righe.to_numpy(), ideale.to_numpy(), arrotondamento)
+
+    ret = {}
+    for i, d in enumerate(distretti):
+        mask = seggi[i] > 0
+        ret[d] = pd.DataFrame({colonna_lista: ideale.index[mask], colonna_seggi: seggi[i][mask]})
+    return ret, {}, {}
@@ -1,5 +1,7 @@
 import pandas as pd
 
+from src.Commons.apportionment import hare_intero
+
 
 def assign_local_seats(*, information, distribution, district_votes, **kwargs):
     print(information, distribution, district_votes)
@@ -62,11 +64,10 @@ def distrib_europee(*a, data, seats, **kwargs):
     data['Seats'] = data['Votes'] // q
     data['Seats'] = data['Seats'].astype("int")
     data['Remainder'] = data['Votes'] / q - data['Seats']
-    data['RemainderUsed'] = False
-    r = seats - data['Seats'].sum()
-    data.sort_values('Remainder', ascending=False, inplace=True)
-    data.iloc[:r, data.columns.get_loc('RemainderUsed')] = True
-    data.iloc[:r, data.columns.get_loc('Seats')] += 1
+    final = hare_intero(data['Votes'].to_numpy(), seats)
+    data['RemainderUsed'] = final > data['Seats'].to_numpy()
+    data['Seats'] = final
+    data.sort_values('Remainder', ascending=False, inplace=True, kind='stable')
     print("Risultato hondt:", data)
     return data
 
@@ -1,20 +1,18 @@
+import numpy as np
+
+from src.Commons.apportionment import hare
+
+
 def hondt(*a, data, seats, **kwargs):
-    #print("Hondt", kwargs, a)
+    # nonostante il nome è il metodo Hare dei quozienti e dei più alti resti
     data = data.copy()
+    seats = int(np.asarray(seats).ravel()[0])
     q = data['Votes'].sum() / seats
     data['Seats'] = data['Votes'] // q
     data['Seats'] = data['Seats'].astype("int")
     data['Remainder'] = data['Votes'] / q - data['Seats']
-    data['RemainderUsed'] = False
-    r = seats - data['Seats'].sum()
-    data.sort_values('Remainder', ascending=False, inplace=True)
-
-    rest = r[0]
-
-    data.loc[data.head(rest).index, 'RemainderUsed'] = True
-    data.loc[data.head(rest).index, 'Seats'] += 1
-
-    #data.iloc[:r, data.columns.get_loc('RemainderUsed')] = True
-    #data.iloc[:r, data.columns.get_loc('Seats')] += 1
-    #print("Risultato hondt:", data)
+    final = hare(data['Votes'].to_numpy(), seats)
+    data['RemainderUsed'] = final > data['Seats'].to_numpy()
+    data['Seats'] = final
+    data.sort_values('Remainder', ascending=False, inplace=True, kind='stable')
     return data
@@ -6,51 +6,225 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
+import src.GlobalVars as gv
+from src.Commons.apportionment import hare_intero
 
-def select_vincente_mattarellum(*a, data, **kwargs):
+
+def vincenti_collegi_mattarellum(data, colonna_collegio=None):
     '''
-        Viene chiamato nel contesto di un collegio.
-        Individua il vincitore di un collegio uninominale e ritorna un dataframe del tipo |PartitoCollegato|VotiVincenti|
-        composto da una sola riga, dove "PartitoCollegato" è il partito a cui era collegato il vincitore del collegio
-        e "VotiVincenti" è il numero di voti necessario a vincere quel collegio (voti del secondo + 1).
-        
-        Parameters
-        ----------
-        data: dataframe del tipo |Candidato|Lista|Partito|PartitoCollegato|Voti| contente i voti del collegio
+    Individua vincitore e secondo di tutti i collegi uninominali in una volta sola:
+    un unico ordinamento (collegio, voti decrescenti) di tutte le righe.
+    A parità di voti vince il candidato che compare prima nei dati.
+    Ritorna un dataframe del tipo |Collegio|Vincitore|PartitoCollegato|Voti|Secondo|VotiVincenti|
+    con una riga per collegio, nell'ordine in cui i collegi compaiono nei dati, dove "VotiVincenti"
+    è il numero di voti necessario a vincere il collegio (voti del secondo + 1).
+
+    Parameters
+    ----------
+    data: dataframe del tipo |Candidato|Lista|Partito|PartitoCollegato|Voti| con i voti dei collegi
+    colonna_collegio: la colonna con il nome del collegio, se None tutte le righe sono di un solo collegio
     '''
-    
-    # ordino per numero di voti discendente
-    data.sort_values('Voti', ascending=False, inplace=True, ignore_index=True)
-    
-    # ritorno un nuovo dataframe con il PartitoCollegato della prima riga e i Voti della 
-    res = pd.DataFrame(columns=['PartitoCollegato','VotiVincenti'])
-    if data.at[0,'PartitoCollegato'] != '':
-        return res.append({'PartitoCollegato': data.at[0,'PartitoCollegato'], 'VotiVincenti': data.at[1,'Voti']+1}, ignore_index=True)
+    if colonna_collegio is None:
+        codici, collegi = np.zeros(len(data), dtype=np.int64), pd.Index([None])
     else:
-        return res
+        codici, collegi = pd.factorize(data[colonna_collegio])
+    voti = data['Voti'].to_numpy()
+
+    ordine = np.lexsort((-voti, codici))
+    inizio = np.searchsorted(codici[ordine], np.arange(len(collegi)))
+    candidati = np.bincount(codici, minlength=len(collegi))
+    primo = ordine[inizio]
+    secondo = np.where(candidati > 1, voti[ordine[np.minimum(inizio + 1, len(ordine) - 1)]], 0)
 
+    return pd.DataFrame({'Collegio': collegi,
+                         'Vincitore': data['Candidato'].to_numpy()[primo],
+                         'PartitoCollegato': data['PartitoCollegato'].to_numpy()[primo],
+                         'Voti': voti[primo],
+                         'Secondo': secondo,
+                         'VotiVincenti': secondo + 1})
 
-def merge_votivincenti_mattarellum(*a, data, voti_proporzionale, **kwargs):
+
+def vincenti_circoscrizione_mattarellum(circoscrizione, *a, tabella='voti_uninominale', **kwargs):
     '''
     Viene chiamato nel contesto di una circoscrizione.
-    Calcola la cifra elettorale circoscrizionale di ogni partito, effettuando lo scorporo.
-    Ritorna un dataframe del tipo |Partito|Voti|Cifra| con i dati della circoscrizione.
-    
+    Individua il vincitore di ogni collegio della circoscrizione, i vincitori di tutti i collegi
+    sono calcolati una volta sola dalla tabella dei dati dei collegi (ricalcolati solo se i dati cambiano).
+    Ritorna un dataframe del tipo |PartitoCollegato|VotiVincenti|, con una riga per ogni collegio vinto da un
+    candidato collegato a un partito, dove "VotiVincenti" è il numero di voti necessario a vincere quel collegio
+    (voti del secondo + 1).
+
     Parameters
     ----------
-    data: dataframe del tipo |PartitoCollegato|Voti|VotiVincenti| con i dati dei collegi di questa cirscoscrizione già aggregati
-    voti_proporzionali: dataframe del tipo |Partito|Voti| con i voti di questa cirscoscrizione
+    circoscrizione: la circoscrizione
+    tabella: il nome della tabella dei voti dei collegi (Data/Collegio/<tabella>.csv)
     '''
-    # unisco i due dataframe
-    res = data.copy()
-    res.rename(columns = {'PartitoCollegato':'Partito'}, inplace=True)
-    res = pd.merge(res, voti_proporzionale, on='Partito', how='outer')
-    res.fillna(value=0, inplace=True)
+    hub = gv.Hub
+    vincenti = vincenti_tabella_mattarellum(hub, tabella)
+    collegi = [c for c in hub.get_subdivisions(circoscrizione, 'Collegio') if c in vincenti.index]
+    res = vincenti.loc[collegi, ['PartitoCollegato', 'VotiVincenti']].reset_index(drop=True)
+    return res[res['PartitoCollegato'] != '']
+
+
+def vincenti_tabella_mattarellum(hub, tabella='voti_uninominale'):
+    '''
+    I vincitori di tutti i collegi della tabella dei dati dei collegi (vincenti_collegi_mattarellum),
+    indicizzati per collegio, calcolati una volta sola e ricalcolati solo se i dati cambiano.
+
+    Parameters
+    ----------
+    hub: l'ActHub della simulazione
+    tabella: il nome della tabella dei voti dei collegi (Data/Collegio/<tabella>.csv)
+    '''
+    def calcola(hub):
+        data = hub.get_table('Collegio', tabella)
+        return vincenti_collegi_mattarellum(data, data.columns[0]).set_index('Collegio')
+
+    return hub.get_kernel(('vincenti_collegi_mattarellum', tabella), calcola)
+
+
+def cifre_mattarellum(hub, tabella_collegi='voti_uninominale', tabella_circoscrizioni='voti_plurinominale'):
+    '''
+    Scorporo e cifra elettorale di tutte le circoscrizioni in una volta sola, come matrici
+    circoscrizione x partito: i voti della quota proporzionale e i voti da scorporare (VotiVincenti
+    dei collegi vinti dai candidati collegati al partito) sono sommati con un unico np.add.at.
+    Il risultato è calcolato una volta sola e ricalcolato solo se i dati cambiano.
+    Ritorna un dizionario con:
+        + circoscrizioni, partiti: pd.Index delle righe e delle colonne
+        + voti, scorporo, cifra: le matrici, cifra = voti - scorporo
+        + presenti: matrice booleana, vera se il partito ha voti o collegi vinti nella circoscrizione
+
+    Parameters
+    ----------
+    hub: l'ActHub della simulazione
+    tabella_collegi: il nome della tabella dei voti dei collegi (Data/Collegio/<tabella>.csv)
+    tabella_circoscrizioni: il nome della tabella |Circoscrizione|Partito|Voti| (Data/Circoscrizione/<tabella>.csv)
+    '''
+    def calcola(hub):
+        voti = hub.get_table('Circoscrizione', tabella_circoscrizioni)
+        vincenti = vincenti_tabella_mattarellum(hub, tabella_collegi)
+
+        if hub.descendants is None:
+            hub.build_hierarchy()
+        circ_collegi = pd.Series([hub.ancestors.get(('Collegio', c), {}).get('Circoscrizione')
+                                  for c in vincenti.index], dtype=object)
+        collegati = vincenti['PartitoCollegato'].reset_index(drop=True)
+        validi = (circ_collegi.notna() & collegati.notna() & (collegati != '')).to_numpy()
+
+        righe, circoscrizioni = pd.factorize(np.concatenate([voti.iloc[:, 0].to_numpy(dtype=object),
+                                                              circ_collegi.to_numpy()[validi]]))
+        colonne, partiti = pd.factorize(np.concatenate([voti['Partito'].to_numpy(dtype=object),
+                                                         collegati.to_numpy(dtype=object)[validi]]))
+        n = len(voti)
+        forma = (len(circoscrizioni), len(partiti))
+
+        mat_voti = np.zeros(forma, dtype=voti['Voti'].dtype)
+        np.add.at(mat_voti, (righe[:n], colonne[:n]), voti['Voti'].to_numpy())
+        scorporo = np.zeros(forma, dtype=vincenti['VotiVincenti'].dtype)
+        np.add.at(scorporo, (righe[n:], colonne[n:]), vincenti['VotiVincenti'].to_numpy()[validi])
+        presenti = np.zeros(forma, dtype=bool)
+        presenti[righe, colonne] = True
+
+        return {'circoscrizioni': pd.Index(circoscrizioni), 'partiti': pd.Index(partiti),
+                'voti': mat_voti, 'scorporo': scorporo, 'cifra': mat_voti - scorporo, 'presenti': presenti}
+
+    return hub.get_kernel(('cifre_mattarellum', tabella_collegi, tabella_circoscrizioni), calcola)
+
+
+def risultati_circoscrizioni_mattarellum(distretto, *a, tabella_collegi='voti_uninominale',
+                                         tabella_circoscrizioni='voti_plurinominale', **kwargs):
+    '''
+    Viene chiamato nel contesto di una circoscrizione o della nazione.
+    Legge dalle matrici di cifre_mattarellum i risultati delle circoscrizioni del distretto
+    (o del distretto stesso se è una circoscrizione).
+    Ritorna un dataframe del tipo |Circoscrizione|Partito|Voti|Cifra|, con una riga per ogni partito
+    presente in ogni circoscrizione.
+
+    Parameters
+    ----------
+    distretto: la circoscrizione o la nazione
+    tabella_collegi, tabella_circoscrizioni: le tabelle dei dati, come in cifre_mattarellum
+    '''
+    hub = gv.Hub
+    cifre = cifre_mattarellum(hub, tabella_collegi, tabella_circoscrizioni)
+
+    if distretto.type == 'Circoscrizione':
+        nomi = [distretto.name]
+    else:
+        nomi = hub.get_subdivisions(distretto, 'Circoscrizione')
+    idx = cifre['circoscrizioni'].get_indexer(nomi)
+    idx = idx[idx >= 0]
+
+    righe, colonne = np.nonzero(cifre['presenti'][idx])
+    return pd.DataFrame({'Circoscrizione': cifre['circoscrizioni'][idx][righe],
+                         'Partito': cifre['partiti'][colonne],
+                         'Voti': cifre['voti'][idx][righe, colonne],
+                         'Cifra': cifre['cifra'][idx][righe, colonne]})
+
+
+def seggi_provvisori_mattarellum(hub, partiti, tabella_collegi='voti_uninominale',
+                                 tabella_circoscrizioni='voti_plurinominale'):
+    '''
+    Seggi assegnati sicuramente in ogni circoscrizione a ogni partito della distribuzione nazionale,
+    per tutte le circoscrizioni in una volta sola: la matrice delle cifre è ristretta ai partiti
+    (0 per quelli assenti), il quoziente di ogni riga è la somma delle cifre diviso i seggi della
+    circoscrizione e i seggi sono la parte intera di cifra / quoziente.
+    Il risultato è calcolato una volta sola per ogni lista di partiti.
+    Ritorna un dizionario con:
+        + circoscrizioni: pd.Index delle righe, partiti: le colonne nell'ordine dato
+        + seggi, resto: le matrici circoscrizione x partito
+        + seggi_circoscrizione: i seggi della quota proporzionale di ogni circoscrizione
+
+    Parameters
+    ----------
+    hub: l'ActHub della simulazione
+    partiti: tupla con i partiti della distribuzione nazionale
+    tabella_collegi, tabella_circoscrizioni: le tabelle dei dati, come in cifre_mattarellum
+    '''
+    def calcola(hub):
+        cifre = cifre_mattarellum(hub, tabella_collegi, tabella_circoscrizioni)
+        circoscrizioni = pd.Index(hub.get_instances('Circoscrizione'))
+
+        righe = cifre['circoscrizioni'].get_indexer(circoscrizioni)
+        colonne = cifre['partiti'].get_indexer(list(partiti))
+        cifra = np.where((righe >= 0)[:, None] & (colonne >= 0)[None, :],
+                         cifre['cifra'][righe][:, colonne], 0)
+
+        seggi_circoscrizione = np.array([hub.get_instance('Circoscrizione', c).get_seggi_plurinominale()
+                                         for c in circoscrizioni])
+        q = cifra.sum(axis=1) / seggi_circoscrizione
+        seggi = cifra // q[:, None]
+        return {'circoscrizioni': circoscrizioni, 'partiti': list(partiti), 'seggi': seggi,
+                'resto': cifra / q[:, None] - seggi, 'seggi_circoscrizione': seggi_circoscrizione}
+
+    return hub.get_kernel(('seggi_provvisori_mattarellum', tabella_collegi, tabella_circoscrizioni, partiti), calcola)
+
+
+def assegna_seggi_circoscrizioni_mattarellum(circoscrizione, *a, distribution, tabella_collegi='voti_uninominale',
+                                             tabella_circoscrizioni='voti_plurinominale', **kwargs):
+    '''
+    Viene chiamato nel contesto di una circoscrizione.
+    A partire dalle cifre circoscrizionali e dalla distribuzione nazionale dei seggi,
+    assegna ad ogni partito i seggi che gli spettano sicuramente in questa circoscrizione: la riga
+    della circoscrizione è letta dalle matrici di seggi_provvisori_mattarellum, calcolate una volta
+    sola per tutte le circoscrizioni.
+    Ritorna un dataframe del tipo |Partito|Seggi|Resto|SeggiCircoscrizione|.
+
+    Parameters
+    ----------
+    circoscrizione: la circoscrizione
+    distribution: dataframe del tipo |Partito|Seggi| contenente la distibuzione nazionale dei seggi
+    tabella_collegi, tabella_circoscrizioni: le tabelle dei dati, come in cifre_mattarellum
+    '''
+    print('calcolo distribuzioni locali')
+
+    provvisori = seggi_provvisori_mattarellum(gv.Hub, tuple(distribution['Partito']),
+                                              tabella_collegi, tabella_circoscrizioni)
+    i = provvisori['circoscrizioni'].get_loc(circoscrizione.name)
+    return pd.DataFrame({'Partito': provvisori['partiti'],
+                         'Seggi': provvisori['seggi'][i],
+                         'Resto': provvisori['resto'][i],
+                         'SeggiCircoscrizione': provvisori['seggi_circoscrizione'][i]})
 
-    # effettuo lo scorporo
-    res['Cifra'] = res['Voti'] - res['VotiVincenti']
-    return res[['Partito','Voti','Cifra']]
-    
 
 def hare_mattarellum(*a, data, seggi_totali, **kwargs):
     '''
@@ -75,47 +249,11 @@ def hare_mattarellum(*a, data, seggi_totali, **kwargs):
     res['Resto'] = res['Cifra'] / q - res['Seggi']
     
     # assegno i seggi rimanenti in ordine di resto, cifra discendente
-    res.sort_values(['Resto','Cifra'], ascending=False, inplace=True)
-    r = seggi_totali - res['Seggi'].sum()
-    res.iloc[:r, res.columns.get_loc('Seggi')] += 1
+    res['Seggi'] = hare_intero(res['Cifra'].to_numpy(), seggi_totali)
+    res.sort_values(['Resto','Cifra'], ascending=False, inplace=True, kind='stable')
     return res
 
 
-def assegna_seggi_circoscrizione_mattarellum(*, information, distribution, district_votes, seggi_circoscrizione, **kwargs):
-    '''
-    Viene chiamato nel contesto di una circoscrizione.
-    A partire dalle cifre circoscrizionali e dalla distribuzione nazionale dei seggi,
-    assegna ad ogni partito i seggi che gli spettano sicuramente in questa circoscrizione.
-    Ritorna un dataframe del tipo |Partito|Seggi|Resto|SeggiCircoscrizione|.
-
-    Parameters
-    ----------
-    information: informazioni passate dal livello superiore (Nazione)
-    distribution: dataframe del tipo |Partito|Seggi| contenente la distibuzione nazionale dei seggi
-    district_votes: dataframe del tipo |Partito|Voti|Cifra| contenente i voti e le cifre elettorali circoscrizionali relativi a questa circoscrizione
-    seggi_circoscrizione: numero di seggi da assegnare in questa circoscrizione nella quota proporzionale
-    '''
-    
-    print('calcolo distribuzioni locali')
-
-    district_votes.set_index('Partito', inplace=True)
-
-    # calcolo il quoziente elettorale circoscrizionale
-    somma_cifre = 0
-    for _,r in distribution.iterrows():
-        somma_cifre += district_votes.at[r['Partito'],'Cifra']
-    q = somma_cifre / seggi_circoscrizione
-
-    # assegno ad ogni partito i seggi che gli spettano sicuramente e mi segno il resto
-    res = []
-    for _,r in distribution.iterrows():
-        cifra = district_votes.at[r['Partito'],'Cifra']
-        seggi_assegnati = cifra // q
-        res.append(pd.Series({'Partito':r['Partito'],'Seggi': seggi_assegnati, 'Resto': cifra / q - seggi_assegnati, 'SeggiCircoscrizione': seggi_circoscrizione}))
-    
-    return pd.concat(res, axis=1).T
-
-
 def correggi_mattarellum(distretto, distribuzione_ideale, distribuzione_raccolta, info_locali, *info_comuni):
     '''
     Viene chiamato nel contesto della nazione.
@@ -3,6 +3,7 @@ import matplotlib.pyplot as plt
 from pandas.plotting import table
 import src.GlobalVars as gv
 import numpy as np
+from src.Commons.apportionment import largest_remainder
 import plotly.graph_objects as go
 import plotly.express as px
 
@@ -155,83 +156,112 @@ def distrib_porcellum_estero(*a, seats, data, **kwargs):
 # SEZIONE DIVISIONE <-------------------------------------------------------- #
 
 
-def dividi_per_partiti(df_eleggibili, df_partiti, df_coalizioni):
-    
-    # per ogni riga di eleggibili (quindi quello contente sia coalizioni che partiti)
-    # devo controllare se l'eleggibile è un partito o coalizione, se quest'ultima
-    # allora devo guardare tra il df_partiti quali sono quelli che possono prendere
-    # seggi in base allo sbarramento del 2% e suddividere i seggi della coalizione tra
-    # i partiti
-    # #
-    lista_coalizioni_elette = df_coalizioni['Eleggibile'].unique()
-
-    frame = []
-
-    for index, row_eleggibili in df_eleggibili.iterrows() :
+def eleggibilita_porcellum(hub):
 
-        # se questa riga di df_eleggibile è una coalizione
-        # allora devo distribuire i seggi ai partiti sottostanti
-        # altrimenti do il numero di seggi direttamente al partito
-        # #
-        if row_eleggibili['Eleggibile'] in lista_coalizioni_elette :
-            
-            coalizione = row_eleggibili['Eleggibile']
-            seggi_coalizione = row_eleggibili['Seats']
+    # tabella |Coalizione|Partito|PercNazione|PercRegione|Spettante| con una riga
+    # per ogni partito di ogni coalizione (dalle appartenenze dell'Hub).
+    # Un partito di una coalizione prende seggi se supera il 2% dei voti nazionali,
+    # se è il miglior perdente (il primo sotto il 2%, se qualcuno lo supera)
+    # o se supera lo sbarramento regione di Partito (20% dei voti in Trentino-Alto
+    # Adige o Friuli-Venezia Giulia, presentandosi solo lì). Le percentuali sono
+    # calcolate sui totali della nazione (liste e regioniListe) una volta sola,
+    # ricalcolate solo se i dati cambiano #
+    def calcola(hub):
+        naz = hub.get_instance('Nazione', hub.get_instances('Nazione')[0])
 
-            partiti_spettanti_seggi = gv.Hub.get_instance('PolEnt', coalizione).get_partiti_spettanti_seggi()
-            df_partiti_in_coalizione = df_partiti[df_partiti['Eleggibile'].isin(partiti_spettanti_seggi)]
-            df_partiti_in_coalizione['Coalizione'] = row_eleggibili['Eleggibile']
+        tabella = hub.get_political_table('Coalizione', 'Partito').copy()
 
-            tot_voti_coalizione_suddivisione = df_partiti_in_coalizione['Votes'].sum()
-            q = int(tot_voti_coalizione_suddivisione / seggi_coalizione)
-            
+        liste = naz.totals('liste')
+        voti_partito = liste.groupby('Partito')['Voti'].sum()
+        perc_nazione = (voti_partito / liste['Voti'].sum()) * 100
 
-            df_partiti_in_coalizione['Seats'] = df_partiti_in_coalizione['Votes'] // q
-            df_partiti_in_coalizione['Seats'] = df_partiti_in_coalizione['Seats'].astype("int")
+        regioni = naz.totals('regioniListe')
+        in_regione = regioni['Regione'].isin(['TRENTINO-ALTO ADIGE', 'FRIULI-VENEZIA GIULIA'])
+        solo = regioni.groupby('Partito')['Partito'].transform('size') == 1
+        voti_regione = regioni.groupby('Regione')['Voti'].transform('sum')
+        regionali = regioni[in_regione & solo]
+        perc_regione = pd.Series((regionali['Voti'] / voti_regione[regionali.index]).to_numpy() * 100,
+                                 index=regionali['Partito'])
 
-            df_partiti_in_coalizione['Remainder'] = df_partiti_in_coalizione['Votes'] / q - df_partiti_in_coalizione['Seats']
-            df_partiti_in_coalizione['RemainderUsed'] = False
+        tabella['PercNazione'] = perc_nazione.reindex(tabella['Partito']).fillna(0.).to_numpy()
+        tabella['PercRegione'] = perc_regione.reindex(tabella['Partito']).fillna(0.).to_numpy()
 
-            seggi_rimanenti = seggi_coalizione - df_partiti_in_coalizione['Seats'].sum()
+        # dentro ogni coalizione per percentuale nazionale decrescente #
+        tabella.sort_values(['Coalizione', 'PercNazione', 'Partito'], ascending=[True, False, True],
+                            inplace=True, kind='stable')
+        tabella.reset_index(drop=True, inplace=True)
 
-            # qua ordino i partiti in base al resto
-            df_partiti_in_coalizione.sort_values('Remainder', ascending=False, inplace=True)
+        # il miglior perdente è il primo partito dopo quelli sopra il 2% #
+        sopra = tabella['PercNazione'] > 2.
+        sopra_coalizione = sopra.groupby(tabella['Coalizione'])
+        miglior_perdente = (tabella.groupby('Coalizione').cumcount() == sopra_coalizione.transform('sum')) \
+            & sopra_coalizione.transform('any')
+        regionali_eletti = naz.totals('regioniListe', 'regione')['Partito']
+        tabella['Spettante'] = sopra | miglior_perdente | tabella['Partito'].isin(regionali_eletti)
+        return tabella
 
-            # assegno i seggi rimanenti
-            df_partiti_in_coalizione.iloc[:seggi_rimanenti, df_partiti_in_coalizione.columns.get_loc('RemainderUsed')] = True
-            df_partiti_in_coalizione.iloc[:seggi_rimanenti, df_partiti_in_coalizione.columns.get_loc('Seats')] += 1
+    return hub.get_kernel('eleggibilita_porcellum', calcola)
 
-            df_partiti_in_coalizione.sort_values('Seats', ascending=False, inplace=True)
 
-            
-            # ho assegnato tutti i seggi ai partiti di una coalizione quindi ora appendo alla distribuzione finale
-            # e passo alla prossima row_eleggibili
-            frame.append(df_partiti_in_coalizione)
-        
-        else :
-            df_partito = df_eleggibili[df_eleggibili['Eleggibile'] == row_eleggibili['Eleggibile']]
-            df_partito['Coalizione'] = 'NO COALIZIONE'
-            frame.append(df_partito)
+def dividi_per_partiti(df_eleggibili, df_partiti, df_coalizioni):
     
-    # END-FOR
-    df_distribuzione_finale = pd.concat(frame)
+    # i seggi di ogni coalizione eletta sono divisi tra i suoi partiti che
+    # possono prendere seggi (sbarramento del 2%, miglior perdente, 20% regionale)
+    # con il metodo dei quozienti interi e dei più alti resti, per tutte le
+    # coalizioni in una sola chiamata: una riga di voti per coalizione.
+    # I partiti non coalizzati prendono direttamente i seggi dell'eleggibile #
+    hub = gv.Hub
+    lista_coalizioni_elette = df_coalizioni['Eleggibile'].unique()
+    eleggibili = df_eleggibili.reset_index()
+
+    coalizioni = eleggibili[eleggibili['Eleggibile'].isin(lista_coalizioni_elette)]
+
+    # appartenenza partito -> coalizione dalla tabella dell'Hub, ristretta ai partiti che prendono seggi #
+    appartenenza = eleggibilita_porcellum(hub)
+    appartenenza = appartenenza[appartenenza['Coalizione'].isin(coalizioni['Eleggibile'])
+                                & appartenenza['Spettante']]
+    coalizione_partito = appartenenza.set_index('Partito')['Coalizione']
+
+    df_partiti_in_coalizione = df_partiti[df_partiti['Eleggibile'].isin(coalizione_partito.index)].copy()
+    df_partiti_in_coalizione['Coalizione'] = df_partiti_in_coalizione['Eleggibile'].map(coalizione_partito)
+
+    # matrice coalizioni x partiti (nell'ordine di df_partiti), completata con zeri #
+    riga = pd.Index(coalizioni['Eleggibile']).get_indexer(df_partiti_in_coalizione['Coalizione'])
+    colonna = df_partiti_in_coalizione.groupby(riga, sort=False).cumcount().to_numpy()
+    voti = np.zeros((len(coalizioni), colonna.max(initial=-1) + 1), dtype=np.int64)
+    voti[riga, colonna] = df_partiti_in_coalizione['Votes'].to_numpy()
+
+    seggi = largest_remainder(voti, coalizioni['Seats'].to_numpy(), 'hare_intero')
+    q = voti.sum(axis=1) // np.maximum(coalizioni['Seats'].to_numpy(), 1)
+    df_partiti_in_coalizione['Seats'] = seggi[riga, colonna]
+    df_partiti_in_coalizione['Remainder'] = (voti % np.maximum(q, 1)[:, None])[riga, colonna]
+
+    # i partiti non coalizzati prendono i seggi dell'eleggibile #
+    singoli = eleggibili.index[~eleggibili['Eleggibile'].isin(lista_coalizioni_elette)]
+    df_singoli = df_eleggibili.iloc[singoli].copy()
+    df_singoli['Coalizione'] = 'NO COALIZIONE'
+    df_singoli['Ordine'] = singoli
+    df_singoli['Posizione'] = 0
+
+    # ordine finale: gli eleggibili come in df_eleggibili, dentro ogni coalizione
+    # i partiti per seggi e resto decrescenti (a parità nell'ordine di df_partiti) #
+    df_partiti_in_coalizione['Ordine'] = coalizioni.index[riga]
+    df_partiti_in_coalizione['Posizione'] = np.arange(len(df_partiti_in_coalizione))
+    df_distribuzione_finale = pd.concat([df_partiti_in_coalizione, df_singoli])
+    df_distribuzione_finale.sort_values(['Ordine', 'Seats', 'Remainder', 'Posizione'],
+                                        ascending=[True, False, False, True], inplace=True, kind='stable')
 
     # tolto e rinomino colonne # 
-    df_distribuzione_finale = df_distribuzione_finale.drop(['Remainder', 'RemainderUsed'], axis=1)
+    df_distribuzione_finale = df_distribuzione_finale[['Eleggibile', 'Coalizione', 'Votes', 'Seats']]
     df_distribuzione_finale = df_distribuzione_finale.rename({'Eleggibile': 'Partito'}, axis=1)
 
-
     # questa parte mi aggiunge il numero di voti totali che la coalizione ha preso
     # comprendendo anche i voti delle liste della coalizione che non hanno preso seggi #
-    df_distribuzione_finale['VotiCoalizione'] = 0
-    for index, row in df_distribuzione_finale.iterrows():
-        if row['Coalizione'] == 'NO COALIZIONE':
-            voti_coal =  int(df_eleggibili[df_eleggibili['Eleggibile'] == row['Partito']]['Votes'])
-        else :
-            voti_coal = int(df_eleggibili[df_eleggibili['Eleggibile'] == row['Coalizione']]['Votes'])
-        
-        df_distribuzione_finale.at[index, 'VotiCoalizione'] = voti_coal
-    
+    chiave = df_distribuzione_finale['Coalizione'].where(df_distribuzione_finale['Coalizione'] != 'NO COALIZIONE',
+                                                         df_distribuzione_finale['Partito'])
+    voti_coalizioni = df_eleggibili[['Eleggibile', 'Votes']].rename(columns={'Votes': 'VotiCoalizione'})
+    df_distribuzione_finale['VotiCoalizione'] = pd.merge(chiave.rename('Eleggibile').to_frame(), voti_coalizioni,
+                                                         on='Eleggibile', how='left')['VotiCoalizione'].to_numpy()
 
     return df_distribuzione_finale
 
@@ -374,18 +404,22 @@ def divisione_circoscrizionale_partiti(*, information, distribution, district_vo
 
     lista_partiti = information[1].keys() # lista dei partiti spettanti di seggi #
 
+    distribuzione_coalizioni_circ = distribution.get(distretto)
+
+    # le coalizioni spettanti di seggi sono quelle che compaiono tra gli eleggibili:
+    # una coalizione sotto la soglia del 10% non c'è, i suoi partiti che hanno
+    # passato il 4% sono eleggibili da soli come i partiti non coalizzati #
     lista_coalizioni = district_votes['Coalizione'].unique()
-    lista_coalizioni = np.delete(lista_coalizioni, np.argwhere(lista_coalizioni=='NO COALIZIONE')) # lista coalizioni spettanti di seggi #
+    lista_coalizioni = lista_coalizioni[(lista_coalizioni != 'NO COALIZIONE')
+                                        & np.isin(lista_coalizioni, distribuzione_coalizioni_circ['Eleggibile'])]
 
     numero_seggi_circoscrizione = seggi[0]
 
     district_votes_filtrato = district_votes[district_votes['Partito'].isin(lista_partiti)]
     lista_partiti_circoscrizione = district_votes_filtrato['Partito'].unique()
 
-    lista_partiti_senza_coal = district_votes_filtrato[district_votes_filtrato['Coalizione'] == 'NO COALIZIONE']['Partito'].unique()
+    lista_partiti_senza_coal = district_votes_filtrato[~district_votes_filtrato['Coalizione'].isin(lista_coalizioni)]['Partito'].unique()
     lista_partiti_senza_coal = [value for value in lista_partiti_senza_coal if value in lista_partiti] # lista di partiti non in coalizioni spettanti seggi in questa circoscrizione #
-    
-    distribuzione_coalizioni_circ = distribution.get(distretto)
 
     # voti_coalizioni, dizionario :
     #   - chiave : nome coalizione
@@ -458,101 +492,85 @@ def correct_porcellum(distretto, distribuzione_ideale, distribuzione_raccolta,
     lista_coalizioni_partiti = np.delete(lista_coalizioni_partiti, np.argwhere(lista_coalizioni_partiti=='NO COALIZIONE'))
     lista_coalizioni_partiti = np.append(lista_coalizioni_partiti, distribuzione_ideale[distribuzione_ideale['Coalizione'] == 'NO COALIZIONE']['Partito'].unique())
 
-
-    lista_seggi_assegnati = {}
-    lista_seggi_eccedenti = {}
-
-    
-    for elem in lista_coalizioni_partiti :
-
-        tot_seggi_assegnati_circ = 0
-
-        for distrib_circ in distribuzione_raccolta.values() :
-            tot_seggi_assegnati_circ += int(distrib_circ[distrib_circ['Eleggibile'] == elem]['Seggi'])
-        
-        lista_seggi_assegnati[elem] = tot_seggi_assegnati_circ
-
-        numero_seggi_coalizione_partito = distribuzione_ideale[distribuzione_ideale['Coalizione'] == elem]['Seggi'].sum()
-        if numero_seggi_coalizione_partito == 0 :
-            numero_seggi_coalizione_partito = distribuzione_ideale[distribuzione_ideale['Partito'] == elem]['Seggi'].sum()
-
-        lista_seggi_eccedenti[elem] = tot_seggi_assegnati_circ - numero_seggi_coalizione_partito
-    
-    lista_seggi_eccedenti = dict(sorted(lista_seggi_eccedenti.items(), key=lambda item: item[1], reverse=True))
-
-    #print(lista_seggi_eccedenti)
-    eleggibili_seggi_mancanti = {}
-    eleggibili_seggi_eccedenti = {}
-
-    for eleggibile, seggi in lista_seggi_eccedenti.items() :
-        if seggi < 0:
-            eleggibili_seggi_mancanti[eleggibile] = seggi
-        elif seggi > 0:
-            eleggibili_seggi_eccedenti[eleggibile] = seggi
-    
-    lista_info_eleggibili = {}
-
-    for eleggibile, seggi_eccedenti in eleggibili_seggi_eccedenti.items() :
-        
-        dict_info_circ = {}
-        for circ, distrib_circ in distribuzione_raccolta.items():
-
-            # Prendo solo dove i seggi vengono assegnati grazie alla parte decimale 
-            # se non ho assegnato un seggio grazie alla parte decimale non includo le info #
-            if distrib_circ[distrib_circ['Eleggibile'] == eleggibile]['Resto_Usato'].item() == True :
-                dict_info_distribuzione = {}
-                dict_info_distribuzione['Seggi'] = int(distrib_circ[distrib_circ['Eleggibile'] == eleggibile]['Seggi'])
-                dict_info_distribuzione['Resto'] = distrib_circ[distrib_circ['Eleggibile'] == eleggibile]['Resto'].item()
-
-                dict_info_circ[circ] = dict_info_distribuzione
-
-        dict_info_circ = dict(sorted(dict_info_circ.items(), key=lambda item: item[1].get('Resto'), reverse=False))
-        lista_info_eleggibili[eleggibile] = dict_info_circ
-
-    
-    
-    for eleggibile, seggi_eccedenti in eleggibili_seggi_eccedenti.items() :
-        info_resti_coal = lista_info_eleggibili.get(eleggibile, {})
-
-        for circ in info_resti_coal.keys():
-                # se la coalizione ha ancora seggi eccedenti allora continuo a toglierli#
-                distrib_circ = distribuzione_raccolta.get(circ)
-                i_eccedenti = distrib_circ.index[distrib_circ['Eleggibile'] == eleggibile].tolist()
-
-                if distrib_circ['Seggi'][i_eccedenti].item() > 0:
-
-                    df_eleggibile_seggi_mancanti = distrib_circ[distrib_circ['Eleggibile'].isin(eleggibili_seggi_mancanti.keys())]
-                    df_eleggibile_seggi_mancanti = df_eleggibile_seggi_mancanti[df_eleggibile_seggi_mancanti['Resto_Usato'] == False]
-                    df_eleggibile_seggi_mancanti.sort_values('Resto', ascending=False, inplace=True)
-
-                    if len(df_eleggibile_seggi_mancanti) > 0:
-                        eleggibile_assegnatario_seggio = df_eleggibile_seggi_mancanti.iloc[0]['Eleggibile']
-                        i_mancanti = distrib_circ.index[distrib_circ['Eleggibile'] == eleggibile_assegnatario_seggio].tolist()
-
-                        distrib_circ['Seggi'][i_eccedenti] -= 1
-                        distrib_circ['Seggi'][i_mancanti] += 1
-
-                        eleggibili_seggi_eccedenti[eleggibile] -= 1
-                        eleggibili_seggi_mancanti[eleggibile_assegnatario_seggio] += 1
-
-                        if eleggibili_seggi_mancanti[eleggibile_assegnatario_seggio] == 0:
-                            eleggibili_seggi_mancanti.pop(eleggibile_assegnatario_seggio, None)
-                        if eleggibili_seggi_eccedenti[eleggibile] == 0:
-                            break;
-    
-
-    for circ, distr in distribuzione_raccolta.items():
+    eleggibili = pd.Index(lista_coalizioni_partiti)
+    circoscrizioni = list(distribuzione_raccolta.keys())
+
+    # matrici eleggibile x circoscrizione con seggi, resti, resto usato
+    # e la posizione della riga nella distribuzione della circoscrizione #
+    forma = (len(eleggibili), len(circoscrizioni))
+    seggi = np.zeros(forma, dtype=np.int64)
+    resti = np.zeros(forma)
+    resto_usato = np.zeros(forma, dtype=bool)
+    posizione = np.zeros(forma, dtype=np.int64)
+    righe_circ = []
+    for j, distrib_circ in enumerate(distribuzione_raccolta.values()):
+        righe = eleggibili.get_indexer(distrib_circ['Eleggibile'])
+        validi = righe >= 0
+        righe_circ.append((righe, validi))
+        seggi[righe[validi], j] = distrib_circ['Seggi'].to_numpy()[validi]
+        resti[righe[validi], j] = distrib_circ['Resto'].to_numpy()[validi]
+        resto_usato[righe[validi], j] = distrib_circ['Resto_Usato'].to_numpy(dtype=bool)[validi]
+        posizione[righe[validi], j] = np.flatnonzero(validi)
+
+    # seggi spettanti a livello nazionale: quelli della coalizione
+    # o, se non è una coalizione, quelli del partito #
+    seggi_coalizioni = distribuzione_ideale.groupby('Coalizione')['Seggi'].sum().reindex(eleggibili).fillna(0)
+    seggi_partiti = distribuzione_ideale.groupby('Partito')['Seggi'].sum().reindex(eleggibili).fillna(0)
+    seggi_ideali = np.where(seggi_coalizioni == 0, seggi_partiti, seggi_coalizioni).astype(np.int64)
+
+    seggi_eccedenti = seggi.sum(axis=1) - seggi_ideali
+    seggi_dovuti = np.maximum(-seggi_eccedenti, 0)
+
+    # per ogni circoscrizione la coda di chi può ricevere un seggio:
+    # gli eleggibili con seggi mancanti che non hanno usato il resto,
+    # in ordine di resto decrescente (a parità conta l'ordine della distribuzione) #
+    code = []
+    for j in range(len(circoscrizioni)):
+        candidati = np.flatnonzero((seggi_dovuti > 0) & ~resto_usato[:, j])
+        ordine = np.lexsort((posizione[candidati, j], -resti[candidati, j]))
+        code.append(list(candidati[ordine]))
+
+    # gli eleggibili con seggi in eccesso li cedono, cominciando dalle circoscrizioni
+    # in cui hanno preso un seggio con il resto più basso #
+    for e in np.argsort(-seggi_eccedenti, kind='stable'):
+        if seggi_eccedenti[e] <= 0:
+            break
+        circ_resti = np.flatnonzero(resto_usato[e])
+        circ_resti = circ_resti[np.argsort(resti[e, circ_resti], kind='stable')]
+
+        for j in circ_resti:
+            if seggi[e, j] <= 0:
+                continue
+            coda = code[j]
+            while coda and seggi_dovuti[coda[0]] == 0:
+                coda.pop(0)
+            if not coda:
+                continue
+
+            seggi[e, j] -= 1
+            seggi[coda[0], j] += 1
+            seggi_eccedenti[e] -= 1
+            seggi_dovuti[coda[0]] -= 1
+            if seggi_eccedenti[e] == 0:
+                break
+
+    # nuove distribuzioni circoscrizionali #
+    distribuzione_corretta = {}
+    for j, (circ, distrib_circ) in enumerate(distribuzione_raccolta.items()):
+        righe, validi = righe_circ[j]
+        nuovi_seggi = distrib_circ['Seggi'].to_numpy().copy()
+        nuovi_seggi[validi] = seggi[righe[validi], j]
+        distribuzione_corretta[circ] = distrib_circ.assign(Seggi=nuovi_seggi)
+
+    for circ, distr in distribuzione_corretta.items():
         print(circ)
         print(distr)
         print()
     
     # restituisco la nuova distribuzione circoscrizionale
-    seggi_coal = {}
-    for _,row in distribuzione_ideale.iterrows():
-        dict_seggi = {'Seggi': row['Seggi']}
-        seggi_coal[row['Partito']] = dict_seggi
+    seggi_coal = {partito: {'Seggi': s} for partito, s in zip(distribuzione_ideale['Partito'], distribuzione_ideale['Seggi'])}
 
-    ret = distribuzione_raccolta, {}, seggi_coal
+    ret = distribuzione_corretta, {}, seggi_coal
 
     return ret
 
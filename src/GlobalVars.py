@@ -1,90 +1,334 @@
-class ExtendableIterator:
-    def __init__(self, set_start):
-        self.s = set(set_start)
+import heapq
+import threading
+from contextvars import ContextVar, copy_context
 
-    def add_el(self, el):
-        self.s.add(el)
+import pandas as pd
 
-    def __next__(self):
-        try:
-            return self.s.pop()
-        except KeyError:
-            raise StopIteration
-
-    def __iter__(self):
-        return self
+from src.parallel import imap_ordered, parse_execution, process_pool
 
 
 class ActHub:
     def __init__(self, *args):
         self.instances_dict = {}  # Class_name: {Inst_name: instance}
+        self.instance_index = {}  # Class_name o superclasse: {Inst_name: instance}
         self.subs_relations = {}  # Class_name:
         self.subclasses = {}
+        self.superclasses = {}  # Class_name: [superclassi dirette]
+        self.paths = None  # Class_name: {Sub_class: (classi intermedie, ..., Sub_class)}
+        self.descendants = None  # (Class_name, Inst_name): {Sub_class: (nomi,)}
+        self.ancestors = None  # (Class_name, Inst_name): {Sup_class: nome}
+        self.subdivision_instances = {}  # (Class_name, Inst_name, Sub_class): (istanze,)
         self.lanes = {}
-        self.pol = {}
+        self.concurrent_lanes = set()  # lanes che possono essere eseguite in parallelo ad altre, si veda lane_groups
+        self.pol = {}  # Sup_name: {Sub_class: {Sub_name}}
+        self.pol_sups = {}  # Sub_name: {Sub_class: {Sup_name}}
+        self.synonyms = {}  # Class_name: (Class_name, sottoclassi...)
+        self.pol_cache = {}  # (Sup_name, Sub_class, actual): risultato di get_political_subs
         self.lane_tails = {}
+        self.tables = {}  # (Class_name, nome_tabella): dataframe dato con give_data, si veda get_table
+        self.table_updates = {}  # (Class_name, nome_tabella): {Inst_name: dataframe} dati con give_* dopo set_tables
+        self.cubes = {}  # (nome_tabella, campi, chiavi): VoteCube
+        self.data_version = 0  # cambia a ogni give_*, invalida le cache dei totals
+        self.totals_stats = {}  # (Class_name, nome_totale): [hit, miss, non memorizzabili]
+        self.stats_lock = threading.Lock()
+        # le lanes concorrenti girano su più thread: tabelle, cubi e kernel sono protetti da
+        # data_lock (rientrante, i kernel leggono le tabelle e altri kernel), le offerte da offers_lock
+        self.data_lock = threading.RLock()
+        self.offers_lock = threading.Lock()
+        self.execution = ('serial', None)  # (strategia, workers) di default delle fan-out, si veda src.parallel
         self.elected = {}  # nome_cand : informazioni
         self.electors = []
         self.assigned_seats = {}
+        self.offers = []  # heap (numero offerta, nome_cand) dei candidati con offerte da valutare
+        self.offer_seq = 0
+        self.indexes = {}  # nome: indice costruito sui log delle lanes, si veda get_index
+        self.kernels = {}  # nome: (data_version, risultato calcolato sulle tabelle), si veda get_kernel
 
     def run_exec(self):
         """
         Execute the simulation based on the provided priority number, lanes
-        with same priority are resolved concurrently
+        with same priority can be resolved concurrently: if the execution
+        strategy (see set_execution) isn't serial the lanes registered as
+        concurrent are split by lane_groups into groups not sharing geographic
+        instances, the other lanes form a single group; the groups run on a
+        pool of threads, the lanes of a group one after the other. The instructions
+        are collected in the order of registration whatever the strategy
         For each lane:
             1. Get all instances of the lane_head
             2. Run exec_lane on each of these and collect the resulting
                 instructions in a flat list
         For each priority level:
             3. For each instruction collect the proposed names in a set
-            4. Iterate over the extendable iterator of candidates who
-                received a proposal for a seat, if they received more than
-                one extend the iterator with the second choices as returned
-                by the candidate
+            4. Pop from the heap of offers the candidate with the oldest
+                offer not yet evaluated, the candidate picks one of its
+                offers and the others are passed to the next candidates of
+                the lists, pushing new offers on the heap, until the heap
+                is empty. The offers are numbered in order of creation so
+                the result doesn't depend on hashing or on the process
+
+        The steps are run by iter_exec, run_exec only collects its records
+        """
+        exec_return = list(self.iter_exec())
+        if self.has_candidates() and len(self.lanes) > 0:
+            return [self.electors, self.elected]
+        return exec_return
+
+    def has_candidates(self):
+        return 'Candidato' in self.subclasses.get('PolEnt', [])
+
+    def iter_exec(self):
+        """
+        Come run_exec ma è un generatore: produce i record (distretto, lane,
+        elettore, seggi) di ogni lane appena la lane è terminata, nell'ordine
+        delle priorità e di registrazione delle lanes; il distretto è il nome
+        dell'istanza. I record non sono conservati, se non per i candidati.
+
+        Con i candidati i passi 3 e 4 di una priorità sono eseguiti dopo aver
+        prodotto i record di tutte le sue lanes, gli eletti sono in
+        self.electors e self.elected, completi a generatore esaurito.
+
+        Ogni passo è eseguito in una copia del contesto di chi crea il
+        generatore in cui l'Hub è self: il generatore può essere ripreso da
+        qualsiasi thread o task, anche mentre il suo contesto ha un altro Hub
+        """
+        ctx = copy_context()
+        ctx.run(current_hub.set, self)
+        steps = self.exec_steps()
+        try:
+            while True:
+                try:
+                    record = ctx.run(next, steps)
+                except StopIteration:
+                    return
+                yield record
+        finally:
+            ctx.run(steps.close)
+
+    def exec_steps(self):
+        """
+        Il corpo di iter_exec, da eseguire nel contesto in cui l'Hub è self
         """
         # ordina le lanes secondo 'order_number'
         # quindi order_number è la priorità, viene
         # eseguita prima la lane con order_numer piu basso
-        orders = sorted(self.lanes.keys())
-        exec_return = []
-        for i in orders:
-
-            ret = []
-
-            for l_n, h_c in self.lanes[i]:
-                # -- 1
-                instances = self.get_instances(h_c)
-                instances = [self.get_instance(h_c, n_i) for n_i in instances]
-                # -- 2
-                ret.extend([instruction for inst in instances for instruction in inst.exec_lane(l_n)])
-
-            polEnt_list = self.subclasses.get('PolEnt')
-            if 'Candidato' in polEnt_list :
-                # -- 3
-                prop_nomi = set()
-                for district, name_lista, elector, seats in ret:
-                    self.electors.append((district, name_lista, elector, seats))
-                    p = self.get_instance("PolEnt", elector)
-                    for name in p.elect(name_lista, district, seats):
-                        prop_nomi.add(name)
-
-                # -- 4
-                iter_nomi = ExtendableIterator(prop_nomi)
-
-                
-                for i in iter_nomi:
-
-                    c = self.get_instance("PolEnt", i)
-                    info, next = c.pick()
-                    for nome_next in next:
-                        iter_nomi.add_el(nome_next)
-                    self.elected[i] = info
-                exec_return = [self.electors, self.elected]
-            else: 
-                for district, name_lista, elector, seats in ret:
-                     exec_return.append((district.name, name_lista, elector, seats))
-                
-        return exec_return
+        # le fan-out con strategia process della run usano lo stesso pool
+        candidates = self.has_candidates()
+        with process_pool():
+            for i in sorted(self.lanes.keys()):
+                ret = []
+                for instructions in self.iter_priority(i):  # -- 1, 2
+                    if candidates:
+                        ret.extend(instructions)
+                    for district, name_lista, elector, seats in instructions:
+                        yield (district.name, name_lista, elector, seats)
+
+                if candidates:
+                    self.resolve_candidates(ret)
+
+    def iter_priority(self, order):
+        """
+        Esegue le lanes con priorità order, produce la lista di istruzioni di
+        ogni lane nell'ordine di registrazione, appena disponibile
+        """
+        lanes = self.lanes[order]
+        if self.execution[0] == 'serial':
+            groups = [list(range(len(lanes)))]
+        else:
+            groups = self.lane_groups(lanes)
+
+        # con un solo gruppo nel thread corrente, così le fan-out
+        # delle lanes possono usare la propria strategia
+        if len(groups) == 1:
+            for j in groups[0]:
+                yield self.run_lane(*lanes[j])
+            return
+
+        done = {}
+        next_lane = 0
+        results = imap_ordered(lambda g: [self.run_lane(*lanes[j]) for j in g], groups,
+                               'thread', self.execution[1])
+        for g, rs in zip(groups, results):
+            done.update(zip(g, rs))
+            while next_lane in done:
+                yield done.pop(next_lane)
+                next_lane += 1
+
+    def resolve_candidates(self, ret):
+        """
+        Passi 3 e 4 di run_exec sulle istruzioni ret di una priorità
+        """
+        # i log delle lanes di questa priorità sono completi, gli indici si ricostruiscono
+        self.indexes = {}
+
+        # -- 3: le offerte fatte con propose sono registrate con register_offer
+        for district, name_lista, elector, seats in ret:
+            self.electors.append((district, name_lista, elector, seats))
+            p = self.get_instance("PolEnt", elector)
+            p.elect(name_lista, district, seats)
+
+        # -- 4
+        while self.offers:
+            _, name = heapq.heappop(self.offers)
+            c = self.get_instance("PolEnt", name)
+            if not c.proposals:  # ha già scelto, l'offerta è stata passata al successivo
+                continue
+            info, _ = c.pick()
+            self.elected[name] = info
+
+    def get_index(self, name, build):
+        """
+        Restituisce l'indice name, costruito con build(hub) la prima volta che
+        serve durante la risoluzione dei candidati di una priorità (quando i
+        log scritti dalle lanes non cambiano più)
+        """
+        if name not in self.indexes:
+            self.indexes[name] = build(self)
+        return self.indexes[name]
+
+    def get_kernel(self, name, build):
+        """
+        Restituisce il risultato di build(hub), un calcolo fatto una volta sola
+        per tutte le istanze, ricalcolato quando i dati cambiano (data_version).
+        build può leggere le tabelle dei dati (get_table, come i kernel del
+        Mattarellum) o i totals delle istanze (come eleggibilita_porcellum,
+        sui totali della nazione)
+        """
+        with self.data_lock:  # un kernel è calcolato una volta anche se più lanes lo chiedono insieme
+            res = self.kernels.get(name)
+            if res is None or res[0] != self.data_version:
+                res = (self.data_version, build(self))
+                self.kernels[name] = res
+            return res[1]
+
+    def register_offer(self, name):
+        """
+        Il candidato name ha ricevuto un'offerta, lo mette in coda con il
+        numero progressivo dell'offerta
+        """
+        with self.offers_lock:
+            heapq.heappush(self.offers, (self.offer_seq, name))
+            self.offer_seq += 1
+
+    def reset_run(self):
+        """
+        Riporta Hub e istanze allo stato precedente a run_exec, così da poter
+        rieseguire la simulazione (ad esempio con dati diversi) senza
+        ricaricare classi e istanze.
+        Le istanze possono definire reset_run per ripulire il proprio stato
+        """
+        self.elected = {}
+        self.electors = []
+        self.assigned_seats = {}
+        self.offers = []
+        self.offer_seq = 0
+        self.indexes = {}
+        self.invalidate_totals()
+        for instances in self.instances_dict.values():
+            for inst in instances.values():
+                reset = getattr(inst, 'reset_run', None)
+                if reset is not None:
+                    reset()
+
+    def set_execution(self, strategy='serial', workers=None):
+        """
+        Strategia (serial, thread, process) usata dalle operazioni delle lanes
+        per chiamare propose sui sottolivelli, se non indicata nella lane
+        """
+        self.execution = parse_execution({'strategy': strategy, 'workers': workers})
+
+    def set_tables(self, tables):
+        """
+        Registra le tabelle dei dati (quelle passate a give_data), i cubi
+        costruiti sui dati precedenti non sono più validi
+        """
+        with self.data_lock:
+            self.tables = dict(tables)
+            self.table_updates = {}
+            self.cubes = {}
+            self.invalidate_totals()
+
+    def update_table(self, instance, name, data):
+        """
+        Chiamata da give_<name>: se i dati di instance vengono da una tabella
+        registrata con set_tables le sue righe saranno sostituite da data
+        (senza la prima colonna, come in give_data) alla prossima get_table.
+        I cubi costruiti sulla tabella non sono più validi
+        """
+        if type(data) != pd.DataFrame:
+            return
+        classe = getattr(instance, 'type', type(instance).__name__)
+        with self.data_lock:
+            for f, n in self.tables:
+                if n == name and classe in self.get_synonyms(f):
+                    self.table_updates.setdefault((f, n), {})[instance.name] = data
+                    self.cubes = {k: v for k, v in self.cubes.items() if k[0] != name}
+
+    def get_table(self, class_name, name):
+        """
+        La tabella name della classe class_name (data/<Classe>/<name>.csv)
+        con i dati dati dopo set_tables alle singole istanze con give_*
+        """
+        key = (class_name, name)
+        with self.data_lock:  # senza il lock un'altra lane vedrebbe la tabella senza gli aggiornamenti già tolti
+            updates = self.table_updates.pop(key, None)
+            if updates:
+                df = self.tables[key]
+                col = df.columns[0]
+                parts = [df[~df[col].isin(list(updates))]]
+                for inst_name, data in updates.items():
+                    data = data.copy()
+                    data.insert(0, col, inst_name)
+                    parts.append(data)
+                self.tables[key] = pd.concat(parts, ignore_index=True)
+            return self.tables[key]
+
+    def invalidate_totals(self):
+        """
+        I dati sono cambiati: i risultati dei totals memorizzati nelle istanze
+        non sono più validi
+        """
+        with self.data_lock:
+            self.data_version += 1
+
+    def count_totals(self, class_name, name, hit):
+        """
+        hit: True, False o None se la chiamata non era memorizzabile
+        """
+        with self.stats_lock:  # le lanes e le propose possono girare su più thread
+            stats = self.totals_stats.setdefault((class_name, name), [0, 0, 0])
+            stats[{True: 0, False: 1, None: 2}[hit]] += 1
+
+    def get_totals_stats(self):
+        """
+        Restituisce un dizionario (classe, totale): {'hit': n, 'miss': n, 'uncached': n}
+        """
+        return {k: {'hit': h, 'miss': m, 'uncached': u} for k, (h, m, u) in self.totals_stats.items()}
+
+    def get_cube(self, table, fields, keys):
+        """
+        Restituisce il VoteCube della tabella table (il nome del file in Data),
+        costruito alla prima richiesta e riusato fino ai prossimi set_tables
+        o give_* di quella tabella
+        """
+        key = (table, tuple(fields), tuple(keys))
+        with self.data_lock:
+            if key not in self.cubes:
+                from src.cube import VoteCube
+                matches = [(f, self.get_table(f, name)) for f, name in list(self.tables) if name == table]
+                if len(matches) != 1:
+                    raise KeyError(f"No single table named {table}")
+                leaf_class, data = matches[0]
+                self.cubes[key] = VoteCube(self, leaf_class, data, fields, keys)
+            return self.cubes[key]
+
+    def get_cube_level(self, cube, classe):
+        """
+        Il livello del cubo corrispondente a classe (o a una sua superclasse)
+        """
+        for c in [classe] + self.get_superclasses(classe):
+            if c in cube.levels:
+                return c
+        raise KeyError(f"{classe} is not above {cube.leaf_class}")
 
     def get_elected(self, lane=None, polEnt=None):
         """
@@ -94,25 +338,70 @@ class ActHub:
     def add_lane_tail(self, lane_name, class_name):
         self.lane_tails[lane_name] = class_name
 
+    def get_synonyms(self, classe):
+        """
+        Restituisce una tupla con classe e tutte le sue sottoclassi (anche
+        indirette), senza modificare self.subclasses
+        """
+        if classe not in self.synonyms:
+            res = [classe]
+            for i in res:
+                res.extend(sub for sub in self.subclasses.get(i, []) if sub not in res)
+            self.synonyms[classe] = tuple(res)
+        return self.synonyms[classe]
+
     def get_political_subs(self, sup, sub_type, *, strict=False, actual=False):
         """
         sup è un'istanza
         sub_type è un nome di classe
+
+        Restituisce un frozenset di nomi o, se actual, una tupla di istanze
         """
+        key = (sup.name, sub_type, strict, actual)
+        if key in self.pol_cache:
+            return self.pol_cache[key]
+
         if actual:
-            l = self.get_political_subs(sup, sub_type, strict=strict, actual=False)
-            return [self.get_instance("PolEnt", i) for i in l]
+            res = tuple(self.get_instance("PolEnt", i)
+                        for i in self.get_political_subs(sup, sub_type, strict=strict))
+        elif strict:
+            res = frozenset(self.pol.get(sup.name, {}).get(sub_type, ()))
+        else:
+            subs = self.pol.get(sup.name, {})
+            res = frozenset(el for typ in self.get_synonyms(sub_type) for el in subs.get(typ, ()))
 
-        if strict:
-            return self.pol.get(sup.name, {}).get(sub_type, {})
+        self.pol_cache[key] = res
+        return res
 
-        synonims = self.subclasses.get(sub_type, [])
-        synonims.append(sub_type)
+    def get_political_sups(self, sub, sub_type=None):
+        """
+        sub è un'istanza o un nome
+        sub_type è il nome della classe di sub (o di una sua superclasse),
+        se None considera tutte le classi
+
+        Restituisce un frozenset con i nomi delle entità politiche a cui sub appartiene
+        """
+        name = sub if type(sub) == str else sub.name
+        sups = self.pol_sups.get(name, {})
+        if sub_type is None:
+            return frozenset(el for v in sups.values() for el in v)
+        return frozenset(el for typ in self.get_synonyms(sub_type) for el in sups.get(typ, ()))
+
+    def get_political_table(self, sup_class, sub_type):
+        """
+        sup_class, sub_type: nomi di classi politiche
 
-        return {el for typ in synonims for el in self.get_political_subs(sup,
-                                                                         typ,
-                                                                         strict=True,
-                                                                         actual=actual)}
+        Restituisce un dataframe con colonne sup_class e sub_type, una riga per ogni
+        istanza di sup_class e ogni entità di tipo sub_type che le appartiene,
+        ordinate per nome. Come get_political_subs è ricalcolato solo quando
+        cambiano le appartenenze
+        """
+        key = ('table', sup_class, sub_type)
+        if key not in self.pol_cache:
+            rows = [(sup, sub) for sup in sorted(self.get_instances(sup_class))
+                    for sub in sorted(self.get_political_subs(self.get_instance('PolEnt', sup), sub_type))]
+            self.pol_cache[key] = pd.DataFrame(rows, columns=[sup_class, sub_type])
+        return self.pol_cache[key]
 
     def add_political_sub(self, sub, sup, typ):
         o_sup = self.pol.get(sup, {})
@@ -124,33 +413,125 @@ class ActHub:
 
         self.pol[sup] = o_sup
 
+        self.pol_sups.setdefault(sub, {}).setdefault(typ, set()).add(sup)
+        self.pol_cache = {}
+
+    def freeze_classes(self):
+        """
+        Da chiamare una volta registrate tutte le classi: precalcola i percorsi
+        tra ogni coppia di classi collegate da subs_relations.
+        Una successiva add_subdiv invalida la cache
+        """
+        self.paths = {}
+        for sup_t in self.subs_relations:
+            self._compute_paths(sup_t, ())
+
+    def _compute_paths(self, sup_t, visiting):
+        """
+        Restituisce {sub_t: percorso} per ogni classe raggiungibile da sup_t,
+        a parità di destinazione sceglie lo stesso percorso della visita in
+        profondità (prima le suddivisioni dirette, poi nell'ordine di
+        dichiarazione)
+        """
+        if sup_t in self.paths:
+            return self.paths[sup_t]
+
+        direct = self.subs_relations.get(sup_t, {})
+        res = {sub_t: (sub_t,) for sub_t in direct}
+        for i in direct:
+            if i in visiting or i == sup_t:
+                continue
+            for sub_t, path in self._compute_paths(i, visiting + (sup_t,)).items():
+                if sub_t not in res:
+                    res[sub_t] = (i,) + path
+
+        self.paths[sup_t] = res
+        return res
+
+    def get_paths(self, sup_t):
+        if self.paths is None:
+            self.freeze_classes()
+        if sup_t not in self.paths:
+            return self._compute_paths(sup_t, ())
+        return self.paths[sup_t]
+
     def get_path(self, sup_t, sub_t):
-        if sub_t in self.subs_relations[sup_t]:
-            return [sub_t]
+        return list(self.get_paths(sup_t).get(sub_t, ()))
+
+    def build_hierarchy(self):
+        """
+        Costruisce l'indice della gerarchia geografica, va chiamata una volta
+        caricate tutte le istanze (viene comunque richiamata automaticamente
+        se l'indice non è aggiornato)
 
-        for i in self.subs_relations[sup_t].keys():
-            v = self.get_path(i, sub_t)
-            if v != []:
-                return [i] + v
-        return []
+        Per ogni istanza con suddivisioni salva, per ogni classe raggiungibile,
+        la tupla dei nomi delle suddivisioni; per ogni suddivisione salva, per
+        ogni classe superiore, il nome della superdivisione
+        """
+        self.descendants = {}
+        self.ancestors = {}
+        self.subdivision_instances = {}
+
+        for sup_type in self.subs_relations:
+            for name in self.instances_dict.get(sup_type, {}):
+                self._collect_descendants(sup_type, name)
+
+        for (sup_type, sup_name), per_class in self.descendants.items():
+            sups = [sup_type] + self.get_superclasses(sup_type)
+            for sub_class, names in per_class.items():
+                for n in names:
+                    anc = self.ancestors.setdefault((sub_class, n), {})
+                    for sup in sups:
+                        anc.setdefault(sup, sup_name)
+
+    def _collect_descendants(self, typ, name):
+        """
+        Calcola (e memorizza in self.descendants) le suddivisioni di ogni
+        livello dell'istanza name di classe typ, seguendo i percorsi di get_path
+        """
+        key = (typ, name)
+        if key in self.descendants:
+            return self.descendants[key]
+
+        inst = self.instances_dict.get(typ, {}).get(name)
+        if inst is None:
+            return {}
+
+        res = {}
+        for sub_class, path in self.get_paths(typ).items():
+            children = tuple(self.get_subdivisions_direct(inst, path[0], False))
+            if len(path) == 1:
+                res[sub_class] = children
+            else:
+                res[sub_class] = tuple(n for child in children
+                                       for n in self._collect_descendants(path[0], child).get(sub_class, ()))
+
+        self.descendants[key] = res
+        return res
 
     def get_subdivisions(self, sup, sub_class, instance=False):
-        #print("Get sub")
-        typ = None
-        inst = sup
+        """
+        sup: o un'istanza di una geoEnt, o una tupla (nomeClasse, nomeIstanza)
+        sub_class: nome classe target, anche su più livelli
+
+        return: tupla di nomi (o di istanze se instance è True)
+        """
         if type(sup) == tuple:
-            typ = sup[0]
-            inst = self.get_instance(typ, sup[1])
+            typ, name = sup
         else:
-            typ = sup.type
-            name = sup.name
+            typ, name = sup.type, sup.name
+
+        if self.descendants is None:
+            self.build_hierarchy()
 
-        path = self.get_path(typ, sub_class)
-        ents = [inst]
-        for i in path[:-1]:
-            ents = [j for en in ents for j in self.get_subdivisions_direct(en, i, True)]
+        if not instance:
+            return self.descendants[(typ, name)][sub_class]
 
-        return [j for en in ents for j in self.get_subdivisions_direct(en, sub_class, instance)]
+        key = (typ, name, sub_class)
+        if key not in self.subdivision_instances:
+            names = self.descendants[(typ, name)][sub_class]
+            self.subdivision_instances[key] = tuple(self.get_instance(sub_class, n) for n in names)
+        return self.subdivision_instances[key]
 
     def get_subdivisions_direct(self, sup, sub_class, instance):
         typ = None
@@ -198,6 +579,33 @@ class ActHub:
         ex = self.subclasses.get(superclass, [])
         ex.append(subclass)
         self.subclasses[superclass] = ex
+        self.synonyms = {}
+        self.pol_cache = {}
+
+        sups = self.superclasses.get(subclass, [])
+        if superclass not in sups:
+            sups.append(superclass)
+        self.superclasses[subclass] = sups
+
+        # le istanze già registrate della sottoclasse diventano visibili
+        # anche dalla nuova superclasse (e dalle sue superclassi)
+        for inst_name, instance in self.instance_index.get(subclass, {}).items():
+            for sup in [superclass] + self.get_superclasses(superclass):
+                self.instance_index.setdefault(sup, {}).setdefault(inst_name, instance)
+
+    def get_superclasses(self, classe):
+        """
+        Restituisce tutte le superclassi (dirette e indirette) di classe
+        """
+        res = []
+        to_visit = list(self.superclasses.get(classe, []))
+        while to_visit:
+            sup = to_visit.pop(0)
+            if sup in res or sup == classe:
+                continue
+            res.append(sup)
+            to_visit.extend(self.superclasses.get(sup, []))
+        return res
 
     def get_instances(self, classe, strict=False):
         #print("Get instances: ", classe, strict)
@@ -219,38 +627,41 @@ class ActHub:
 
         return nome istanza target
         """
-        tops = self.get_instances(sup_name)
-        typ = None
-        inst = sub
         if type(sub) == tuple:
-            typ = sub[0]
-            name = sub[1]
-            inst = self.get_instance(typ, sub[1])
+            typ, name = sub
         else:
-            typ = sub.type
-            name = sub.name
+            typ, name = sub.type, sub.name
+
+        if self.descendants is None:
+            self.build_hierarchy()
 
-        for i in tops:
-            if name in self.get_subdivisions((sup_name, i), typ):
-                return i
-        raise KeyError("No such superdivision")
+        try:
+            return self.ancestors[(typ, name)][sup_name]
+        except KeyError:
+            raise KeyError("No such superdivision")
 
     def add_instance(self, class_name, inst_name, instance):
         instances = self.instances_dict.get(class_name, {})
         instances[inst_name] = instance
         self.instances_dict[class_name] = instances
 
-    def get_instance(self, class_name, inst_name):
-
-        #print("Getting instance", class_name, inst_name)
-        subs = self.subclasses.get(class_name, [])
+        # l'indice della gerarchia va ricostruito
+        self.descendants = None
+        self.ancestors = None
+        self.pol_cache = {}
 
-        for i in subs:
-            if inst_name in self.get_instances(i):
-                return self.instances_dict[i][inst_name]
+        # indicizzo l'istanza sotto la sua classe e sotto tutte le superclassi,
+        # in caso di omonimi tra sottoclassi vince la prima registrata
+        self.instance_index.setdefault(class_name, {})[inst_name] = instance
+        for sup in self.get_superclasses(class_name):
+            self.instance_index.setdefault(sup, {}).setdefault(inst_name, instance)
 
-        
-        return self.instances_dict[class_name][inst_name]
+    def get_instance(self, class_name, inst_name):
+        """
+        Restituisce l'istanza inst_name della classe class_name o di una
+        delle sue sottoclassi, solleva KeyError se non esiste
+        """
+        return self.instance_index[class_name][inst_name]
 
     def add_subdiv(self, sup_type, sub_type, var_name):
         """
@@ -261,7 +672,12 @@ class ActHub:
         sup_dict[sub_type] = var_name
         self.subs_relations[sup_type] = sup_dict
 
-    def register_lane(self, name, head_class, order):
+        # il grafo delle classi è cambiato, invalido i percorsi e la gerarchia
+        self.paths = None
+        self.descendants = None
+        self.ancestors = None
+
+    def register_lane(self, name, head_class, order, concurrent=False):
         # self.lanes è il dizionario che contiene tutte le lane create
         # prende la lane con order passato,
         # se non c'è di default restituisce lista vuota []
@@ -272,6 +688,105 @@ class ActHub:
 
         # aggiunge i valori al dizionario delle lane
         self.lanes[order] = exist
+        if concurrent:
+            self.concurrent_lanes.add(name)
+
+    def lane_footprint(self, head_class):
+        """
+        Le istanze geografiche (classe, nome) su cui una lane con testa head_class
+        può leggere o scrivere: le istanze della testa, le loro suddivisioni e
+        i distretti superiori
+        """
+        if self.descendants is None:
+            self.build_hierarchy()
+        res = set()
+        for n in self.get_instances(head_class):
+            key = (self.get_instance(head_class, n).type, n)
+            res.add(key)
+            res.update(self.ancestors.get(key, {}).items())
+            for sub_class, names in self.descendants.get(key, {}).items():
+                res.update((sub_class, m) for m in names)
+        return res
+
+    def lane_groups(self, lanes):
+        """
+        lanes: le lanes (nome, classe testa) di una stessa priorità
+
+        Restituisce una lista di gruppi (liste di indici in lanes, in ordine),
+        gruppi diversi possono essere eseguiti in parallelo. Le PolEnt toccate
+        da una lane si conoscono solo eseguendola, quindi le lanes sono nello
+        stesso gruppo a meno che non siano concurrent (register_lane): due lanes
+        concurrent sono nello stesso gruppo solo se le loro impronte geografiche
+        si sovrappongono
+        """
+        group = list(range(len(lanes)))  # union-find
+
+        def find(i):
+            while group[i] != i:
+                group[i] = group[group[i]]
+                i = group[i]
+            return i
+
+        owner = {}
+        serial = None
+        for i, (l_n, h_c) in enumerate(lanes):
+            if l_n not in self.concurrent_lanes:
+                if serial is None:
+                    serial = i
+                group[find(i)] = find(serial)
+            for key in self.lane_footprint(h_c):
+                if key in owner:
+                    group[find(i)] = find(owner[key])
+                else:
+                    owner[key] = i
+
+        res = {}
+        for i in range(len(lanes)):
+            res.setdefault(find(i), []).append(i)
+        return sorted(res.values())
+
+    def run_lane(self, l_n, h_c):
+        """
+        Esegue la lane l_n su tutte le istanze della classe testa h_c,
+        restituisce la lista piatta delle istruzioni
+        """
+        instances = self.get_instances(h_c)
+        instances = [self.get_instance(h_c, n_i) for n_i in instances]
+        return [instruction for inst in instances for instruction in inst.exec_lane(l_n)]
+
+
+def get_hub():
+    """
+    L'Hub del contesto corrente, solleva RuntimeError se non ne è stato
+    impostato uno (con load_law, run_simulation o current_hub.set)
+    """
+    hub = current_hub.get()
+    if hub is None:
+        raise RuntimeError("No Hub is bound to the current context: load a law (src.load_law, "
+                           "src.run_simulation) or set one with GlobalVars.current_hub.set(ActHub())")
+    return hub
+
+
+class HubProxy:
+    """
+    Inoltra ogni accesso all'Hub del contesto corrente (vedi current_hub).
+
+    Ogni thread o task asyncio vede l'Hub impostato nel proprio contesto,
+    così più simulazioni possono essere eseguite in parallelo nello stesso
+    processo; metaclassi e classi continuano a usare GlobalVars.Hub.
+    Senza un Hub nel contesto ogni accesso solleva RuntimeError
+    """
+    def __getattr__(self, item):
+        return getattr(get_hub(), item)
+
+    def __setattr__(self, key, value):
+        setattr(get_hub(), key, value)
+
+    def __repr__(self):
+        return f"HubProxy({current_hub.get()!r})"
+
 
+# nessun Hub di default: un Hub condiviso da tutti i contesti mescolerebbe le simulazioni
+current_hub = ContextVar('current_hub', default=None)
 
-Hub = ActHub()
+Hub = HubProxy()
@@ -20,6 +20,7 @@ class candidate(type):
     # TODO: gestire candidati e partiti e coalizioni magari come se fosse una subdivision? Posso usare subdivision come per le geoEnt
     def __new__(mcs, *args, candidate, **kwargs):
         o_init = args[2].get('__init__', lambda *s, **k: None)
+        o_reset = args[2].get('reset_run', lambda *s, **k: None)
 
         def __init__(self, *a, **kwargs):
             self.proposals = []
@@ -27,6 +28,11 @@ class candidate(type):
 
             return o_init(self, *a, **kwargs)
 
+        def reset_run(self):
+            self.proposals = []
+            self.elected = False
+            return o_reset(self)
+
         def propose(self, lane, district, party, iterator, **info):
             if self.elected is not False:
                 try:
@@ -35,24 +41,34 @@ class candidate(type):
                     return None
 
             self.proposals.append((lane, district, party, iterator, info))
+            GlobalVars.Hub.register_offer(self.name)
             return self.name
 
         args[2]['pick'] = mcs.parse_pick(**candidate)
         args[2]['__init__'] = __init__
         args[2]['propose'] = propose
+        args[2]['reset_run'] = reset_run
         return super().__new__(mcs, *args, **kwargs)
 
     @classmethod
     def parse_pick(mcs, *, info_vars, criteria, **kwargs):
+        """
+        criteria:
+            + first: accetta la prima offerta ricevuta
+            + list: accetta l'offerta minore per le informazioni indicate (la prima
+                è la più importante), a parità la prima ricevuta
+            + str: una funzione proposals -> (accettata, rifiutate)
+
+        Le offerte rifiutate sono passate, nell'ordine in cui sono arrivate, ai
+        candidati successivi delle liste
+        """
         if criteria == "first":
             def pick_fun(proposals):
                 return proposals[0], proposals[1:]
         elif type(criteria) == list:
             def pick_fun(proposals):
-                props = proposals
-                for i in criteria:
-                    props = sorted(proposals, key=lambda x: x[4][i])
-                return props[0], props[1:]
+                best = min(range(len(proposals)), key=lambda j: tuple(proposals[j][4][i] for i in criteria))
+                return proposals[best], proposals[:best] + proposals[best + 1:]
         else:
             pick_fun = eval(criteria)
 
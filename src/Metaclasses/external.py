@@ -114,6 +114,8 @@ class external(type):
             def give(self, val):
                 # print("Adding ", val, " come ", var)
                 setattr(self, var, val)
+                src.GlobalVars.Hub.update_table(self, var, val)
+                src.GlobalVars.Hub.invalidate_totals()
 
             return var, give
 
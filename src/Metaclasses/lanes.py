@@ -1,12 +1,29 @@
 # -*- coding: utf-8 -*-
+import functools
+
 import pandas as pd
 import src.GlobalVars
+import src.parallel
 import src.utils
 import src.Commons
 from src import Commons
 
 commons = Commons
 
+
+def propose_subdivision(sub_level, collect_type, general_info, distribution, item):
+    """
+    La propose di collect_type sulla suddivisione item = (nome, vincolo), il vincolo
+    None non viene passato. È a livello di modulo così può essere inviata ai processi
+    (si veda src.parallel)
+    """
+    name, constraint = item
+    s = src.GlobalVars.Hub.get_instance(sub_level, name)
+    if constraint is None:
+        return s.propose(collect_type, {}, *general_info, distribution=distribution)
+    return s.propose(collect_type, {}, *general_info, constraint=constraint, distribution=distribution)
+
+
 class lanes(type):
     def __new__(mcs, *args, lane=None, lanes_propose=None, **kwargs):
         if lane is None:
@@ -46,7 +63,7 @@ class lanes(type):
     @classmethod
     def parse_operation_lane(mcs, sub_level, *,
                              collect_type, ideal_distribution, corrector, collect_constraints=None,
-                             forward_distribution=False, **kwargs):
+                             forward_distribution=False, execution=None, **kwargs):
         """
         sub_level: Il livello inferiore della lane
         collect_type: il tipo di propose che sarà chiamato sui livelli inferiori
@@ -55,11 +72,18 @@ class lanes(type):
             + str: Il tipo di propose da chiamare
             + dict: dict['source'] è la funzione da chiamare
         corrector: la funzione da chiamare per avere la correzione
+            + str: il nome della funzione
+            + dict: dict['name'] è il nome della funzione, le altre chiavi sono passate come kwargs
+                (quelle con una 'source' sono calcolate nel contesto del distretto)
         collect_constraints:
             + None
             + '$': la distribuzione precedente
             + str: il tipo di propose da chiamare su self
         forward_distribution: se True allora rende irrilevanti le operazioni sulla distribuzione
+        execution: come chiamare propose sui sottolivelli (si veda src.parallel)
+            + None: la strategia del Hub (Hub.set_execution)
+            + str: serial, thread o process
+            + dict: strategy e workers
 
         Genera la funzione di una singola operazione, accetta:
             + locs
@@ -73,6 +97,10 @@ class lanes(type):
             + new_specific_info
         """
         ideal_distr = ideal_distribution
+        corrector_kwargs = {}
+        if type(corrector) == dict:
+            corrector_kwargs = {k: v for k, v in corrector.items() if k != 'name'}
+            corrector = corrector['name']
         corrector = eval(corrector)
 
         def operation_fun(loc, specific_info, info_district, *general_info, distribution):
@@ -84,7 +112,7 @@ class lanes(type):
             distribution: un dataframe con due colonne [Elettore, Seggi] (o equivalenti)
             """
 
-            district = eval("self", globals(), loc)
+            district = loc['self']
 
             subs = src.GlobalVars.Hub.get_subdivisions(district, sub_level)
             gen_info_new = {}
@@ -107,22 +135,16 @@ class lanes(type):
             #
             general_info_lower_lvl = [info_district] + list(general_info)
 
-            def get_proposal(name, *gen_info):
-                s = src.GlobalVars.Hub.get_instance(sub_level, name)
-                if collect_constraints is None:
-                    distr, loc_info_new = s.propose(collect_type, {}, *general_info_lower_lvl, distribution=ideal_distrib_dynamic)
-                elif collect_constraints == '$':
-                    constr = distribution.get(name, pd.DataFrame())
-                    distr, loc_info_new = s.propose(collect_type, {}, *general_info_lower_lvl,
-                                                    constraint=constr,
-                                                    distribution=ideal_distrib_dynamic)
-                else:
-                    constr = district.propose(collect_constraints, *general_info_lower_lvl, distribution=ideal_distrib_dynamic)
-                    distr, loc_info_new = s.propose(collect_type, {}, *general_info_lower_lvl,
-                                                    constraint=constr,
-                                                    distribution=ideal_distrib_dynamic)
-
-                return distr, loc_info_new
+            if collect_constraints is None:
+                items = [(name, None) for name in subs]
+            elif collect_constraints == '$':
+                items = [(name, distribution.get(name, pd.DataFrame())) for name in subs]
+            else:
+                # propose non ha effetti collaterali, il vincolo del distretto è calcolato una volta
+                constr = district.propose(collect_constraints, *general_info_lower_lvl, distribution=ideal_distrib_dynamic)
+                items = [(name, constr) for name in subs]
+            get_proposal = functools.partial(propose_subdivision, sub_level, collect_type,
+                                             general_info_lower_lvl, ideal_distrib_dynamic)
             # FIXME: AGGIUSTARE TUTTO QUI
             #        PASSO LOCAL, DISTRIC, GENERAL RICEVO NEW LOCAL DA PROPOSE, NEW LOC E NEW DISTRICT DA CORRECT
             o_distr = distribution
@@ -130,8 +152,9 @@ class lanes(type):
             new_general = {}
             new_specific = {}
             # print("line 147, subs= ", subs)
-            for i in subs:
-                n_dist, n_spec = get_proposal(i, *general_info)
+            strategy, workers = src.parallel.parse_execution(execution, src.GlobalVars.Hub.execution)
+            proposals = src.parallel.map_ordered(get_proposal, items, strategy, workers)
+            for i, (n_dist, n_spec) in zip(subs, proposals):
                 distribution[i] = n_dist
                 new_specific[i] = n_spec
 
@@ -141,9 +164,12 @@ class lanes(type):
                 d_t.update(v)
                 specific_cumulative[k] = d_t
 
+            corr_kwargs = {k: v['source'](loc) if type(v) == dict and 'source' in v else v
+                           for k, v in corrector_kwargs.items()}
             correct_distr, new_loc,  new_gen = corrector(district, ideal_distrib_dynamic,
                                                         distribution,
-                                                        specific_cumulative, *general_info_lower_lvl)
+                                                        specific_cumulative, *general_info_lower_lvl,
+                                                        **corr_kwargs)
 
             for k, v in info_district.items():
                 d = new_gen.get(k, {})
@@ -489,12 +515,14 @@ class lanes(type):
         return exec_lane_node
 
     @classmethod
-    def parse_lane_head(mcs, lane_name, *, first_input, order_number, class_name, **kwargs):
+    def parse_lane_head(mcs, lane_name, *, first_input, order_number, class_name, concurrent=False, **kwargs):
         """
         lane_name:
         first_input: il nome della propose da usare per primo input
         order_number: Il numero di priorità, lane con numeri minori vengono eseguite prima di lane con numeri maggiori
         class_name: il nome della classe
+        concurrent: se True la lane può essere eseguita in parallelo alle altre con lo stesso order_number,
+            da usare solo se non condivide PolEnt con le altre lanes
 
         La head, usa distribution per generare una distribuzione ideale e poi la modifica con le operazioni
         """
@@ -532,7 +560,8 @@ class lanes(type):
 
 
         # questa riga aggiungere la nuova lane alle registro delle lane
-        src.GlobalVars.Hub.register_lane(name=lane_name, head_class=class_name, order=order_number)
+        src.GlobalVars.Hub.register_lane(name=lane_name, head_class=class_name, order=order_number,
+                                         concurrent=concurrent)
 
         # questa riga fa andare la funzione parse_lane_node,
         # la funzione può essere trovata in questo file,
@@ -566,17 +595,20 @@ class lanes(type):
             return f(self, lane_name, info, distribution=distribution)
         return exec_head
     @classmethod
-    def parse_lane_only(mcs, lane_name, *, distribution, order_number, class_name, **kwargs):
+    def parse_lane_only(mcs, lane_name, *, distribution, order_number, class_name, concurrent=False, **kwargs):
         """
         lane_name:
         distribution: il nome della propose da usare
         order_number:
         class_name:
+        concurrent: se True la lane può essere eseguita in parallelo alle altre con lo stesso order_number,
+            da usare solo se non condivide PolEnt con le altre lanes
 
         Genera la funzione che fa' tutto in una lane single-step
         """
 
-        src.GlobalVars.Hub.register_lane(name=lane_name, head_class=class_name, order=order_number)
+        src.GlobalVars.Hub.register_lane(name=lane_name, head_class=class_name, order=order_number,
+                                         concurrent=concurrent)
 
         distr_name = distribution
         f = mcs.parse_lane_tail(lane_name, class_name=class_name, **kwargs)
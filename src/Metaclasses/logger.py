@@ -5,6 +5,7 @@ class logger(type):
     def __new__(mcs, *args, **kwargs):
         o_log = args[2].get('log', lambda *a, **k: None)
         o_init = args[2].get('__init__', lambda *a, **k: None)
+        o_reset = args[2].get('reset_run', lambda *a, **k: None)
 
         def log(self, district, lane_name, **info):
             '''
@@ -37,9 +38,14 @@ class logger(type):
             self.logs = {}
             return o_init(self, *a, **k)
 
+        def reset_run(self):
+            self.logs = {}
+            return o_reset(self)
+
         args[2]['log'] = log
         args[2]['get_log'] = get_log
         args[2]['__init__'] = __init__
+        args[2]['reset_run'] = reset_run
         return super().__new__(mcs, *args, **kwargs)
 
     @classmethod
@@ -1,9 +1,44 @@
+import builtins
 from copy import deepcopy
+from operator import attrgetter
 import src.utils
 from src import Commons
 commons = Commons
 
 
+def compile_accessor(name):
+    """
+    Compiles the name of a source (`self.method`, `commons.function`, `self.attr.key`)
+    once, at class creation. Returns a function accepting the local namespace and
+    returning the object named.
+
+    A dotted path is resolved with a lookup of the root (local namespace, then the
+    globals of this module, then builtins) followed by a chain of getattr,
+    any other expression is compiled and evaluated in the same namespaces
+    """
+    parts = name.split('.')
+    if not all(p.isidentifier() for p in parts):
+        code = compile(name, '<source>', 'eval')
+
+        def evaluated(local):
+            return eval(code, globals(), local)
+        return evaluated
+
+    root = parts[0]
+    getter = attrgetter('.'.join(parts[1:])) if len(parts) > 1 else None
+    glob = globals()
+
+    def resolve(local):
+        if root in local:
+            obj = local[root]
+        elif root in glob:
+            obj = glob[root]
+        else:
+            obj = getattr(builtins, root)
+        return obj if getter is None else getter(obj)
+    return resolve
+
+
 def function_arg_parser(source_parser, name, args=None,
                         kwargs=None, **other_confs):
     """
@@ -12,10 +47,10 @@ def function_arg_parser(source_parser, name, args=None,
         + *args
         + **kwargs
     And returns the value
-    The function is a string evaluated at runtime in the
+    The function is a string resolved at runtime in the
     context of the instance. Therefore it can be a method
     like `self.method` or a third function in Commons like
-    `commons.function`
+    `commons.function`, the name is compiled once by compile_accessor
     """
     # print("Parsing fun: ", name, args, kwargs, other_confs)
     if args is None:
@@ -23,7 +58,7 @@ def function_arg_parser(source_parser, name, args=None,
     if kwargs is None:
         kwargs = {}
 
-    fun = deepcopy(name)
+    fun = compile_accessor(name)
     args = deepcopy(args)
     kwargs = deepcopy(kwargs)
 
@@ -38,13 +73,7 @@ def function_arg_parser(source_parser, name, args=None,
         eff_args = eff_args + list(n_args)
         eff_kwargs.update(n_kwargs)
 
-        globs = globals()
-        globs['Commons'] = src.Commons
-        globs['commons'] = src.Commons
-
-        f = eval(fun, globs, local)
-
-        return f(*eff_args, **eff_kwargs)
+        return fun(local)(*eff_args, **eff_kwargs)
     return return_fun
 
 
@@ -53,12 +82,14 @@ def attribute_arg_parser(source_parser, name, **other_confs):
     Returns a function accepting a namespace, *args and **kwargs, ignores the ?args and
     returns the value
 
-    As in the function case the name is evaluated at runtime in
+    As in the function case the name is resolved at runtime in
     the context of the instance
     """
+    accessor = compile_accessor(name)
+
     def return_fun(local, *args, **kwargs):
         # print("Locals prima di trovare l'attributo: ", local)
-        return eval(name, globals(), local)
+        return accessor(local)
 
     return return_fun
 
@@ -50,9 +50,13 @@ class superdivision(type):
             src.GlobalVars.Hub.add_subdiv(args[0], info['type'], name)
 
             # functions ha una lista di dizionari {name: nome_funz, source: <funzione>}
+            # o {name: nome_funz, cube: {table, fields, keys}}
             for i in info['functions']:
-                args[2][f"subs_{name}_{i['name']}"] = superdivision.generate_accessor(info['type'],
-                                                                               i['source'])
+                if 'cube' in i:
+                    acc = superdivision.generate_cube_accessor(info['type'], **i['cube'])
+                else:
+                    acc = superdivision.generate_accessor(info['type'], i['source'])
+                args[2][f"subs_{name}_{i['name']}"] = acc
 
         kwargs['external'] = dict_external
         # print("After superdivision: ", args, kwargs)
@@ -88,6 +92,21 @@ class superdivision(type):
 
         return accessor
 
+    @staticmethod
+    def generate_cube_accessor(classe_oggetti, table, fields, keys):
+        """
+        Come generate_accessor, ma i dati delle suddivisioni sono i totali del
+        VoteCube (vedi src.cube) per ognuna di esse, in un solo dataframe.
+        Gli argomenti della chiamata sono ignorati
+        """
+        def accessor(self, *args, **kwargs):
+            hub = src.GlobalVars.Hub
+            cube = hub.get_cube(table, fields, keys)
+            names = hub.get_subdivisions(self, classe_oggetti)
+            return cube.subdivisions_frame(hub.get_cube_level(cube, classe_oggetti), names)
+
+        return accessor
+
     @staticmethod
     def parse_conf(configuration):
         return configuration
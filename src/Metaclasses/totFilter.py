@@ -1,215 +1,401 @@
+import numpy as np
+import pandas as pd
+
 import src.GlobalVars
 from src import Commons
+from src.Metaclasses import sources_parse
 
 commons = Commons
 
+CRITERIA = {
+    'gt': np.greater,
+    'ge': np.greater_equal,
+    'lt': np.less,
+    'le': np.less_equal,
+    'eq': np.equal,
+}
 
-class totFilter(type):
+
+class _Context:
     """
-    Le classi con questa meta hanno la funzione filter(self, inst_geo, type_tot, row, df)
-
-    Parametri passati a filter:
-        + district_inst, totals_type, row, full_df, sbarramenti
-
-    Un filtro può essere:
-    + condizione
-    + predicato composto da altri filtri della stessa PolEnt
-    + un filtro di un'altra polEnt a cui passo solo district
-
-    Inoltre posso specificare se un filtro è memoizable (il filtro restituisce sempre
-    lo stesso valore indipendentemente da come è chiamato
-
-    Infine potrei dover fare un rebase, che vuol dire spostarmi in un livello geografico
-    superiore
-
-    Che dati uso?
-
-    Ho a disposizione:
-        + Il distretto
-        + Il nome della funzione
-        + la linea specifica
-        + il dataframe completo
-        + la lista degli sbarramenti
-
-    1. Se sbarramenti è una lista procedo in ordine, devono essere verificati tutti
-    2. Se non è una lista allora procedo
-
-    Lista eletta:
-        type: dataframe
-        rebase: Nazione
-        source:
-            totals: Liste
-        column: Voti
-        criteria: gt
-        logic: relative
-        target: 0.03
-
-    Coalizione partiti:
-        type: filter_map
-        criteria: any
-        filter: eletto
-        targets: Partiti # trova i partiti sottostanti la coalizione
-
-    Coalizione soglia:
-        rebase: Nazione
-        source:
-            totals: Coalizione
-        criteria
-
-    Coalizione eletta:
-        and:
-            - fil1
-            - not: fil2
-            - or:
-                - fil3
-                - fil4
+    Quello che serve a valutare un filtro: il distretto (già spostato dal rebase),
+    il dataframe del totals e per ogni riga il nome della PolEnt a cui è riferita
     """
+    __slots__ = ('district', 'total', 'dataframe', 'names', 'cls')
 
-    @classmethod
-    def parse_tot(mcs, old_filter, *, filters):
-        filt_dict = {name: mcs.parse_filter_action(name, **d) for name, d in filters.items()}
-        # parse_filter_action restituisce due funnzioni, la prima dice se devo applicare il filtro a questo livello
-        # (prende in input district e total)
-        # la seconda applica il filtro
-        old_filter = lambda *x: None
-
-        def filter(self, district, *, total=None, row=None, dataframe=None, sbarramenti):
-            if type(sbarramenti) == list:
-                for i in sbarramenti:
-                    if not self.filter(district, total=total, row=row, dataframe=dataframe, sbarramenti=i):
-                        return False
-                return True
-            if sbarramenti not in filt_dict:
-                return old_filter(self, district, total, row, dataframe, sbarramenti)
-
-            apply_check, filter_f = filt_dict[sbarramenti]
-            if apply_check(district=district, total=total):
-                return filter_f(self, district, total=total,
-                                row=row,
-                                dataframe=dataframe,
-                                sbarramenti=sbarramenti)
-            else:
-                return True
+    def __init__(self, district, total, dataframe, names, cls):
+        self.district = district
+        self.total = total
+        self.dataframe = dataframe
+        self.names = names
+        self.cls = cls
 
-        return filter
+    def replace(self, **kwargs):
+        d = {k: getattr(self, k) for k in self.__slots__}
+        d.update(kwargs)
+        return _Context(**d)
 
-    @classmethod
-    def parse_filter_function_wrapper(mcs, filter_name, *, memoizable=False, rebase=None, **conf):
 
-        act_filt = mcs.parse_filter_function(filter_name, **conf)
+def _as_source(source):
+    # nelle classi python la conf non passa da source_parse
+    if source is None or callable(source):
+        return source
+    return sources_parse.source_parse({'source': source})['source']
 
-        def filter(self, district, **kwargs):
-            if memoizable:
-                if filter_name in self.memoized:
-                    return self.memoized[filter_name]
 
-            if rebase is not None:
-                district = src.GlobalVars.Hub.get_superdivision(district, rebase)
-                district = src.GlobalVars.Hub.get_instance(rebase, district)
-                kwargs.pop('dataframe')
+def _by_entity(names, mask):
+    """
+    Da una maschera per riga a un dizionario nome: valore, una PolEnt con più
+    righe supera il filtro se ne supera almeno una
+    """
+    return pd.Series(mask, index=names).groupby(level=0, sort=False).any().to_dict()
+
+
+def _class_masks(ctx, sbarramento):
+    """
+    Valuta lo sbarramento di ogni riga con il filtro della classe della PolEnt
+    della riga (le righe delle classi che non lo definiscono passano)
+    """
+    hub = src.GlobalVars.Hub
+    res = np.ones(len(ctx.names), dtype=bool)
+    classes = {}
+    for i, n in enumerate(ctx.names):
+        classes.setdefault(type(hub.get_instance("PolEnt", n)), []).append(i)
+
+    for cls, idx in classes.items():
+        filters = getattr(cls, '_tot_filters', {})
+        if sbarramento in filters:
+            res[idx] = filters[sbarramento](ctx.replace(cls=cls))[idx]
+    return res
 
-            res = act_filt(self, district, **kwargs)
-            if memoizable:
-                self.memoized[filter_name] = res
 
+class totFilter(type):
+    """
+    Le classi con questa meta hanno filter e filter_batch (si veda filter_mask in
+    totals) definiti dalla conf filters, un dizionario nome sbarramento: filtro.
+
+    Ogni filtro è compilato una volta sola in una funzione che, dato il dataframe
+    del totals, restituisce la maschera booleana delle righe che lo superano.
+    filter, chiamato riga per riga sullo stesso dataframe, riusa la maschera
+    dell'ultimo dataframe (finché non cambiano distretto, sbarramenti o dati).
+
+    Un filtro può avere:
+        + levels: i tipi di distretto in cui si applica, negli altri passano tutti
+        + totals: i totals a cui si applica, negli altri passano tutti
+        + rebase: il filtro è valutato nel distretto superiore di questo tipo
+        + memoizable: il valore dipende solo dalla PolEnt e non dalla riga, viene
+            calcolato una volta per distretto (fino a quando cambiano i dati o a reset_run)
+        + filter: il nodo da valutare, se manca il nodo sono le altre chiavi
+
+    I nodi sono:
+        + value: confronta una colonna con target
+            column, criteria (gt, ge, lt, le, eq), target
+            logic: absolute o relative (rispetto al totale della colonna, o dei
+                gruppi relative_to)
+            group: colonne su cui sommare column prima del confronto
+            aggregate: come aggregare i gruppi (default sum, size conta le righe)
+            source: se c'è il confronto è fatto sul dataframe di source e le righe
+                sono collegate da column_key (default la prima colonna)
+        + membership: la colonna (default il nome della PolEnt) è in values, o
+            nella lista restituita da source
+        + delegate: il filtro sbarramento della PolEnt nella variabile variable
+        + map: il filtro sbarramento sulle PolEnt di tipo subs sottostanti, con
+            how any/all/less/more/exactly e count, su source o sul dataframe
+        + and/or (liste) e not: predicati, gli elementi sono nodi o nomi di altri
+            filtri della stessa classe
+
+    Esempio:
+        filters:
+          elette:
+            levels: [Nazione]
+            filter:
+              or:
+                - type: value
+                  column: Voti
+                  group: [Partito]
+                  logic: relative
+                  criteria: gt
+                  target: 0.04
+                - and:
+                  - not:
+                      type: membership
+                      column: Coalizione
+                      values: [NO COALIZIONE]
+                  - type: value
+                    column: Voti
+                    group: [Coalizione]
+                    logic: relative
+                    criteria: gt
+                    target: 0.1
+
+    Se sbarramenti contiene più nomi devono essere superati tutti, quelli che non
+    sono in filters sono ignorati. Se nessuno è in filters si usano il filter e
+    filter_batch definiti nella classe, se ci sono.
+    """
+    def __new__(mcs, *args, filters=None, **kwargs):
+        if filters is None:
+            filters = {}
+
+        compiled = dict(args[2].get('_tot_filters', {}))
+        for name, conf in filters.items():
+            compiled[name] = mcs.parse_filter(name, compiled, **conf)
+        args[2]['_tot_filters'] = compiled
+
+        o_filter = args[2].get('filter', lambda *x, **k: True)
+        o_reset = args[2].get('reset_run', lambda *a, **k: None)
+        o_batch = args[2].get('filter_batch', None)
+        if isinstance(o_batch, classmethod):
+            o_batch = o_batch.__func__
+
+        def known(sbarramenti):
+            if type(sbarramenti) == str:
+                sbarramenti = (sbarramenti,)
+            return [i for i in sbarramenti if i in compiled]
+
+        def batch_mask(cls, district, total, dataframe, names, sbarr):
+            # un solo contesto per tutti gli sbarramenti, ogni nome è valutato una volta
+            ctx = _Context(district, total, dataframe, names, cls)
+            res = np.ones(len(dataframe), dtype=bool)
+            for i in dict.fromkeys(sbarr):
+                res &= compiled[i](ctx)
             return res
 
-        return filter
+        def filter_batch(cls, district, *, total=None, dataframe, rows=None, sbarramenti, **kwargs):
+            sbarr = known(sbarramenti)
+            if not sbarr:
+                if o_batch is not None:
+                    return o_batch(cls, district, total=total, dataframe=dataframe, rows=rows,
+                                   sbarramenti=sbarramenti, **kwargs)
+                hub = src.GlobalVars.Hub
+                res = np.ones(len(dataframe), dtype=bool)
+                sel = np.ones(len(dataframe), dtype=bool) if rows is None else np.asarray(rows, dtype=bool)
+                for i in np.flatnonzero(sel):
+                    r = dataframe.iloc[i]
+                    res[i] = o_filter(hub.get_instance("PolEnt", r.iloc[0]), district, total=total, row=r,
+                                      dataframe=dataframe, sbarramenti=sbarramenti)
+                return res
+            names = dataframe.iloc[:, 0].to_numpy()
+            return batch_mask(cls, district, total, dataframe, names, sbarr)
+
+        # l'ultima maschera calcolata da filter: (chiave, dataframe, maschera), filter è
+        # chiamato riga per riga sullo stesso dataframe e la maschera è calcolata una volta
+        last = [None]
+
+        def filter(self, district, *, total=None, row=None, dataframe=None, sbarramenti, **kwargs):
+            sbarr = known(sbarramenti)
+            if not sbarr:
+                return o_filter(self, district, total=total, row=row, dataframe=dataframe,
+                                sbarramenti=sbarramenti, **kwargs)
+            if dataframe is None:
+                dataframe = pd.DataFrame([row]) if row is not None else pd.DataFrame({'PolEnt': [self.name]})
+            names = dataframe.iloc[:, 0].to_numpy()
+            key = (type(self), district.type, district.name, total, tuple(sbarr), src.GlobalVars.Hub.data_version)
+            hit = last[0]
+            if hit is not None and hit[0] == key and hit[1] is dataframe:
+                mask = hit[2]
+            else:
+                mask = batch_mask(type(self), district, total, dataframe, names, sbarr)
+                last[0] = (key, dataframe, mask)
+            if row is None:
+                return bool(mask[names == self.name].any())
+            return bool(mask[dataframe.index.get_loc(row.name)])
+
+        def reset_run(self):
+            # i valori memorizzati dai filtri e l'ultima maschera di filter valgono per una sola esecuzione
+            for f in compiled.values():
+                f.reset()
+            last[0] = None
+            return o_reset(self)
+
+        args[2]['filter'] = filter
+        args[2]['filter_batch'] = classmethod(filter_batch)
+        args[2]['reset_run'] = reset_run
+        return super().__new__(mcs, *args, **kwargs)
 
     @classmethod
-    def parse_value_filter(mcs, *, source=None, column_key=None, column, criteria, logic='absolute', target):
+    def parse_filter(mcs, name, compiled, *, levels=None, totals=None, rebase=None, memoizable=False,
+                     filter=None, **node):
         """
-        source: se None uso il dataframe fornito, si supponga che self sia un distretto geografico
-        column_key: solo se uso source, mi dice quale colonna guardare per identificare la linea
-        La colonna deve essere la stessa per la row e per il df
-        column: la colonna da confrontare
-        criteria: gt,lt,eq
-        logic: absolute/relative
+        Compila il filtro name, restituisce una funzione ctx -> maschera
         """
-        def value_filter(self, district, *, row, dataframe=None, **kwargs):
-            if source is not None:
-                dataframe = source({'self': district})
-                row = dataframe[dataframe[column_key] == row[column_key]].iloc[0]
+        act = mcs.parse_node(filter if filter is not None else node, compiled)
+        levels = None if levels is None else frozenset(levels)
+        totals = None if totals is None else frozenset(totals)
+        rebased = {}  # (tipo, nome) del distretto: istanza superiore
+        memo = {}  # (tipo, nome) del distretto: (data_version, {PolEnt: valore})
+
+        def apply(ctx):
+            if (levels is not None and ctx.district.type not in levels) or \
+                    (totals is not None and ctx.total not in totals):
+                return np.ones(len(ctx.names), dtype=bool)
+
+            if rebase is not None:
+                key = (ctx.district.type, ctx.district.name)
+                if key not in rebased:
+                    hub = src.GlobalVars.Hub
+                    sup = ctx.district if ctx.district.type == rebase else \
+                        hub.get_instance(rebase, hub.get_superdivision(ctx.district, rebase))
+                    rebased[key] = sup
+                ctx = ctx.replace(district=rebased[key])
+
+            if not memoizable:
+                return act(ctx)
+
+            version = src.GlobalVars.Hub.data_version
+            key = (ctx.district.type, ctx.district.name)
+            if memo.get(key, (None,))[0] != version:
+                memo[key] = (version, {})
+            values = memo[key][1]
+            missing = [n for n in dict.fromkeys(ctx.names) if n not in values]
+            if missing:
+                values.update(_by_entity(ctx.names, act(ctx)))
+            return np.fromiter((values[n] for n in ctx.names), dtype=bool, count=len(ctx.names))
+
+        apply.reset = memo.clear
+        return apply
 
+    @classmethod
+    def parse_node(mcs, node, compiled):
+        if type(node) == str:
+            # riferimento a un altro filtro della stessa classe, risolto alla valutazione
+            return lambda ctx: compiled[node](ctx)
+        node = dict(node)
+        if 'and' in node or 'or' in node or 'not' in node:
+            return mcs.parse_predicate_filter(compiled, **node)
+
+        kind = node.pop('type', 'value')
+        if kind in ('value', 'dataframe'):
+            return mcs.parse_value_filter(**node)
+        if kind == 'membership':
+            return mcs.parse_membership_filter(**node)
+        if kind == 'delegate':
+            return mcs.parse_delegate_filter(**node)
+        if kind == 'map':
+            return mcs.parse_map_filter(**node)
+        raise KeyError(f"Unknown filter type: {kind}")
+
+    @classmethod
+    def parse_value_filter(mcs, *, source=None, column_key=None, column, criteria='gt', logic='absolute',
+                           target, group=None, aggregate='sum', relative_to=None):
+        """
+        source: se None uso il dataframe del totals
+        column_key: solo se uso source, la colonna che collega le righe dei due dataframe
+        column: la colonna da confrontare
+        criteria: gt, ge, lt, le, eq
+        logic: absolute/relative, relative confronta column con target per la somma
+            della colonna (come column > somma * target, senza divisioni)
+        group: se c'è column è sommata per gruppo prima del confronto
+        aggregate: la funzione di aggregazione dei gruppi (sum, size, count, max, ...)
+        relative_to: se c'è la somma di relative è fatta per gruppo
+        """
+        source = _as_source(source)
+        compare = CRITERIA[criteria]
+        group = [group] if type(group) == str else group
+        relative_to = [relative_to] if type(relative_to) == str else relative_to
+
+        def evaluate(df):
+            values = df[column]
+            if group is not None:
+                values = df.groupby(group, sort=False)[column].transform(aggregate)
             if logic == 'relative':
-                s = dataframe[column].sum()
-                c_v = row[column] / s
-            else:
-                c_v = row[column]
+                if relative_to is not None:
+                    tot = df.groupby(relative_to, sort=False)[column].transform('sum').to_numpy()
+                else:
+                    tot = df[column].sum()
+                return compare(values.to_numpy(), tot * target)
+            return compare(values.to_numpy(), target)
 
-            if criteria == 'gt':
-                return c_v > target
-            if criteria == 'lt':
-                return c_v < target
-            else:
-                return c_v == target
+        def value_filter(ctx):
+            if source is None:
+                return np.asarray(evaluate(ctx.dataframe), dtype=bool)
 
-        return value_filter
+            df = source({'self': ctx.district})
+            key = df.columns[0] if column_key is None else column_key
+            res = pd.Series(evaluate(df), index=df[key].to_numpy()).groupby(level=0).any()
+            keys = ctx.names if column_key is None else ctx.dataframe[column_key].to_numpy()
+            return res.reindex(keys).fillna(False).to_numpy(dtype=bool)
 
+        return value_filter
 
     @classmethod
-    def parse_membership_filter(mcs, source):
-        def member_filt(self, district, **kwargs):
-            l = source(locals())
-            return (self in l) or (self.name in l)
+    def parse_membership_filter(mcs, *, column=None, values=None, source=None):
+        """
+        column: se None il nome della PolEnt di ogni riga
+        values: lista di valori, oppure source che restituisce una lista (o un dataframe,
+            di cui si usa la prima colonna)
+        """
+        source = _as_source(source)
+        fixed = None if values is None else list(values)
+
+        def member_filt(ctx):
+            allowed = fixed
+            if allowed is None:
+                allowed = source({'self': ctx.district})
+                if isinstance(allowed, pd.DataFrame):
+                    allowed = allowed.iloc[:, 0]
+                allowed = [getattr(i, 'name', i) for i in allowed]
+            col = ctx.names if column is None else ctx.dataframe[column].to_numpy()
+            return pd.Series(col).isin(allowed).to_numpy()
 
         return member_filt
 
     @classmethod
-    def parse_delegate_filter(mcs, *, variable, filter):
+    def parse_delegate_filter(mcs, *, variable, sbarramento):
         """
-        Come rebase ma per le polEnt, chiama il filtro sulla PolEnt contenuta in una data variabile della PolEnt corrente
+        Come rebase ma per le PolEnt: valuta lo sbarramento della PolEnt contenuta
+        nella variabile variable della PolEnt di ogni riga, sulla stessa riga
         """
-
-        def filt_del(self, district, **kwargs):
-            v = getattr(self, variable)
-            if type(v) == str:
-                v = src.GlobalVars.Hub.get_instance('PolEnt', v)
-            return v.filter(district, **kwargs)
+        def filt_del(ctx):
+            hub = src.GlobalVars.Hub
+            cache = {}
+            for n in dict.fromkeys(ctx.names):
+                v = getattr(hub.get_instance("PolEnt", n), variable)
+                cache[n] = getattr(v, 'name', v)
+            return _class_masks(ctx.replace(names=np.array([cache[n] for n in ctx.names], dtype=object)),
+                                sbarramento)
 
         return filt_del
 
     @classmethod
-    def parse_map_filter(mcs, *, source, type="any", count=None, sbarramento):
+    def parse_map_filter(mcs, *, subs, sbarramento, how='any', count=None, source=None):
         """
-        Come delegate ma su una lista
+        Come delegate ma sulle PolEnt di tipo subs sottostanti la PolEnt di ogni riga
 
-        Type può essere any/all/less/more/exactly
-
-        count indica il valore (intero) per less/more/exactly
+        how: any/all/less/more/exactly, count il valore per less/more/exactly
+        source: il dataframe su cui valutare lo sbarramento delle sottostanti,
+            se None quello del totals
         """
+        source = _as_source(source)
 
-        def map_filter(self, district, **kwargs):
-            lis = source(locals())
-            if type(lis[0]) == str:
-                lis = [src.GlobalVars.Hub.get_instance('PolEnt', i) for i in lis]
-            if type == "any":
-                for i in lis:
-                    if i.filter(district, sbarramento=sbarramento):
-                        return True
-                return False
-            if type == "all":
-                for i in lis:
-                    if not i.filter(district, sbarramento=sbarramento):
-                        return False
-                return True
+        def map_filter(ctx):
+            hub = src.GlobalVars.Hub
+            if source is None:
+                sub_ctx = ctx
             else:
-                c = 0
-                for i in lis:
-                    if i.filter(district, sbarramento=sbarramento):
-                        c += 1
-
-                if type == 'less':
-                    return c < count
-                if type == "more":
-                    return c > count
+                df = source({'self': ctx.district})
+                sub_ctx = ctx.replace(dataframe=df, names=df.iloc[:, 0].to_numpy())
+            passed = _by_entity(sub_ctx.names, _class_masks(sub_ctx, sbarramento))
+
+            res = {}
+            for n in dict.fromkeys(ctx.names):
+                sub_names = hub.get_political_subs(hub.get_instance("PolEnt", n), subs)
+                c = sum(passed.get(i, False) for i in sub_names)
+                if how == 'any':
+                    res[n] = c > 0
+                elif how == 'all':
+                    res[n] = c == len(sub_names)
+                elif how == 'less':
+                    res[n] = c < count
+                elif how == 'more':
+                    res[n] = c > count
                 else:
-                    return c == count
+                    res[n] = c == count
+            return np.fromiter((res[n] for n in ctx.names), dtype=bool, count=len(ctx.names))
 
         return map_filter
 
     @classmethod
-    def parse_predicate_filter(mcs, **kwargs):
+    def parse_predicate_filter(mcs, compiled, **kwargs):
         """
         Costruisce un predicato a partire da filtri
 
@@ -220,48 +406,25 @@ class totFilter(type):
 
         and e or contengono liste di lunghezza arbitraria, not un valore e basta
 
-        gli elementi delle liste (o i valori) possono essere:
-            + stringa (chiama filter con riferimento solo al district
+        gli elementi delle liste (o i valori) possono essere nodi o nomi di filtri
+        della stessa classe
         """
-
-        def filter_pred(self, district, *, sbarramento, **kwargs):
-
-            if 'and' in kwargs:
-                for i in kwargs['and']:
-                    if not self.filter(district, sbarramento=i):
-                        return False
-                return True
-            if 'or' in kwargs:
-                for i in kwargs['or']:
-                    if self.filter(district, sbarramento=i):
-                        return True
-                return False
-            if 'not' in kwargs:
-                return not self.filter(district, sbarramento=kwargs['not'])
+        if 'not' in kwargs:
+            inner = mcs.parse_node(kwargs['not'], compiled)
+            return lambda ctx: ~inner(ctx)
+
+        op, items = ('and', kwargs['and']) if 'and' in kwargs else ('or', kwargs['or'])
+        parts = [mcs.parse_node(i, compiled) for i in items]
+        combine = np.logical_and if op == 'and' else np.logical_or
+
+        def filter_pred(ctx):
+            res = np.full(len(ctx.names), op == 'and')
+            for p in parts:
+                res = combine(res, p(ctx))
+            return res
 
         return filter_pred
 
-    @classmethod
-    def parse_filter_function(mcs, type, **kwargs):
-        if type == "dataframe":
-            pass
-            # TODO: dataframe e value sono gli stessi, solo uno è relativo al resto della colonna e l'altro è assoluto
-        if type == "value":
-            pass
-        if type == "membership":  # controlla se self o self.name compare in una qualche lista
-            pass
-        if type == "delegate":  # applica il filtro ad una polent superiore
-            pass
-        if type == "map":  # applica il filtro ad una lista di polent sottostanti
-            pass
-        if type == "predicate":  # crea una espressione in logica dei predicati usando filtri di self
-            return mcs.parse_predicate_filter(**kwargs)
-
     @classmethod
     def parse_conf(mcs, conf):
         return conf
-
-    @classmethod
-    def parse_filter_action(mcs, name, param):
-        return check_filter, apply_filter
-
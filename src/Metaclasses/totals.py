@@ -2,6 +2,7 @@
 import copy
 import functools
 
+import numpy as np
 import pandas as pd
 
 import src.GlobalVars
@@ -10,6 +11,45 @@ from src.utils import *
 from src import Commons
 commons = Commons
 
+# argomenti passati dalle lanes (lanes_propose) e dalle operazioni di tipo dataframe
+# (data=df) a ogni source, i totals non li usano
+PASSTHROUGH_KWARGS = frozenset(('data', 'information', 'constraint', 'distribution'))
+
+
+def filter_mask(district, total, res, sbarramenti):
+    """
+    Restituisce la maschera booleana delle righe di res che superano gli
+    sbarramenti, la prima colonna di res contiene il nome della PolEnt.
+
+    Le righe sono raggruppate per classe della PolEnt: se la classe definisce
+    filter_batch questo riceve tutto il dataframe una volta sola, con rows (la
+    maschera delle righe della classe), e restituisce una maschera lunga quanto
+    il dataframe di cui vengono usate solo le righe in rows. Altrimenti viene
+    chiamato filter su ogni riga
+    """
+    hub = src.GlobalVars.Hub
+    names = res[res.columns[0]]
+    mask = pd.Series(True, index=res.index)
+
+    classes = {}
+    for n in names.unique():
+        classes.setdefault(type(hub.get_instance("PolEnt", n)), []).append(n)
+
+    for cls, cls_names in classes.items():
+        rows = names.isin(cls_names)
+        batch = getattr(cls, 'filter_batch', None)
+        if batch is not None:
+            m = batch(district, total=total, dataframe=res, rows=rows, sbarramenti=sbarramenti)
+            mask[rows] = np.asarray(m, dtype=bool)[rows.to_numpy()]
+            continue
+
+        def apply_filter(row):
+            polEnt = hub.get_instance("PolEnt", row[res.columns[0]])
+            return polEnt.filter(district, total=total, row=row, dataframe=res, sbarramenti=sbarramenti)
+
+        mask[rows] = res[rows].apply(apply_filter, axis=1).astype(bool)
+    return mask
+
 
 class totals(type):
     
@@ -26,8 +66,8 @@ class totals(type):
         if totals_support is None:
             totals_support = {}
 
-        totals = {k: mcs.parse_total_proper(k, **v)[1] for k, v in totals.items()}
-        supports = {k: mcs.parse_total_support(**v) for k, v in totals_support.items()}
+        totals = {k: mcs.memoize(k, mcs.parse_total_proper(k, **v)[1]) for k, v in totals.items()}
+        supports = {k: mcs.memoize(k, mcs.parse_total_support(**v)) for k, v in totals_support.items()}
 
         old_tots = args[2].get('totals', lambda *x, **w: print("old_totals",x, w))
 
@@ -42,6 +82,55 @@ class totals(type):
 
         return super().__new__(mcs, *args, **kwargs)
 
+    @staticmethod
+    def memo_key(name, args, kwargs):
+        """
+        La chiave di memoize: il nome con gli sbarramenti, le liste diventano tuple.
+        Gli argomenti in PASSTHROUGH_KWARGS sono passati dalle lanes e dalle operazioni
+        dataframe a tutte le source annidate e i totals non li leggono, quindi non
+        entrano nella chiave. Restituisce None se la chiave non è hashable
+        """
+        def norm(v):
+            if isinstance(v, (list, tuple)):
+                return tuple(norm(i) for i in v)
+            return v
+
+        key = (name, norm(args),
+               tuple(sorted((k, norm(v)) for k, v in kwargs.items() if k not in PASSTHROUGH_KWARGS)))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    @staticmethod
+    def memoize(name, f):
+        """
+        Memorizza nell'istanza i risultati di f (un totals o un totals_support),
+        la chiave è data da memo_key (il nome con gli sbarramenti).
+        I risultati valgono finché l'Hub non cambia data_version (give_*, give_data,
+        reset_run), le chiamate con argomenti non hashable non vengono memorizzate
+        """
+        def cached(self, *args, **kwargs):
+            hub = src.GlobalVars.Hub
+            class_name = getattr(self, 'type', type(self).__name__)
+            key = totals.memo_key(name, args, kwargs)
+            if key is None:
+                hub.count_totals(class_name, name, None)
+                return f(self, *args, **kwargs)
+
+            cache = self.__dict__.setdefault('_totals_cache', {})
+            version, res = cache.get(key, (None, None))
+            hit = version == hub.data_version
+            hub.count_totals(class_name, name, hit)
+            if not hit:
+                res = f(self, *args, **kwargs)
+                cache[key] = (hub.data_version, res)
+            # chi chiama può modificare il dataframe, la copia in cache resta intatta
+            return res.copy() if isinstance(res, pd.DataFrame) else res
+
+        return cached
+
     @classmethod
     def parse_aggregate(mcs, totals=True, *, keys, source, ops, **kwargs):
         """
@@ -76,6 +165,24 @@ class totals(type):
 
         return aggregate_support
 
+    @classmethod
+    def parse_cube(mcs, totals=True, *, table, fields, keys, **kwargs):
+        """
+        table: il nome della tabella dei dati (data/<Classe>/<table>.csv)
+        fields: le colonne della tabella da usare, con la sintassi di columns
+        keys: le colonne su cui aggregare, le altre sono sommate
+
+        Come un aggregate sulle suddivisioni del livello più basso, ma i totali
+        sono una fetta del VoteCube dell'Hub
+        """
+        def cube_totals(locs, *args, **kwargs):
+            hub = src.GlobalVars.Hub
+            cube = hub.get_cube(table, fields, keys)
+            s = locs['self']
+            return cube.frame(hub.get_cube_level(cube, s.type), s.name)
+
+        return cube_totals
+
     @classmethod
     def parse_transform_op_df(mcs, source, **kwargs):
         """
@@ -294,16 +401,8 @@ class totals(type):
 
             # print(res)
 
-            columns = res.columns
-
-            def apply_filter(row):
-
-                
-                polEnt = src.GlobalVars.Hub.get_instance("PolEnt", row[columns[0]])
-                return polEnt.filter(self, total=type, row=row, dataframe=res, sbarramenti=sbarramenti)
-
             if len(sbarramenti)>0:
-                return res[res.apply(apply_filter, axis=1)]
+                return res[filter_mask(self, type, res, sbarramenti)]
             else:
                 return res
 
@@ -330,6 +429,8 @@ class totals(type):
             f_to_c = mcs.parse_transform(totals, **kwargs)
         elif type == 'combine':
             f_to_c = mcs.parse_combination(totals, **kwargs)
+        elif type == 'cube':
+            f_to_c = mcs.parse_cube(totals, **kwargs)
 
         def totals_support(locs, *args, **kwargs):
             # print("Total supports locs (332): ", locs)
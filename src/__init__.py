@@ -1,6 +1,8 @@
 from typing import final
 import src.GlobalVars
-from runpy import run_path
+from multiprocessing import Pool
+import copy
+import io
 import sys
 import pandas as pd
 import src
@@ -10,45 +12,110 @@ import src.GlobalVars as GlobalVars
 import yaml
 
 from src import Commons
+from src import compiled
+from src import parallel
 from src.Metaclasses import sources_parse
 from src.Metaclasses.cleanup import cleanup
 
 commons = Commons
 
 
-def run_simulation(path):
+def run_simulation(path, visuals=True, execution=None):
     """
-    Given a path to the input folder it runs the simulation of the election
+    Given a path to the input folder it runs the simulation of the election,
+    if visuals is False the charts of the bundled laws are not shown
+    execution is the default strategy of the lanes fan-out (see src.parallel),
+    a strategy name or a dictionary {strategy, workers}
     Overview of steps:
     1. Create the Hub, this works as a global variable space with some support
-        functions tailored to the project
+        functions tailored to the project. The Hub is bound to the current
+        context (thread or asyncio task), so simulations running concurrently
+        don't share it
     2. Read the configuration files for the Classes, for each of these, if it's
         a python file execute it and "import" the class, if they're a yaml file
         then evaluate the metaclasses it needs and then pass the configuration
-        to these to create the concrete classes
+        to these to create the concrete classes. Once all the classes are
+        created the paths between classes in the Hub are precomputed
     3. Read the files describing the instances and pass them to the corresponding
         class created in step 2 as keyword arguments.
         NB: during the creation of the instance the unique name provided to each
         instance is associated to the instance in the Hub as well as other
         information provided by metaclasess
+        Once all the instances are loaded the Hub indexes the geographic hierarchy
     4. Read the data (the votes in the election) and provide it to the specified
         instances through method calls
     5. Run the election through the hub
+
+    Classes, instances and data are read from the compiled artifact of the law
+    (see src.compiled), the law is compiled again only if its files changed
+    """
+
+    law = compiled.load_compiled(path)
+    hub = load_law(path, law) # 1, 2, 3
+    if execution is not None:
+        hub.execution = parallel.parse_execution(execution)
+    give_data(read_data(path, law)) # 4
+
+     # run_exec fa partire l'esecuzione 
+    final_result = GlobalVars.Hub.run_exec() # 5
+
+    if not visuals:
+        return final_result
+
+    if 'Porcellum' in path:
+        Commons.printing_visuals(final_result) #visualizzaione grafica da porcellum.py
+    if 'Mattarellum' in path:
+        Commons.show_chart(final_result) # visualizzazione grafica da mattarellum.py
+    if 'Binomiale' in path:
+        Commons.show_binomiale_chart(final_result)
+
+
+    return final_result
+
+
+def stream_simulation(path, execution=None):
     """
+    Like run_simulation, without visuals, but it's a generator: the records
+    (district, lane, elector, seats) of every lane are produced as soon as the
+    lane is done (see ActHub.iter_exec). For laws with candidates the elected
+    candidates are in GlobalVars.Hub.elected once the generator is exhausted.
+    The steps always run with the Hub of this law bound, even if the caller
+    resumes the generator from another thread or after loading another law
+    """
+    law = compiled.load_compiled(path)
+    hub = load_law(path, law)
+    if execution is not None:
+        hub.execution = parallel.parse_execution(execution)
+    give_data(read_data(path, law))
+    yield from hub.iter_exec()
 
-    src.GlobalVars.Hub = src.GlobalVars.ActHub() # 1
-    base_path = path
-    classes = next(os.walk(os.path.join(base_path, 'Classes')))
-    for i in classes[2]: # 2
-        pth = os.path.join(base_path, 'Classes', i)
-        name = i.split('.')[0]
 
-        if '.py' in i:
-            d = run_path(pth, globals())
-            exec(f"{name} = d['{name}']")
-        elif '.yaml' in i:
-            with open(pth, 'r') as f:
-                conf = yaml.safe_load(f)
+def load_law(path, law=None):
+    """
+    Steps 1, 2 and 3 of run_simulation: creates the Hub, the classes and the
+    instances of the law in path, returns the Hub (already set in the current
+    context)
+    law is the compiled artifact of the law (see src.compiled), if None it's
+    loaded from the cache or compiled
+    """
+    if law is None:
+        law = compiled.load_compiled(path)
+
+    hub = GlobalVars.ActHub()
+    GlobalVars.current_hub.set(hub) # 1
+    classes_ns = {}
+    for entry in law['classes']: # 2
+        name, kind, pth = entry[:3]
+
+        if kind == 'py':
+            # come run_path(pth, globals()) ma senza ricompilare il file
+            d = dict(globals())
+            d.update(__name__='<run_path>', __file__=pth, __cached__=None,
+                     __loader__=None, __package__=None, __spec__=None)
+            exec(compiled.class_code(entry), d)
+            classes_ns[name] = d[name]
+        elif kind == 'yaml':
+            conf = copy.deepcopy(entry[3])
             metas = [eval(i) for i in conf.pop('metaclasses')]
             for i in metas:
                 conf = i.parse_conf(conf) # parse conf is a method of each metaclass
@@ -58,37 +125,92 @@ def run_simulation(path):
             comb = type(f'comb_{name}', metas_f, {}) # create the combined metaclass
 
             c = comb(name, (), {}, **conf)  # create the class
-            exec(f'{name}=c') # insert the class into the namespace of the program
-
-    instances = next(os.walk(os.path.join(base_path, 'Instances')))
-    for i in instances[2]: # 3
-        #print(i)
-        cls = eval(i.split('.')[0])
-        with open(os.path.join(base_path, 'Instances', i), 'r') as f:
-            d = yaml.safe_load(f)
-            for k, conf in d.items():
-                #print(k)
-                cls(k, **conf)
-
-    data = next(os.walk(os.path.join(base_path, 'Data')))
-    for f in data[1]: # 4
-        path = os.path.join(base_path, 'Data', f)
-        for csv in next(os.walk(path))[2]:
-            name = csv.split('.')[0]
-            df = pd.read_csv(os.path.join(path, csv))
-            for k, data in df.groupby(df.columns[0]):
-                r = GlobalVars.Hub.get_instance(f, k)
-                getattr(r, f'give_{name}')(data.iloc[:, 1:])
+            classes_ns[name] = c # insert the class into the namespace of the program
+    hub.freeze_classes()
 
-     # run_exec fa partire l'esecuzione 
-    final_result = src.GlobalVars.Hub.run_exec() # 5
+    for class_name, d in law['instances']: # 3
+        cls = classes_ns[class_name]
+        for k, conf in copy.deepcopy(d).items():
+            cls(k, **conf)
+    hub.build_hierarchy()
 
-    if 'Porcellum' in path:
-        Commons.printing_visuals(final_result) #visualizzaione grafica da porcellum.py
-    if 'Mattarellum' in path:
-        Commons.show_chart(final_result) # visualizzazione grafica da mattarellum.py
-    if 'Binomiale' in path:
-        Commons.show_binomiale_chart(final_result)
+    return hub
+
+
+def read_data(path, law=None):
+    """
+    Returns the data of the law in path, a dictionary
+    (class_name, data_name): dataframe, one for each csv in Data/class_name/
+    """
+    if law is None:
+        law = compiled.load_compiled(path)
+    return dict(law['data'])
+
+
+def give_data(tables):
+    """
+    Step 4 of run_simulation: the rows of each table are grouped by the first
+    column (the name of the instance) and given to the instance through
+    give_<data_name>, then the tables are registered in the Hub (set_tables)
+    """
+    for (f, name), df in tables.items():
+        for k, data in df.groupby(df.columns[0]):
+            r = GlobalVars.Hub.get_instance(f, k)
+            getattr(r, f'give_{name}')(data.iloc[:, 1:])
+    GlobalVars.Hub.set_tables(tables)
+
+
+def seats_list(result):
+    """
+    Given the result of run_simulation returns a list of tuples
+    (district, lane, elector, seats) made only of names and integers
+    """
+    if len(result) == 2 and type(result[1]) == dict:  # laws with candidates return [electors, elected]
+        result = result[0]
+    return [(getattr(district, 'name', district), lane, elector, int(seats))
+            for district, lane, elector, seats in result]
+
+
+def law_name(path):
+    return os.path.basename(os.path.normpath(path))
+
+
+def _run_batch_worker(path):
+    """
+    Runs a single law capturing its output, returns only picklable data
+    """
+    out = io.StringIO()
+    save_stdout = sys.stdout
+    sys.stdout = out
+    try:
+        res = run_simulation(path, visuals=False)
+    finally:
+        sys.stdout = save_stdout
+    return path, seats_list(res), out.getvalue()
+
+
+def run_batch(paths, jobs=1):
+    """
+    Runs the simulation for every folder in paths, using a pool of jobs
+    processes if jobs > 1
+
+    Returns:
+        + a dataframe with a row per elector, a column per law and the
+          seats won as values
+        + a dictionary path: output printed by the simulation
+    """
+    if jobs > 1:
+        with Pool(min(jobs, len(paths))) as p:
+            outs = p.map(_run_batch_worker, paths, chunksize=1)
+    else:
+        outs = list(map(_run_batch_worker, paths))
 
+    rows = [(law_name(path), elector, seats)
+            for path, seats, _ in outs
+            for _, _, elector, seats in seats]
+    df = pd.DataFrame(rows, columns=['Legge', 'Elettore', 'Seggi'])
+    table = df.pivot_table(index='Elettore', columns='Legge', values='Seggi', aggfunc='sum', fill_value=0)
+    table = table[[law_name(path) for path, _, _ in outs]]
+    table = table.loc[table.sum(axis=1).sort_values(ascending=False, kind='mergesort').index]
 
-    return final_result
\ No newline at end of file
+    return table, {path: log for path, _, log in outs}
@@ -22,22 +22,84 @@ from src.Metaclasses import *
 from src import Commons
 import argparse  # Usa per avere in input i
 import src
+import src.compiled
+import src.ensemble
 
 parser = argparse.ArgumentParser(
     description='This program uses the configuration files and data provided to simulate an '
                 'electoral process')
 parser.add_argument('path', help='the path to the directory containing the configuration files', nargs='*')
+parser.add_argument('-j', '--jobs', type=int, default=1,
+                    help='number of processes used to simulate the laws in parallel, with more than one process or '
+                         'more than one path a table comparing the seats of each law is printed')
+parser.add_argument('--ensemble', type=int, default=0, metavar='N',
+                    help='run N simulations on randomly perturbed votes and print the seat histograms of each elector')
+parser.add_argument('--noise', choices=['dirichlet', 'swing'], default='dirichlet',
+                    help='noise model of the ensemble: dirichlet per district or uniform national swing')
+parser.add_argument('--concentration', type=float, default=1000.,
+                    help='concentration of the dirichlet noise, higher values stay closer to the actual votes')
+parser.add_argument('--sigma', type=float, default=0.01,
+                    help='standard deviation of the national swing, as a share of the votes')
+parser.add_argument('--seed', type=int, default=0, help='seed of the ensemble')
+parser.add_argument('--party-column', action='append', default=[], metavar='Folder/table=COLUMN',
+                    help='column with the party of the rows of a table perturbed by the ensemble, overrides '
+                         '<law>/Data/ensemble.yaml (can be repeated)')
+parser.add_argument('--execution', choices=['serial', 'thread', 'process'], default='serial',
+                    help='how the lanes call propose on the subdivisions of a district: in a loop, with a pool of '
+                         'threads or with a pool of processes (only for lanes whose propose has no side effects)')
+parser.add_argument('--workers', type=int, default=None,
+                    help='number of threads or processes of --execution, by default the number of cpus')
+parser.add_argument('--stream', action='store_true',
+                    help='print the seats of every lane as soon as the lane is done, one line per elector')
+parser.add_argument('--compile', action='store_true',
+                    help='only compile the laws into their cached artifact (<law>/.compiled), without simulating')
 
 if __name__ == '__main__':
     args = parser.parse_args()
-    f = open("logs", 'w')
-    save_stdout = sys.stdout
-    sys.stdout = f
-    for i in args.path:
-        res = src.run_simulation(i)
-    sys.stdout = save_stdout
-    f.close()
-
-    print(res)
+
+    if args.compile:
+        for i in args.path:
+            law = src.compiled.compile_law(i)
+            pth = src.compiled.save_law(i, law)
+            print(f"{i}: {pth if pth is not None else 'cannot write the artifact'}")
+    elif args.ensemble > 0:
+        party_columns = dict(c.split('=', 1) for c in args.party_column)
+        for i in args.path:
+            draws = src.ensemble.run_ensemble(i, args.ensemble, jobs=args.jobs, seed=args.seed, noise=args.noise,
+                                              party_columns=party_columns, concentration=args.concentration,
+                                              sigma=args.sigma)
+            with pandas.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+                print(i)
+                print(src.ensemble.seat_histograms(draws))
+    elif args.jobs > 1 or len(args.path) > 1:
+        table, logs = src.run_batch(args.path, jobs=args.jobs)
+        with open("logs", 'w') as f:
+            for path, log in logs.items():
+                f.write(f"===== {path} =====\n")
+                f.write(log)
+
+        with pandas.option_context('display.max_rows', None, 'display.width', None):
+            print(table)
+    elif args.stream:
+        save_stdout = sys.stdout
+        with open("logs", 'w') as f:
+            sys.stdout = f
+            try:
+                for i in args.path:
+                    for district, lane, elector, seats in src.stream_simulation(
+                            i, execution={'strategy': args.execution, 'workers': args.workers}):
+                        print(district, lane, elector, seats, sep='\t', file=save_stdout, flush=True)
+            finally:
+                sys.stdout = save_stdout
+    else:
+        f = open("logs", 'w')
+        save_stdout = sys.stdout
+        sys.stdout = f
+        for i in args.path:
+            res = src.run_simulation(i, execution={'strategy': args.execution, 'workers': args.workers})
+        sys.stdout = save_stdout
+        f.close()
+
+        print(res)
 
 
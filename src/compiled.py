@@ -0,0 +1,132 @@
+"""
+Compiled laws: a law folder is turned into a single artifact holding everything
+that can be prepared ahead of the simulation:
+    + the configuration of the yaml classes, already parsed
+    + the bytecode of the python classes
+    + the declarations of the instances
+    + the vote tables, as typed dataframes
+    + Data/ensemble.yaml, the party columns perturbed by the ensembles
+
+The artifact is saved in <law>/.compiled/law.pickle together with the hash of
+the content of Classes, Instances and Data: when a source file changes the hash
+changes as well and the law is compiled again. An artifact that can't be loaded
+(corrupted, or written by other versions of the libraries) is compiled again too.
+"""
+import hashlib
+import marshal
+import os
+import pickle
+import sys
+
+import numpy as np
+import pandas as pd
+import yaml
+
+COMPILED_VERSION = 2
+COMPILED_DIR = '.compiled'
+COMPILED_FILE = 'law.pickle'
+
+
+def artifact_path(path):
+    return os.path.join(path, COMPILED_DIR, COMPILED_FILE)
+
+
+def law_hash(path):
+    """
+    Hash del contenuto (nomi e byte dei file) di Classes, Instances e Data,
+    dipende anche dalla versione del formato, di python (per il bytecode) e di
+    pandas e numpy (per i dataframe salvati con pickle)
+    """
+    h = hashlib.sha256()
+    h.update(f'{COMPILED_VERSION} {sys.version_info[:2]} {pd.__version__} {np.__version__}'.encode())
+    for sub in ('Classes', 'Instances', 'Data'):
+        for root, dirs, files in os.walk(os.path.join(path, sub)):
+            dirs.sort()
+            for f in sorted(files):
+                pth = os.path.join(root, f)
+                h.update(os.path.relpath(pth, path).encode())
+                with open(pth, 'rb') as fl:
+                    h.update(hashlib.sha256(fl.read()).digest())
+    return h.hexdigest()
+
+
+def compile_law(path):
+    """
+    Legge la cartella della legge e restituisce l'artefatto (un dizionario),
+    l'ordine di classi, istanze e dati è lo stesso usato da run_simulation
+    """
+    classes = []
+    for i in next(os.walk(os.path.join(path, 'Classes')))[2]:
+        pth = os.path.join(path, 'Classes', i)
+        name = i.split('.')[0]
+        if '.py' in i:
+            with open(pth, 'r') as f:
+                code = compile(f.read(), pth, 'exec')
+            classes.append((name, 'py', pth, marshal.dumps(code)))
+        elif '.yaml' in i:
+            with open(pth, 'r') as f:
+                classes.append((name, 'yaml', pth, yaml.safe_load(f)))
+
+    instances = []
+    for i in next(os.walk(os.path.join(path, 'Instances')))[2]:
+        with open(os.path.join(path, 'Instances', i), 'r') as f:
+            instances.append((i.split('.')[0], yaml.safe_load(f)))
+
+    data = {}
+    for f in next(os.walk(os.path.join(path, 'Data')))[1]:
+        folder = os.path.join(path, 'Data', f)
+        for csv in next(os.walk(folder))[2]:
+            data[(f, csv.split('.')[0])] = pd.read_csv(os.path.join(folder, csv))
+
+    ensemble = None
+    pth = os.path.join(path, 'Data', 'ensemble.yaml')
+    if os.path.exists(pth):
+        with open(pth, 'r') as f:
+            ensemble = yaml.safe_load(f)
+
+    return {'hash': law_hash(path), 'classes': classes, 'instances': instances, 'data': data,
+            'ensemble': ensemble}
+
+
+def save_law(path, law):
+    """
+    Salva l'artefatto, restituisce il percorso o None se la cartella non è scrivibile
+    """
+    pth = artifact_path(path)
+    try:
+        os.makedirs(os.path.dirname(pth), exist_ok=True)
+        tmp = f'{pth}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(law, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, pth)  # atomico, più processi possono compilare la stessa legge
+    except OSError:
+        return None
+    return pth
+
+
+def load_compiled(path, save=True):
+    """
+    Restituisce l'artefatto della legge in path, se quello salvato manca, non
+    corrisponde più ai sorgenti o non si riesce a leggere la legge viene
+    ricompilata (e salvata se save)
+    """
+    h = law_hash(path)
+    try:
+        with open(artifact_path(path), 'rb') as f:
+            law = pickle.load(f)
+        if law.get('hash') == h:
+            return law
+    except Exception:  # un artefatto rovinato o di un'altra versione è come uno che manca
+        pass
+
+    law = compile_law(path)
+    if save:
+        save_law(path, law)
+    return law
+
+
+def class_code(entry):
+    """
+    entry: un elemento di law['classes'] di tipo 'py', restituisce il code object
+    """
+    return marshal.loads(entry[3])
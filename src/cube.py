@@ -0,0 +1,100 @@
+"""
+Vote cube: the rows of a data table (the ones given to the instances of the
+lowest level through give_<table>) are coded as integers, geography on one
+axis and political keys on the other, and summed into numpy arrays.
+The sums for every level above the one of the table (as in subs_relations)
+are computed once, so the totals of an instance, or the ones of all its
+subdivisions, are slices of an array instead of a concat of dataframes
+followed by a groupby.
+"""
+import numpy as np
+import pandas as pd
+
+import src.utils
+
+
+class VoteCube:
+    def __init__(self, hub, leaf_class, data, fields, keys):
+        """
+        hub: l'ActHub delle istanze
+        leaf_class: la classe a cui sono dati i dati (la cartella in Data)
+        data: la tabella, la prima colonna è il nome dell'istanza
+        fields: le colonne da usare (sintassi di columns, 'COLONNA -> Nome')
+        keys: le colonne (dopo la rinomina) su cui aggregare, le altre sono sommate
+        """
+        cols, rename = src.utils.parse_columns(list(fields))
+        geo = data.iloc[:, 0]
+        data = data[cols].rename(columns=rename)
+        keys = list(keys)
+        self.values = [c for c in data.columns if c not in keys]
+        self.leaf_class = leaf_class
+
+        grouped = data.groupby(keys, sort=True)
+        self.pol = grouped.size().index.to_frame(index=False)
+        pol_codes = grouped.ngroup().to_numpy()
+        leaf_codes, leaf_names = pd.factorize(geo)
+
+        valid = pol_codes >= 0  # come groupby le chiavi nulle sono scartate
+        n_pol = len(self.pol)
+        flat = leaf_codes[valid] * n_pol + pol_codes[valid]
+        size = len(leaf_names) * n_pol
+
+        counts = np.bincount(flat, minlength=size).reshape(-1, n_pol)
+        sums = {}
+        for c in self.values:
+            arr = np.zeros(size, dtype=data[c].dtype)
+            np.add.at(arr, flat, data[c].to_numpy()[valid])
+            sums[c] = arr.reshape(-1, n_pol)
+
+        # livello: (nome istanza: indice, conteggi, somme)
+        self.levels = {leaf_class: ({n: i for i, n in enumerate(leaf_names)}, counts, sums)}
+
+        if hub.descendants is None:
+            hub.build_hierarchy()
+        ups = {}
+        for i, n in enumerate(leaf_names):
+            for sup_class, sup_name in hub.ancestors.get((leaf_class, n), {}).items():
+                ups.setdefault(sup_class, {})[i] = sup_name
+
+        for sup_class, mapping in ups.items():
+            names, codes = pd.factorize(pd.Series(mapping))
+            leaves = np.fromiter(mapping.keys(), dtype=np.int64, count=len(mapping))
+            up_counts = np.zeros((len(codes), n_pol), dtype=counts.dtype)
+            np.add.at(up_counts, names, counts[leaves])
+            up_sums = {}
+            for c, arr in sums.items():
+                up_sums[c] = np.zeros((len(codes), n_pol), dtype=arr.dtype)
+                np.add.at(up_sums[c], names, arr[leaves])
+            self.levels[sup_class] = ({n: i for i, n in enumerate(codes)}, up_counts, up_sums)
+
+    def _rows(self, level, idx):
+        """
+        Dataframe con le chiavi e le somme delle righe idx (array di indici) di level,
+        una riga per ogni coppia (istanza, chiave) presente nei dati
+        """
+        _, counts, sums = self.levels[level]
+        present = counts[idx] > 0
+        inst, pol = np.nonzero(present)
+        res = self.pol.iloc[pol].reset_index(drop=True)
+        for c, arr in sums.items():
+            res[c] = arr[idx][inst, pol]
+        return res, inst
+
+    def frame(self, level, name):
+        """
+        I totali dell'istanza name di classe level, come il groupby(keys).sum()
+        dei dati delle sue suddivisioni del livello più basso
+        """
+        index = self.levels[level][0]
+        if name not in index:
+            return self._rows(level, np.zeros(0, dtype=np.int64))[0]
+        return self._rows(level, np.array([index[name]]))[0]
+
+    def subdivisions_frame(self, level, names):
+        """
+        I totali delle istanze names di classe level uno dopo l'altro, come il
+        pd.concat dei frame di ogni istanza
+        """
+        index = self.levels[level][0]
+        idx = np.array([index[n] for n in names if n in index], dtype=np.int64)
+        return self._rows(level, idx)[0]
@@ -0,0 +1,286 @@
+"""
+Monte Carlo ensemble of simulations: the law is loaded once, then the election
+is run many times on perturbed copies of the vote tables to obtain, for each
+elector, the distribution of the seats won.
+
+Noise models:
+    + dirichlet: in every district the shares of the parties are drawn from a
+        Dirichlet distribution centred on the actual shares, concentration
+        controls the spread (higher = closer to the real result)
+    + swing: uniform national swing, every party gains (or loses) the same
+        share of votes in every district, the swing is drawn from a normal
+        distribution with standard deviation sigma
+
+Every csv of a Data folder is perturbed, the party of each row must be declared
+in <law>/Data/ensemble.yaml (or passed as party_columns): a table without a
+declaration, or with rows whose party can't be found, is an error. The rows are
+identified by the first column (the instance) and by the party, all the integer
+columns are scaled by the same factor. The tables of a group (by default the
+Data folder) get the factors computed on the first table of the group declared
+in ensemble.yaml, so that they stay consistent with each other.
+
+ensemble.yaml:
+
+    party_columns:
+        Folder/table: COLUMN                   # the column with the party
+        Folder/table: [COLUMN, OTHER]          # the first non empty value
+        Folder/table:
+            column: COLUMN                     # the column with the name of an instance,
+            instance: Class                    # the party is its attribute (default party)
+            attribute: party
+            group: name                        # share the factors with another group
+            ignore: [VALUE]                    # rows of the column left as they are (placeholders)
+"""
+import contextlib
+import io
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+import src
+import src.GlobalVars as GlobalVars
+from src import compiled
+
+
+def vote_columns(df):
+    return [c for c in df.columns[1:] if pd.api.types.is_integer_dtype(df[c])]
+
+
+def table_name(key):
+    return f'{key[0]}/{key[1]}'
+
+
+def parse_party_spec(spec):
+    """
+    Una dichiarazione di party_columns (stringa, lista o dizionario) come dizionario
+    {columns, instance, attribute, group, ignore}
+    """
+    if type(spec) == str:
+        spec = {'column': spec}
+    elif type(spec) == list:
+        spec = {'column': spec}
+    elif type(spec) != dict or 'column' not in spec:
+        raise ValueError(f"Invalid party column declaration: {spec!r}")
+    columns = spec['column'] if type(spec['column']) == list else [spec['column']]
+    return {'columns': columns, 'instance': spec.get('instance'),
+            'attribute': spec.get('attribute', 'party'), 'group': spec.get('group'),
+            'ignore': frozenset(spec.get('ignore', ()))}
+
+
+def table_parties(tables, party_columns, instances=()):
+    """
+    tables: il dizionario restituito da src.read_data
+    party_columns: {"Cartella/tabella": dichiarazione} (si veda il docstring del modulo)
+    instances: law['instances'], per le dichiarazioni con instance
+
+    Restituisce (parties, groups): per ogni tabella la Series con il partito di ogni
+    riga (nullo per le righe ignore) e il gruppo (la cartella se non indicato),
+    nell'ordine delle dichiarazioni.
+    Solleva KeyError per tabelle non dichiarate o dichiarazioni di tabelle che non
+    esistono e ValueError se il partito di qualche riga non si trova
+    """
+    names = {table_name(k): k for k in tables}
+    missing = sorted(set(names) - set(party_columns))
+    if missing:
+        raise KeyError(f"No party column declared for the tables {missing}")
+    unknown = sorted(set(party_columns) - set(names))
+    if unknown:
+        raise KeyError(f"Party columns declared for unknown tables {unknown}")
+
+    attributes = {}
+    for class_name, d in instances:
+        attributes.setdefault(class_name, {}).update(d or {})
+
+    parties, groups = {}, {}
+    for name, spec in party_columns.items():
+        key = names[name]
+        df = tables[key]
+        spec = parse_party_spec(spec)
+        absent = [c for c in spec['columns'] if c not in df.columns]
+        if absent:
+            raise KeyError(f"{name}: no columns {absent}")
+        party = df[spec['columns'][0]]
+        for c in spec['columns'][1:]:
+            party = party.fillna(df[c])
+        ignored = df[spec['columns'][0]].isin(spec['ignore'])
+        if spec['instance'] is not None:
+            decl = attributes.get(spec['instance'], {})
+            party = party.map(lambda n: (decl.get(n) or {}).get(spec['attribute']))
+        unknown = party.isna() & ~ignored
+        if unknown.any():
+            raise ValueError(f"{name}: no party for {int(unknown.sum())} rows, "
+                             f"e.g. {df[unknown].iloc[0].tolist()}")
+        party = party.where(~ignored)
+        parties[key] = party
+        groups[key] = spec['group'] or key[0]
+    return parties, groups
+
+
+def shares(df, party):
+    """
+    party: la Series con il partito di ogni riga di df
+
+    Restituisce una Series con indice (istanza, partito) e la quota di voti
+    del partito nell'istanza
+    """
+    votes = df[vote_columns(df)].sum(axis=1).groupby([df[df.columns[0]], party.rename('Partito')], sort=True).sum()
+    return votes / votes.groupby(level=0).transform('sum')
+
+
+def dirichlet_factors(share, rng, concentration=1000., **kwargs):
+    # una Dirichlet per distretto equivale a Gamma indipendenti normalizzate per distretto
+    alpha = share.to_numpy() * concentration
+    g = np.zeros(len(alpha))
+    g[alpha > 0] = rng.standard_gamma(alpha[alpha > 0])
+    g = pd.Series(g, index=share.index)
+    new = g / g.groupby(level=0).transform('sum')
+    return new, share
+
+
+def swing_factors(share, rng, deltas, **kwargs):
+    delta = deltas.reindex(share.index.get_level_values(1)).fillna(0.).to_numpy()
+    new = (share + delta).clip(lower=0)
+    new = new / new.groupby(level=0).transform('sum')
+    return new, share
+
+
+def perturb(tables, rng, parties, groups, noise='dirichlet', sigma=0.01, concentration=1000.):
+    """
+    tables: il dizionario restituito da src.read_data
+    rng: numpy Generator
+    parties, groups: il risultato di table_parties
+    noise: 'dirichlet' o 'swing'
+
+    Restituisce un nuovo dizionario di tabelle con i voti perturbati
+    """
+    # le tabelle dello stesso gruppo condividono i fattori della prima
+    members = {}
+    for key, g in groups.items():
+        members.setdefault(g, []).append(key)
+
+    refs = {g: shares(tables[keys[0]], parties[keys[0]]) for g, keys in members.items()}
+
+    deltas = None
+    if noise == 'swing':
+        names = sorted({p for s in refs.values() for p in s.index.get_level_values(1)})
+        deltas = pd.Series(rng.normal(0., sigma, len(names)), index=names)
+    elif noise != 'dirichlet':
+        raise KeyError(f"Unknown noise model: {noise}")
+
+    res = dict(tables)
+    for g, keys in members.items():
+        if noise == 'dirichlet':
+            new, old = dirichlet_factors(refs[g], rng, concentration=concentration)
+        else:
+            new, old = swing_factors(refs[g], rng, deltas)
+        factors = (new / old.where(old > 0)).fillna(1.)
+
+        for key in keys:
+            df = tables[key]
+            idx = pd.MultiIndex.from_arrays([df[df.columns[0]], parties[key]])
+            f = factors.reindex(idx).fillna(1.).to_numpy()
+            out = df.copy()
+            for c in vote_columns(df):
+                out[c] = np.rint(df[c].to_numpy() * f).astype(df[c].dtype)
+            res[key] = out
+    return res
+
+
+class Ensemble:
+    """
+    Una legge caricata una sola volta, rieseguibile su dati diversi
+    """
+    def __init__(self, path, party_columns=None):
+        """
+        party_columns: dichiarazioni che si aggiungono (o sostituiscono) quelle
+        di Data/ensemble.yaml della legge
+        """
+        self.path = path
+        law = compiled.load_compiled(path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.hub = src.load_law(path, law)
+        self.tables = src.read_data(path, law)
+        declared = dict((law.get('ensemble') or {}).get('party_columns', {}))
+        declared.update(party_columns or {})
+        self.parties, self.groups = table_parties(self.tables, declared, law['instances'])
+
+    def run(self, tables):
+        """
+        Esegue la simulazione con le tabelle fornite, restituisce un dizionario
+        elettore: seggi
+        """
+        GlobalVars.current_hub.set(self.hub)
+        self.hub.reset_run()
+        with contextlib.redirect_stdout(io.StringIO()):
+            src.give_data(tables)
+            result = self.hub.run_exec()
+
+        seats = {}
+        for _, _, elector, s in src.seats_list(result):
+            seats[elector] = seats.get(elector, 0) + s
+        return seats
+
+    def draw(self, i, seed, **noise):
+        """
+        Esegue l'estrazione numero i, il generatore dipende solo da seed e i
+        così il risultato non dipende da quale processo la esegue
+        """
+        rng = np.random.default_rng([seed, i])
+        return self.run(perturb(self.tables, rng, self.parties, self.groups, **noise))
+
+
+_ensemble = None  # l'Ensemble del processo worker
+_noise = {}
+
+
+def _init_worker(path, party_columns, noise):
+    global _ensemble, _noise
+    # con fork il worker eredita l'Ensemble già caricato dal processo padre
+    if _ensemble is None or _ensemble.path != path:
+        _ensemble = Ensemble(path, party_columns)
+    _noise = noise
+
+
+def _draw(args):
+    i, seed = args
+    return _ensemble.draw(i, seed, **_noise)
+
+
+def run_ensemble(path, draws, *, jobs=1, seed=0, party_columns=None, **noise):
+    """
+    path: la cartella della legge
+    draws: il numero di simulazioni
+    jobs: il numero di processi
+    seed: il seme, a parità di seme i risultati sono riproducibili
+    party_columns: dichiarazioni in aggiunta a Data/ensemble.yaml (si veda Ensemble)
+    noise: parametri per perturb (noise, sigma, concentration)
+
+    Restituisce un dataframe con una riga per estrazione e una colonna per
+    elettore, con i seggi ottenuti
+    """
+    global _ensemble
+    _ensemble = None  # le dichiarazioni possono essere cambiate
+    _init_worker(path, party_columns, noise)
+
+    tasks = [(i, seed) for i in range(draws)]
+    if jobs > 1:
+        with Pool(jobs, initializer=_init_worker, initargs=(path, party_columns, noise)) as p:
+            rows = p.map(_draw, tasks, chunksize=max(1, draws // (4 * jobs)))
+    else:
+        rows = list(map(_draw, tasks))
+
+    df = pd.DataFrame(rows).fillna(0).astype(int)
+    df.index.name = 'Estrazione'
+    return df[sorted(df.columns, key=lambda c: (-df[c].mean(), c))]
+
+
+def seat_histograms(draws):
+    """
+    draws: il dataframe restituito da run_ensemble
+
+    Restituisce un dataframe con una riga per elettore e una colonna per ogni
+    numero di seggi, il valore è il numero di estrazioni con quel risultato
+    """
+    hist = draws.apply(lambda c: c.value_counts()).fillna(0).astype(int).T
+    return hist[sorted(hist.columns)]
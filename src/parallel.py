@@ -0,0 +1,175 @@
+"""
+Execution strategies for the fan-outs of the simulation (the proposals of the
+subdivisions of a lane operation, the lanes with the same priority): the same
+function is applied to a list of independent items and the results are
+returned in the order of the items, whatever the strategy.
+
+Strategies:
+    + serial: a plain loop, the default
+    + thread: a pool of threads sharing the Hub, every task runs in a copy of
+        the context of the caller so it sees the same Hub (see GlobalVars)
+    + process: a pool of processes started with fork, every worker inherits
+        the Hub as it was when the pool was created. The function and the
+        items are sent pickled (fun must be picklable: a module level function
+        or a functools.partial of one) and so are the results, the side
+        effects of the tasks on the instances (logs, attributes) stay in the
+        worker: use it only for pure tasks. If fork is not available or the
+        tasks or their results can't be pickled the items are evaluated
+        serially. Inside process_pool (a run of the Hub) the pool is created
+        once and reused, until the data of the Hub change
+
+Inside a worker (thread or process) nested fan-outs are always serial.
+"""
+import contextlib
+import contextvars
+import multiprocessing
+import multiprocessing.pool
+import os
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+STRATEGIE = ('serial', 'thread', 'process')
+
+_worker = threading.local()  # flag dei thread worker
+_in_process = False  # vero nei processi worker
+_pools = contextvars.ContextVar('pools', default=None)  # i pool della run corrente, si veda process_pool
+
+
+def parse_execution(conf, default=('serial', None)):
+    """
+    conf: None, il nome di una strategia o un dizionario {strategy, workers}
+
+    Restituisce la coppia (strategia, workers)
+    """
+    if conf is None:
+        return default
+    if type(conf) == str:
+        conf = {'strategy': conf}
+    strategy = conf.get('strategy', default[0])
+    if strategy not in STRATEGIE:
+        raise KeyError(f"Unknown execution strategy: {strategy}")
+    return strategy, conf.get('workers', default[1])
+
+
+def in_worker():
+    return _in_process or getattr(_worker, 'active', False)
+
+
+def _run_in_thread(fun, item):
+    _worker.active = True
+    try:
+        return fun(item)
+    finally:
+        _worker.active = False
+
+
+def _run_pickled(task):
+    global _in_process
+    _in_process = True
+    fun, item = pickle.loads(task)
+    return fun(item)
+
+
+@contextlib.contextmanager
+def process_pool():
+    """
+    Le fan-out process eseguite dentro il blocco usano lo stesso pool (per
+    numero di workers), che viene chiuso all'uscita. Il pool è creato di nuovo
+    se nel frattempo i dati dell'Hub sono cambiati (data_version), perché i
+    worker vedono l'Hub del momento del fork
+    """
+    token = _pools.set({})
+    try:
+        yield
+    finally:
+        pools = _pools.get()
+        _pools.reset(token)
+        for _, pool in pools.values():
+            pool.terminate()
+
+
+def _get_pool(ctx, workers):
+    """
+    Restituisce (pool, temporaneo): il pool di process_pool se c'è, altrimenti
+    un pool nuovo che chi chiama deve chiudere
+    """
+    from src.GlobalVars import current_hub
+    pools = _pools.get()
+    if pools is None:
+        return ctx.Pool(workers), True
+    hub = current_hub.get()  # None fuori da una simulazione
+    version = None if hub is None else (id(hub), hub.data_version)
+    old = pools.get(workers)
+    if old is not None and old[0] == version:
+        return old[1], False
+    if old is not None:
+        old[1].terminate()
+    pools[workers] = (version, ctx.Pool(workers))
+    return pools[workers][1], False
+
+
+def map_ordered(fun, items, strategy='serial', workers=None):
+    """
+    Applica fun a ogni elemento di items con la strategia indicata, restituisce
+    la lista dei risultati nell'ordine di items
+    workers: il numero di thread o processi, se None il numero di cpu
+    """
+    items = list(items)
+    if strategy == 'serial' or len(items) < 2 or in_worker():
+        return [fun(i) for i in items]
+
+    workers = min(workers or os.cpu_count() or 1, len(items))
+    if strategy == 'thread':
+        return list(imap_ordered(fun, items, strategy, workers))
+
+    if strategy == 'process':
+        try:
+            ctx = multiprocessing.get_context('fork')
+        except ValueError:
+            return [fun(i) for i in items]
+        try:
+            # serializzati qui, prima di eseguire qualsiasi task: gli errori sono solo
+            # di pickle (che per funzioni locali e lock solleva AttributeError e TypeError)
+            # e non possono essere confusi con un errore di fun
+            tasks = [pickle.dumps((fun, i)) for i in items]
+        except (pickle.PicklingError, AttributeError, TypeError):
+            return [fun(i) for i in items]
+        pool, temporary = _get_pool(ctx, workers)
+        try:
+            return pool.map(_run_pickled, tasks)
+        except multiprocessing.pool.MaybeEncodingError:
+            # risultati non serializzabili: nel processo principale non è cambiato niente, si ripete qui
+            return [fun(i) for i in items]
+        finally:
+            if temporary:
+                pool.terminate()
+
+    raise KeyError(f"Unknown execution strategy: {strategy}")
+
+
+def imap_ordered(fun, items, strategy='serial', workers=None):
+    """
+    Come map_ordered ma restituisce un generatore: ogni risultato è prodotto
+    appena sono pronti lui e quelli che lo precedono in items.
+    Con serial fun è chiamata solo quando si chiede il risultato successivo,
+    process non è incrementale (i risultati arrivano tutti insieme)
+    """
+    items = list(items)
+    if strategy == 'serial' or len(items) < 2 or in_worker():
+        for i in items:
+            yield fun(i)
+        return
+    if strategy != 'thread':
+        yield from map_ordered(fun, items, strategy, workers)
+        return
+
+    workers = min(workers or os.cpu_count() or 1, len(items))
+    with ThreadPoolExecutor(workers) as ex:
+        futures = [ex.submit(contextvars.copy_context().run, _run_in_thread, fun, i) for i in items]
+        try:
+            for f in futures:
+                yield f.result()
+        finally:
+            for f in futures:
+                f.cancel()
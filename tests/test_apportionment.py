@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from src.Commons.apportionment import apportion, dhondt, droop, hare, hare_intero, imperiali, \
+    largest_remainder, sainte_lague, sainte_lague_modificato
+
+
+def test_hare():
+    votes = [47000, 16000, 15800, 12000, 6100, 3100]
+    assert hare(votes, 10).tolist() == [5, 2, 1, 1, 1, 0]
+
+
+def test_dhondt():
+    assert dhondt([100000, 80000, 30000, 20000], 8).tolist() == [4, 3, 1, 0]
+
+
+def test_sainte_lague():
+    assert sainte_lague([100000, 80000, 30000, 20000], 8).tolist() == [3, 3, 1, 1]
+
+
+def test_sainte_lague_modificato():
+    # il primo divisore 1.4 penalizza il partito piccolo rispetto a sainte_lague
+    assert sainte_lague([10, 4], 2).tolist() == [1, 1]
+    assert sainte_lague_modificato([10, 4], 2).tolist() == [2, 0]
+
+
+def test_droop_imperiali():
+    assert droop([50, 30, 20], 3).tolist() == [2, 1, 0]
+    assert imperiali([50, 30, 20], 3).tolist() == [2, 1, 0]
+
+
+def test_batch_equals_single():
+    rng = np.random.default_rng(0)
+    votes = rng.integers(0, 10000, size=(20, 6))
+    seats = rng.integers(1, 30, size=20)
+    for method in ('hare', 'hare_intero', 'droop', 'imperiali', 'dhondt', 'sainte_lague'):
+        batch = apportion(votes, seats, method)
+        assert (batch.sum(axis=1) == seats).all()
+        for i in range(len(votes)):
+            assert batch[i].tolist() == apportion(votes[i], seats[i], method).tolist()
+
+
+def test_ties_go_to_more_votes_then_lower_index():
+    # stesso resto: vince chi ha più voti, poi l'indice minore
+    assert hare([10, 10, 10], 2).tolist() == [1, 1, 0]
+    assert hare([15, 25, 5], 2).tolist() == [1, 1, 0]
+
+
+def test_no_votes_no_seats():
+    assert hare([[0, 0], [3, 1]], [5, 4]).tolist() == [[0, 0], [3, 1]]
+
+
+def test_hare_intero_excess_seats():
+    # quoziente intero 31 // 22 = 1: 31 quozienti pieni per 22 seggi,
+    # i 9 in eccesso sono tolti a giro, il partito da 8 voti per primo
+    assert hare_intero([23, 8], 22).tolist() == [19, 3]
+    assert hare_intero([8, 23], 22).tolist() == [3, 19]
+
+
+def test_hare_intero():
+    # quoziente 105 // 10 = 10: quozienti pieni 4 + 3 + 3 = 10
+    assert hare_intero([41, 33, 31, 0], 10).tolist() == [4, 3, 3, 0]
+    # quoziente 29 // 9 = 3: quozienti pieni 3 + 3 + 2 = 8, resti 2, 1, 2:
+    # il seggio rimanente va a parità di resto a chi ha più voti
+    assert hare_intero([11, 10, 8], 9).tolist() == [4, 3, 2]
+
+
+def test_hare_intero_excess_smallest_remainder_first():
+    # quoziente 23 // 10 = 2: quozienti pieni 6 + 3 + 2 = 11 per 10 seggi, resti 0, 1, 0:
+    # il seggio in eccesso è tolto a chi ha il resto minore, a parità a chi ha meno voti
+    assert hare_intero([12, 7, 4], 10).tolist() == [6, 3, 1]
+
+
+def test_unknown_method():
+    with pytest.raises(KeyError):
+        apportion([1, 2], 1, 'nessuno')
+    with pytest.raises(KeyError):
+        largest_remainder([1, 2], 1, 'nessuno')
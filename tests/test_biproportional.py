@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.Commons.biproportional import biproportional, correct_biproportional
+
+
+def test_margins():
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        votes = rng.integers(0, 50000, size=(6, 5))
+        rows = rng.integers(1, 15, size=6)
+        total = rows.sum()
+        cols = np.bincount(rng.integers(0, 5, size=total), minlength=5)
+        cols[votes.sum(axis=0) == 0] = 0
+        cols[0] += total - cols.sum()
+        seats = biproportional(votes, rows, cols)
+        assert (seats.sum(axis=1) == rows).all()
+        assert (seats.sum(axis=0) == cols).all()
+        assert (seats[votes == 0] == 0).all()
+
+
+def test_proportional_matrix():
+    # voti già proporzionali ai seggi: la soluzione è la matrice stessa
+    seats = np.array([[3, 1, 2], [1, 4, 0], [2, 2, 5]])
+    res = biproportional(seats * 1000, seats.sum(axis=1), seats.sum(axis=0))
+    assert res.tolist() == seats.tolist()
+
+
+def test_rounding():
+    votes = [[10, 20], [30, 40]]
+    assert biproportional(votes, [3, 7], [4, 6]).tolist() == [[1, 2], [3, 4]]
+    assert biproportional(votes, [3, 7], [4, 6], rounding='down').sum() == 10
+
+
+def test_margins_must_agree():
+    with pytest.raises(ValueError):
+        biproportional([[1, 2], [3, 4]], [1, 1], [1, 2])
+
+
+def test_correct_biproportional():
+    voti = pd.DataFrame({'Distretto': ['A', 'A', 'B', 'B'],
+                         'Partito': ['X', 'Y', 'X', 'Y'],
+                         'Voti': [600, 400, 200, 800]})
+    ideale = pd.DataFrame({'Partito': ['X', 'Y'], 'Seggi': [4, 6]})
+    raccolta = {'A': pd.DataFrame({'Partito': ['X', 'Y'], 'Seggi': [3, 2]}),
+                'B': pd.DataFrame({'Partito': ['X', 'Y'], 'Seggi': [1, 4]})}
+    ret, _, _ = correct_biproportional(None, ideale, raccolta, {}, voti=voti, colonna_distretto='Distretto')
+    seggi = {d: dict(zip(df['Partito'], df['Seggi'])) for d, df in ret.items()}
+    assert sum(v.get('X', 0) for v in seggi.values()) == 4
+    assert sum(v.get('Y', 0) for v in seggi.values()) == 6
+    assert sum(seggi['A'].values()) == 5 and sum(seggi['B'].values()) == 5
@@ -0,0 +1,57 @@
+import contextvars
+
+import pytest
+
+from src import GlobalVars
+from src.Metaclasses.candidate import candidate
+
+
+def scenario(criteria, order):
+    """
+    Tre lanes offrono seggi ai candidati A, B, C nell'ordine order; le offerte
+    ad A sono a pari merito, quella rifiutata passa al candidato successivo
+    della lista. Restituisce gli eletti nell'ordine di risoluzione
+    """
+    hub = GlobalVars.ActHub()
+    GlobalVars.current_hub.set(hub)
+
+    class Candidato(metaclass=candidate, candidate={'criteria': criteria, 'info_vars': []}):
+        def __init__(self, name):
+            self.name = name
+
+    cands = {n: Candidato(n) for n in 'ABC'}
+    hub.get_instance = lambda kind, name: cands[name]
+    offers = {
+        'L1': ('D1', 'P1', ['A', 'B', 'C'], {'rank': 1}),
+        'L2': ('D2', 'P2', ['A', 'C', 'B'], {'rank': 1}),
+        'L3': ('D3', 'P3', ['B'], {'rank': 0}),
+        'L4': ('D4', 'P4', ['B', 'C'], {'rank': 2}),
+    }
+    for lane in order:
+        district, party, lista, info = offers[lane]
+        it = iter([cands[n] for n in lista])
+        next(it).propose(lane, district, party, it, **info)
+
+    hub.resolve_candidates([])
+    return [(name, info['lane']) for name, info in hub.elected.items()]
+
+
+@pytest.mark.parametrize('criteria', ['first', ['rank']])
+def test_tied_offers(criteria):
+    # la proposta più vecchia è valutata per prima, a pari merito A accetta la prima ricevuta
+    # e quella rifiutata passa a C con un nuovo numero, valutato dopo le offerte già in coda
+    res = contextvars.Context().run(scenario, criteria, ['L1', 'L2', 'L3'])
+    assert res == [('A', 'L1'), ('B', 'L3'), ('C', 'L2')]
+    # l'esito dipende solo dall'ordine delle offerte
+    assert contextvars.Context().run(scenario, criteria, ['L1', 'L2', 'L3']) == res
+    assert contextvars.Context().run(scenario, criteria, ['L2', 'L1', 'L3']) == \
+        [('A', 'L2'), ('B', 'L3'), ('C', 'L1')]
+
+
+@pytest.mark.parametrize('criteria, atteso', [
+    ('first', [('B', 'L4')]),
+    # con criteria una lista vince l'offerta minore anche se arrivata dopo, la rifiutata passa a C
+    (['rank'], [('B', 'L3'), ('C', 'L4')]),
+])
+def test_criteria_before_arrival(criteria, atteso):
+    assert contextvars.Context().run(scenario, criteria, ['L4', 'L3']) == atteso
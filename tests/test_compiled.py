@@ -0,0 +1,64 @@
+import os
+import pickle
+import shutil
+
+import pytest
+
+from src import compiled
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def law(tmp_path):
+    # una copia della legge, per non toccare l'artefatto di quella nel repository
+    path = tmp_path / 'Europee'
+    shutil.copytree(os.path.join(ROOT, 'LeggiElettorali', 'Europee'), path,
+                    ignore=shutil.ignore_patterns(compiled.COMPILED_DIR, '__pycache__'))
+    return str(path)
+
+
+def artifact(law, content):
+    pth = compiled.artifact_path(law)
+    os.makedirs(os.path.dirname(pth), exist_ok=True)
+    with open(pth, 'wb') as f:
+        f.write(content)
+    return pth
+
+
+class Incompatible:
+    # come un dataframe salvato da un'altra versione di pandas: la ricostruzione fallisce
+    def __reduce__(self):
+        return int, ('not a number',)
+
+
+@pytest.mark.parametrize('content', [
+    b'',  # troncato
+    b'not a pickle',
+    pickle.dumps(['a', 'list']),  # non è un dizionario
+    pickle.dumps({'hash': 'of another law'}),
+    pickle.dumps({'hash': 'x'})[:-3],
+    # un oggetto di una classe che non esiste
+    b'\x80\x04\x95\x1a\x00\x00\x00\x00\x00\x00\x00\x8c\x08missing_\x94\x8c\x05Thing\x94\x93\x94)\x81\x94.',
+    pickle.dumps({'hash': 'x', 'data': Incompatible()}),
+], ids=['empty', 'garbage', 'list', 'foreign', 'truncated', 'unknown-class', 'incompatible'])
+def test_bad_artifact_is_rebuilt(law, content):
+    pth = artifact(law, content)
+    res = compiled.load_compiled(law)
+    assert res['hash'] == compiled.law_hash(law)
+    assert ('Regione', 'voti_liste') in res['data']
+    with open(pth, 'rb') as f:
+        assert pickle.load(f)['hash'] == res['hash']
+
+
+def test_artifact_is_reused(law):
+    first = compiled.load_compiled(law)
+    mtime = os.path.getmtime(compiled.artifact_path(law))
+    assert compiled.load_compiled(law)['hash'] == first['hash']
+    assert os.path.getmtime(compiled.artifact_path(law)) == mtime
+
+
+def test_hash_depends_on_libraries(law, monkeypatch):
+    h = compiled.law_hash(law)
+    monkeypatch.setattr(compiled.pd, '__version__', '0.0.0')
+    assert compiled.law_hash(law) != h
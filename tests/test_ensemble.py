@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+
+from src import ensemble
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LEGGI = ['Porcellum', 'Mattarellum', 'Europee', 'Binomiale']
+
+
+def perturbed(legge, **noise):
+    ens = ensemble.Ensemble(os.path.join('LeggiElettorali', legge))
+    return ens, ensemble.perturb(ens.tables, np.random.default_rng(0), ens.parties, ens.groups, **noise)
+
+
+def voti(df, party):
+    cols = ensemble.vote_columns(df)
+    return df[cols].sum(axis=1).groupby([df[df.columns[0]], party]).sum()
+
+
+@pytest.mark.parametrize('legge', LEGGI)
+@pytest.mark.parametrize('noise', [{'noise': 'dirichlet', 'concentration': 50.}, {'noise': 'swing', 'sigma': 0.05}])
+def test_every_table_is_perturbed(monkeypatch, legge, noise):
+    monkeypatch.chdir(ROOT)
+    ens, res = perturbed(legge, **noise)
+    for key, df in ens.tables.items():
+        cols = ensemble.vote_columns(df)
+        assert cols, key
+        # le righe con un partito e abbastanza voti cambiano (salvo un fattore per caso vicino a 1)
+        grandi = ens.parties[key].notna() & (df[cols].sum(axis=1) >= 1000)
+        assert grandi.any(), key
+        cambiate = (res[key][cols] != df[cols]).any(axis=1)
+        assert cambiate[grandi].mean() > 0.99, (key, df[grandi & ~cambiate].head())
+
+
+@pytest.mark.parametrize('legge', LEGGI)
+def test_totals_of_instances_are_kept(monkeypatch, legge):
+    monkeypatch.chdir(ROOT)
+    ens, res = perturbed(legge, noise='dirichlet', concentration=50.)
+    for key, df in ens.tables.items():
+        if ens.parties[key].isna().any():
+            continue
+        prima = voti(df, ens.parties[key]).groupby(level=0).sum()
+        dopo = voti(res[key], ens.parties[key]).groupby(level=0).sum()
+        righe = df.groupby(df.columns[0]).size()
+        # solo gli arrotondamenti, al più mezzo voto per riga
+        assert ((dopo - prima).abs() <= righe / 2).all(), key
+
+
+def test_porcellum_tables_stay_identical(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    ens, res = perturbed('Porcellum', noise='dirichlet', concentration=50.)
+    liste = res[('Regione', 'voti_liste')]
+    assert (liste['VOTI_LISTA'] != ens.tables[('Regione', 'voti_liste')]['VOTI_LISTA']).any()
+    for t in ('voti_coalizioni', 'voti_regionali'):
+        assert res[('Regione', t)]['VOTI_LISTA'].tolist() == liste['VOTI_LISTA'].tolist()
+
+
+def test_europee_preferences_follow_their_list(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    ens, res = perturbed('Europee', noise='dirichlet', concentration=50.)
+    liste, cand = ('Regione', 'voti_liste'), ('Regione', 'voti_cand')
+    f_liste = voti(res[liste], ens.parties[liste]) / voti(ens.tables[liste], ens.parties[liste])
+    prima = voti(ens.tables[cand], ens.parties[cand])
+    dopo = voti(res[cand], ens.parties[cand])
+    righe = ens.tables[cand].groupby([ens.tables[cand]['REGIONE'], ens.parties[cand]]).size()
+    assert (f_liste.reindex(prima.index) != 1).mean() > 0.99
+    # le preferenze della lista sono scalate dal fattore della lista, salvo arrotondamenti
+    assert ((dopo - prima * f_liste.reindex(prima.index)).abs() <= righe / 2 + 1e-6).all()
+
+
+def test_undeclared_tables_are_an_error(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    ens = ensemble.Ensemble(os.path.join('LeggiElettorali', 'Europee'))
+    istanze = ensemble.compiled.load_compiled(os.path.join('LeggiElettorali', 'Europee'))['instances']
+    with pytest.raises(KeyError):
+        ensemble.table_parties(ens.tables, {'Regione/voti_liste': 'LISTA'})
+    with pytest.raises(KeyError):
+        ensemble.table_parties(ens.tables, {'Regione/voti_liste': 'LISTA', 'Regione/voti_cand': 'LISTA'})
+    with pytest.raises(ValueError):
+        # senza ignore il segnaposto EMPTY non ha partito
+        ensemble.table_parties(ens.tables, {'Regione/voti_liste': 'LISTA',
+                                            'Regione/voti_cand': {'column': 'Candidato', 'instance': 'Candidato'}},
+                               istanze)
@@ -0,0 +1,41 @@
+import contextvars
+import os
+from types import SimpleNamespace
+
+import src
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeHub:
+    # un partito con i candidati restituiti in un ordine qualsiasi
+    def __init__(self, candidati):
+        self.partito = SimpleNamespace(name='LISTA')
+        self.candidati = candidati
+
+    def get_instances(self, kind):
+        return ['LISTA']
+
+    def get_instance(self, kind, name):
+        return self.partito
+
+    def get_political_subs(self, sup, sub_type, actual=False):
+        return tuple(self.candidati)
+
+
+def candidato(name, voti):
+    return SimpleNamespace(name=name, logs={'lista': {0: {'Circoscrizione': 'NORD', 'Voti': voti}}})
+
+
+def test_preference_ranking_ties(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    hub = contextvars.copy_context().run(src.load_law, os.path.join('LeggiElettorali', 'Europee'))
+    partito = hub.get_instance('Partito', hub.get_instances('Partito')[0])
+    preference_ranking = type(partito).elect.__globals__['preference_ranking']
+
+    candidati = [candidato('D', 5), candidato('C', 10), candidato('A', 10), candidato('B', 10), candidato('E', 1)]
+    attesa = ['E', 'D', 'A', 'B', 'C']
+    for ordine in (candidati, candidati[::-1], candidati[2:] + candidati[:2]):
+        ranking = preference_ranking(FakeHub(ordine))
+        # a parità di voti l'ordine è quello dei nomi, qualunque sia l'ordine dei sottostanti
+        assert [c.name for c in ranking[('LISTA', 'NORD')]] == attesa
@@ -0,0 +1,109 @@
+import multiprocessing
+
+import pytest
+
+from src import parallel
+
+
+def square(x):
+    return x * x
+
+
+def fail(x):
+    raise AttributeError(x)
+
+
+def test_map_ordered_strategies():
+    for strategy in parallel.STRATEGIE:
+        assert parallel.map_ordered(square, range(5), strategy, 2) == [0, 1, 4, 9, 16]
+
+
+def test_task_errors_are_not_swallowed():
+    # solo gli errori di pickle fanno ripetere le task in serie
+    with pytest.raises(AttributeError):
+        parallel.map_ordered(fail, range(3), 'process', 2)
+
+
+def test_unpicklable_function_runs_serially():
+    assert parallel.map_ordered(lambda x: x + 1, range(3), 'process', 2) == [1, 2, 3]
+
+
+def test_pool_reused_in_process_pool(monkeypatch):
+    created = []
+    ctx = multiprocessing.get_context('fork')
+    pool = type(ctx).Pool
+
+    def counting_pool(self, *args, **kwargs):
+        created.append(1)
+        return pool(self, *args, **kwargs)
+
+    monkeypatch.setattr(type(ctx), 'Pool', counting_pool)
+    with parallel.process_pool():
+        assert parallel.map_ordered(square, range(3), 'process', 2) == [0, 1, 4]
+        assert parallel.map_ordered(square, range(4), 'process', 2) == [0, 1, 4, 9]
+    assert len(created) == 1
+
+
+def test_lane_groups_serial_unless_concurrent():
+    from src.GlobalVars import ActHub
+    hub = ActHub()
+    hub.lane_footprint = lambda head: {(head, head)}
+    lanes = [('a', 'A'), ('b', 'B'), ('c', 'C'), ('d', 'A')]
+    assert hub.lane_groups(lanes) == [[0, 1, 2, 3]]
+    hub.concurrent_lanes = {'b', 'c', 'd'}
+    # d ha la stessa testa di a: stesso gruppo
+    assert hub.lane_groups(lanes) == [[0, 3], [1], [2]]
+
+
+def test_hub_shared_state_from_threads():
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    import pandas as pd
+    from src.GlobalVars import ActHub
+
+    hub = ActHub()
+    with ThreadPoolExecutor(8) as ex:
+        list(ex.map(hub.register_offer, [f'c{i}' for i in range(2000)]))
+    assert hub.offer_seq == 2000
+    assert sorted(seq for seq, _ in hub.offers) == list(range(2000))
+
+    builds = []
+
+    def build(h):
+        builds.append(1)
+        time.sleep(0.05)
+        return len(builds)
+
+    with ThreadPoolExecutor(8) as ex:
+        assert set(ex.map(lambda _: hub.get_kernel('k', build), range(8))) == {1}
+    assert len(builds) == 1
+
+    # le righe date con give_* sono viste da tutte le lanes, non solo da quella che toglie gli aggiornamenti
+    hub.get_synonyms = lambda classe: (classe,)
+    hub.set_tables({('Collegio', 'voti'): pd.DataFrame({'Collegio': ['A', 'B'], 'Voti': [1, 2]})})
+    hub.update_table(type('Collegio', (), {'name': 'A', 'type': 'Collegio'})(), 'voti', pd.DataFrame({'Voti': [10]}))
+    with ThreadPoolExecutor(8) as ex:
+        tables = list(ex.map(lambda _: hub.get_table('Collegio', 'voti'), range(8)))
+    assert all(sorted(t['Voti']) == [2, 10] for t in tables)
+
+
+def test_hub_must_be_bound():
+    import contextvars
+
+    import src.GlobalVars as gv
+
+    def unbound():
+        gv.current_hub.set(None)
+        with pytest.raises(RuntimeError, match='No Hub'):
+            gv.Hub.data_version
+
+        # ogni contesto ha il suo Hub, non uno condiviso
+        hub = gv.ActHub()
+        gv.current_hub.set(hub)
+        assert gv.Hub.data_version == hub.data_version
+        return hub
+
+    a = contextvars.Context().run(unbound)
+    b = contextvars.Context().run(unbound)
+    assert a is not b
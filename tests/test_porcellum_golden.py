@@ -0,0 +1,45 @@
+import json
+import os
+import sys
+
+import src
+import src.GlobalVars
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_porcellum_2013(monkeypatch, capsys):
+    # seggi per circoscrizione e lista sui dati 2013 inclusi nel repository,
+    # confrontati con l'esito della versione precedente al calcolo matriciale
+    # di correct_porcellum e dividi_per_partiti
+    monkeypatch.chdir(ROOT)
+    risultato = src.run_simulation('LeggiElettorali/Porcellum', visuals=False)
+    capsys.readouterr()
+    with open(os.path.join(ROOT, 'tests', 'data', 'porcellum_2013.json'), encoding='utf-8') as f:
+        atteso = json.load(f)
+    assert sorted(map(list, risultato)) == sorted(atteso)
+    assert sum(r[3] for r in risultato) == 630
+
+
+def test_porcellum_filter_matches_filter_batch(monkeypatch, capsys):
+    # per ogni sbarramento applicato nella simulazione filter, riga per riga,
+    # dà la stessa maschera di filter_batch
+    monkeypatch.chdir(ROOT)
+    totals = sys.modules['src.Metaclasses.totals']
+    filter_mask = totals.filter_mask
+    checked = []
+
+    def check(district, total, res, sbarramenti):
+        mask = filter_mask(district, total, res, sbarramenti)
+        hub = src.GlobalVars.Hub
+        rows = [hub.get_instance('PolEnt', r.iloc[0]).filter(district, total=total, row=r, dataframe=res,
+                                                              sbarramenti=sbarramenti)
+                for _, r in res.iterrows()]
+        assert rows == mask.tolist(), (district.name, total, sbarramenti)
+        checked.append(sum(rows) < len(rows))
+        return mask
+
+    monkeypatch.setattr(totals, 'filter_mask', check)
+    src.run_simulation('LeggiElettorali/Porcellum', visuals=False)
+    capsys.readouterr()
+    assert any(checked)
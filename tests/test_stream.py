@@ -0,0 +1,31 @@
+import contextvars
+import os
+
+import src
+from src import GlobalVars
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_interleaved_streams(monkeypatch, capsys):
+    # ogni passo vede l'Hub del proprio generatore, anche se chi lo riprende
+    # nel frattempo ha caricato un'altra legge o gira in un altro contesto
+    monkeypatch.chdir(ROOT)
+    attesi = {law: src.seats_list(src.run_simulation(f'LeggiElettorali/{law}', visuals=False))
+              for law in ('Porcellum', 'Europee')}
+    streams = {law: src.stream_simulation(f'LeggiElettorali/{law}') for law in attesi}
+    records = {law: [] for law in attesi}
+    for law, stream in streams.items():
+        records[law].append(next(stream))
+    # l'ultimo caricamento ha impostato il suo Hub nel contesto corrente
+    assert GlobalVars.Hub.lanes is not None
+    attivi = dict(streams)
+    while attivi:
+        for law in list(attivi):
+            try:
+                records[law].append(contextvars.Context().run(next, attivi[law]))
+            except StopIteration:
+                del attivi[law]
+    capsys.readouterr()
+    for law, recs in records.items():
+        assert [(d, l, e, int(s)) for d, l, e, s in recs] == attesi[law]
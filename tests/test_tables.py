@@ -0,0 +1,77 @@
+import os
+
+import src
+from src import Commons, GlobalVars
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_give_updates_kernels(monkeypatch, capsys):
+    # give_* fuori da give_data: i kernel sono ricalcolati sui nuovi dati
+    monkeypatch.chdir(ROOT)
+    src.run_simulation('LeggiElettorali/Mattarellum', visuals=False)
+    capsys.readouterr()
+    hub = GlobalVars.Hub
+    righe = len(hub.get_table('Collegio', 'voti_uninominale'))
+    assert Commons.vincenti_tabella_mattarellum(hub).loc['10 - CHIVASSO', 'Vincitore'] == 'CHIANALE MAURO'
+
+    collegio = hub.get_instance('Collegio', '10 - CHIVASSO')
+    voti = collegio.voti_uninominale.copy()
+    voti.loc[voti['Candidato'] == 'CORAL NEVIO', 'Voti'] = 40000
+    collegio.give_voti_uninominale(voti)
+
+    vincenti = Commons.vincenti_tabella_mattarellum(hub)
+    assert vincenti.loc['10 - CHIVASSO', 'Vincitore'] == 'CORAL NEVIO'
+    assert len(hub.get_table('Collegio', 'voti_uninominale')) == righe
+    cifre = Commons.cifre_mattarellum(hub)
+    assert cifre['scorporo'].sum() > 0
+
+
+def test_totals_follow_the_data(monkeypatch, capsys):
+    # i totals memorizzati non sopravvivono a un cambio dei dati
+    monkeypatch.chdir(ROOT)
+    src.run_simulation('LeggiElettorali/Porcellum', visuals=False)
+    capsys.readouterr()
+    hub = GlobalVars.Hub
+    naz = hub.get_instance('Nazione', hub.get_instances('Nazione')[0])
+
+    def voti_pd():
+        liste = naz.totals('liste')
+        return liste.loc[liste['Partito'] == 'PARTITO DEMOCRATICO', 'Voti'].sum()
+
+    prima = voti_pd()
+    assert voti_pd() == prima
+    regione = hub.get_instance('Regione', 'PIEMONTE 1')
+    voti = regione.voti_liste.copy()
+    voti.loc[voti['LISTA'] == 'PARTITO DEMOCRATICO', 'VOTI_LISTA'] += 1000
+    versione = hub.data_version
+    regione.give_voti_liste(voti)
+    assert hub.data_version > versione
+    assert voti_pd() == prima + 1000
+
+
+def test_kernel_totals_follow_the_tables(monkeypatch, capsys):
+    # i totals calcolati dai kernel sulle tabelle: update_table (give_*) e set_tables
+    monkeypatch.chdir(ROOT)
+    src.run_simulation('LeggiElettorali/Mattarellum', visuals=False)
+    capsys.readouterr()
+    hub = GlobalVars.Hub
+    naz = hub.get_instance('Nazione', hub.get_instances('Nazione')[0])
+
+    def voti_fi():
+        res = naz.totals('aggrega_risultati_circoscrizioni')
+        return res.loc[res['Partito'] == 'FORZA ITALIA', 'Voti'].sum()
+
+    prima = voti_fi()
+    circ = hub.get_instance('Circoscrizione', 'PIEMONTE 1')
+    voti = circ.voti_plurinominale.copy()
+    voti.loc[voti['Partito'] == 'FORZA ITALIA', 'Voti'] += 1000
+    circ.give_voti_plurinominale(voti)
+    assert voti_fi() == prima + 1000
+
+    tabelle = dict(hub.tables)
+    df = hub.get_table('Circoscrizione', 'voti_plurinominale').copy()
+    df.loc[df['Partito'] == 'FORZA ITALIA', 'Voti'] += 10
+    tabelle[('Circoscrizione', 'voti_plurinominale')] = df
+    hub.set_tables(tabelle)
+    assert voti_fi() == prima + 1000 + 10 * (df['Partito'] == 'FORZA ITALIA').sum()
@@ -0,0 +1,229 @@
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import src.GlobalVars
+from src.Metaclasses.totFilter import totFilter
+
+
+class FakeHub:
+    # quello che i filtri chiedono all'Hub: istanze, sottostanti e distretti superiori
+    def __init__(self, instances=(), subs=None, sup=None):
+        self.instances = {i.name: i for i in instances}
+        self.subs = subs or {}
+        self.sup = sup or {}
+        self.data_version = 0
+        self.sup_calls = 0
+
+    def get_instance(self, kind, name):
+        return self.instances[name]
+
+    def get_political_subs(self, inst, subs):
+        return self.subs[inst.name]
+
+    def get_superdivision(self, district, kind):
+        self.sup_calls += 1
+        return self.sup[district.name]
+
+
+@pytest.fixture
+def hub():
+    h = FakeHub()
+    token = src.GlobalVars.current_hub.set(h)
+    yield h
+    src.GlobalVars.current_hub.reset(token)
+
+
+def district(type, name='X'):
+    return SimpleNamespace(type=type, name=name)
+
+
+def make(name='P', **filters):
+    return totFilter(name, (), {}, filters=filters)
+
+
+def mask(cls, df, sbarramento, d=None, total='liste'):
+    return cls.filter_batch(d or district('Nazione'), total=total, dataframe=df,
+                            sbarramenti=[sbarramento]).tolist()
+
+
+VOTI = pd.DataFrame({'Partito': ['A', 'B', 'C', 'D'],
+                     'Coalizione': ['X', 'X', 'NO COALIZIONE', 'Y'],
+                     'Regione': ['R1', 'R1', 'R2', 'R2'],
+                     'Voti': [50, 5, 40, 5]})
+
+
+def test_value():
+    cls = make(abs={'column': 'Voti', 'criteria': 'ge', 'target': 40},
+               rel={'column': 'Voti', 'logic': 'relative', 'target': 0.1},
+               grp={'column': 'Voti', 'group': ['Coalizione'], 'logic': 'relative', 'target': 0.5},
+               reg={'column': 'Voti', 'logic': 'relative', 'relative_to': ['Regione'], 'target': 0.5},
+               size={'column': 'Voti', 'group': 'Regione', 'aggregate': 'size', 'criteria': 'eq', 'target': 2})
+    assert mask(cls, VOTI, 'abs') == [True, False, True, False]
+    assert mask(cls, VOTI, 'rel') == [True, False, True, False]
+    assert mask(cls, VOTI, 'grp') == [True, True, False, False]
+    assert mask(cls, VOTI, 'reg') == [True, False, True, False]
+    assert mask(cls, VOTI, 'size') == [True] * 4
+
+
+def test_value_source():
+    altri = pd.DataFrame({'Partito': ['A', 'C', 'C'], 'Voti': [1, 10, 10]})
+    cls = make(src={'source': lambda locs: altri, 'column': 'Voti', 'group': 'Partito', 'target': 15})
+    # D non è in source, B nemmeno: non passano
+    assert mask(cls, VOTI, 'src') == [False, False, True, False]
+
+
+def test_membership():
+    cls = make(col={'type': 'membership', 'column': 'Coalizione', 'values': ['X']},
+               nome={'type': 'membership', 'values': ['A', 'D']},
+               src={'type': 'membership', 'source': lambda locs: [SimpleNamespace(name='B')]})
+    assert mask(cls, VOTI, 'col') == [True, True, False, False]
+    assert mask(cls, VOTI, 'nome') == [True, False, False, True]
+    assert mask(cls, VOTI, 'src') == [False, True, False, False]
+
+
+def test_predicates_and_references():
+    grande = {'column': 'Voti', 'criteria': 'gt', 'target': 10}
+    cls = make(grande=grande,
+               coalizzato={'not': {'type': 'membership', 'column': 'Coalizione', 'values': ['NO COALIZIONE']}},
+               e={'and': ['grande', 'coalizzato']},
+               o={'or': ['grande', {'type': 'membership', 'values': ['D']}]},
+               n={'not': 'e'})
+    assert mask(cls, VOTI, 'coalizzato') == [True, True, False, True]
+    assert mask(cls, VOTI, 'e') == [True, False, False, False]
+    assert mask(cls, VOTI, 'o') == [True, False, True, True]
+    assert mask(cls, VOTI, 'n') == [False, True, True, True]
+    # più sbarramenti devono essere superati tutti, quelli sconosciuti sono ignorati
+    assert cls.filter_batch(district('Nazione'), total='liste', dataframe=VOTI,
+                            sbarramenti=['grande', 'coalizzato', 'altro']).tolist() == [True, False, False, False]
+
+
+def test_levels_and_totals():
+    cls = make(s={'levels': ['Nazione'], 'totals': ['liste'], 'column': 'Voti', 'target': 10})
+    assert mask(cls, VOTI, 's') == [True, False, True, False]
+    assert mask(cls, VOTI, 's', d=district('Regione')) == [True] * 4
+    assert mask(cls, VOTI, 's', total='coalizioni') == [True] * 4
+
+
+def test_rebase(hub):
+    sup = district('Regione', 'R')
+    hub.instances['R'] = sup
+    hub.sup = {'C1': 'R', 'C2': 'R'}
+    seen = []
+
+    def source(locs):
+        seen.append(locs['self'].name)
+        return VOTI
+
+    cls = make(s={'levels': ['Circoscrizione'], 'rebase': 'Regione', 'source': source,
+                  'column': 'Voti', 'target': 10})
+    assert mask(cls, VOTI, 's', d=district('Circoscrizione', 'C1')) == [True, False, True, False]
+    mask(cls, VOTI, 's', d=district('Circoscrizione', 'C1'))
+    mask(cls, VOTI, 's', d=district('Circoscrizione', 'C2'))
+    # levels si riferisce al distretto prima del rebase
+    assert mask(cls, VOTI, 's', d=district('Regione', 'R')) == [True] * 4
+    # valutato nella regione, il distretto superiore è cercato una volta per distretto
+    assert seen == ['R', 'R', 'R']
+    assert hub.sup_calls == 2
+
+
+def test_memoizable(hub):
+    calls = []
+
+    def source(locs):
+        calls.append(1)
+        return VOTI
+
+    cls = make(s={'memoizable': True, 'source': source, 'column': 'Voti', 'target': 10})
+    assert mask(cls, VOTI, 's') == [True, False, True, False]
+    assert mask(cls, VOTI, 's') == [True, False, True, False]
+    assert len(calls) == 1
+    # una PolEnt nuova è calcolata, quelle già viste no
+    assert mask(cls, pd.DataFrame({'Partito': ['E'], 'Voti': [1]}), 's') == [False]
+    assert len(calls) == 2
+    hub.data_version += 1
+    mask(cls, VOTI, 's')
+    assert len(calls) == 3
+
+
+def coalitions(hub):
+    Coalizione = make('Coalizione', soglia={'column': 'Voti', 'target': 30})
+    Partito = make('Partito',
+                   coalizione={'type': 'delegate', 'variable': 'coalition', 'sbarramento': 'soglia'},
+                   grande={'column': 'Voti', 'target': 10})
+    x, y = Coalizione(), Coalizione()
+    x.name, y.name = 'X', 'Y'
+    hub.instances.update({'X': x, 'Y': y})
+    for p, c in zip('ABCD', [x, x, y, y]):
+        i = Partito()
+        i.name, i.coalition = p, c
+        hub.instances[p] = i
+    hub.subs = {'X': ['A', 'B'], 'Y': ['C', 'D']}
+    return Coalizione, Partito
+
+
+def test_delegate(hub):
+    Coalizione, Partito = coalitions(hub)
+    df = pd.DataFrame({'Partito': list('ABCD'), 'Voti': [50, 5, 20, 40]})
+    # la soglia di Coalizione è valutata sulla riga del partito con il nome della coalizione
+    assert mask(Partito, df, 'coalizione') == [True, False, False, True]
+
+
+def test_map(hub):
+    Coalizione, Partito = coalitions(hub)
+    partiti = pd.DataFrame({'Partito': list('ABCD'), 'Voti': [50, 5, 20, 40]})
+    cls = make('Coalizione',
+               any={'type': 'map', 'subs': 'Partito', 'sbarramento': 'grande', 'source': lambda locs: partiti},
+               all={'type': 'map', 'subs': 'Partito', 'sbarramento': 'grande', 'how': 'all',
+                    'source': lambda locs: partiti},
+               one={'type': 'map', 'subs': 'Partito', 'sbarramento': 'grande', 'how': 'exactly', 'count': 1,
+                    'source': lambda locs: partiti})
+    df = pd.DataFrame({'Coalizione': ['X', 'Y'], 'Voti': [55, 60]})
+    assert mask(cls, df, 'any') == [True, True]
+    assert mask(cls, df, 'all') == [False, True]
+    assert mask(cls, df, 'one') == [True, False]
+
+
+
+def test_filter_matches_filter_batch(hub):
+    calls = []
+
+    def source(locs):
+        calls.append(1)
+        return VOTI
+
+    cls = make(e={'or': [{'source': source, 'column': 'Voti', 'group': 'Partito', 'logic': 'relative',
+                          'target': 0.3},
+                         {'type': 'membership', 'column': 'Coalizione', 'values': ['Y']}]})
+    batch = mask(cls, VOTI, 'e')
+    p = cls()
+    rows = [p.filter(district('Nazione'), total='liste', row=r, dataframe=VOTI, sbarramenti=['e'])
+            for _, r in VOTI.iterrows()]
+    assert rows == batch == [True, False, True, True]
+    # la maschera è calcolata una volta per filter_batch e una per tutte le righe
+    assert len(calls) == 2
+    hub.data_version += 1
+    p.filter(district('Nazione'), total='liste', row=VOTI.iloc[0], dataframe=VOTI, sbarramenti=['e'])
+    p.filter(district('Regione'), total='liste', row=VOTI.iloc[0], dataframe=VOTI, sbarramenti=['e'])
+    p.filter(district('Regione'), total='liste', row=VOTI.iloc[0], dataframe=VOTI.copy(), sbarramenti=['e'])
+    assert len(calls) == 5
+
+
+def test_reset_run_clears_memo(hub):
+    calls = []
+
+    def source(locs):
+        calls.append(1)
+        return VOTI
+
+    cls = make(s={'memoizable': True, 'source': source, 'column': 'Voti', 'target': 10})
+    p = cls()
+    p.filter(district('Nazione'), total='liste', row=VOTI.iloc[0], dataframe=VOTI, sbarramenti=['s'])
+    mask(cls, VOTI, 's')
+    assert len(calls) == 1
+    # stessa data_version, ma dopo reset_run i valori sono ricalcolati
+    p.reset_run()
+    mask(cls, VOTI, 's')
+    p.filter(district('Nazione'), total='liste', row=VOTI.iloc[0], dataframe=VOTI, sbarramenti=['s'])
+    assert len(calls) == 2